@@ -1,9 +1,11 @@
 from flask import Flask, request, jsonify
 import logging
 import requests
-from tmdb_services import get_tmdb_id, get_imdb_id, get_tvdb_id, get_movie_details, get_tv_details
-from imdbmovies import IMDB
+from tmdb_services import get_tmdb_id, get_tvdb_id, get_movie_details, get_tv_details, get_recommendations
+from tmdb_services import get_imdb_id as tmdb_get_imdb_id, find_by_imdb_id
 import os   
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(
     level=logging.DEBUG,  # Change to DEBUG for more verbose logs
@@ -12,7 +14,22 @@ logging.basicConfig(
 )
 
 app = Flask(__name__)
-imdb = IMDB()
+
+# /validate_ids looks IDs up concurrently and caps the batch size
+VALIDATE_WORKERS = int(os.environ.get("VALIDATE_WORKERS", "8"))
+VALIDATE_MAX_IDS = int(os.environ.get("VALIDATE_MAX_IDS", "100"))
+
+# imdbmovies is only needed for the title-search fallback, so its client is built on first use
+_imdb = None
+_imdb_lock = threading.Lock()
+
+def get_imdb_client():
+    global _imdb
+    with _imdb_lock:
+        if _imdb is None:
+            from imdbmovies import IMDB
+            _imdb = IMDB()
+        return _imdb
 
 def extract_guid_id(guid_id, prefix):
     """Extract ID from guid with given prefix"""
@@ -23,7 +40,7 @@ def extract_guid_id(guid_id, prefix):
 def get_imdb_from_title(title, media_type):
     """Search IMDB by title"""
     try:
-        result = imdb.get_by_name(title, tv=(media_type in ['show', 'episode']))
+        result = get_imdb_client().get_by_name(title, tv=(media_type in ['show', 'episode']))
         if result and 'url' in result:
             return result['url'].split("https://www.imdb.com/title/")[1].split("/")[0]
     except Exception as e:
@@ -125,7 +142,7 @@ def convert_ids():
             # Get other IDs if needed
             if not imdb_id:
                 try:
-                    imdb_id = get_imdb_id(tmdb_id, media_type)
+                    imdb_id = tmdb_get_imdb_id(tmdb_id, media_type)
                     result['imdb_id'] = imdb_id
                     logging.info(f"Converted tmdb_id {tmdb_id} to imdb_id {imdb_id}")
                 except Exception as e:
@@ -161,10 +178,67 @@ def convert_ids():
         logging.error(f"Unhandled exception in convert_ids: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/tmdb_recommendations', methods=['POST'])
+def tmdb_recommendations():
+    """Return TMDb's recommendations for one title in a compact, type-tagged form."""
+    data = request.json or {}
+    tmdb_id = data.get('tmdb_id')
+    media_type = 'tv' if data.get('media_type') == 'tv' else 'movie'
+    limit = int(data.get('limit', 20))
+    if not tmdb_id:
+        return jsonify({"error": "tmdb_id is required"}), 400
+
+    results = []
+    for item in get_recommendations(tmdb_id, media_type, limit):
+        results.append({
+            'tmdb_id': item.get('id'),
+            'media_type': item.get('media_type') or media_type,
+            'title': item.get('title') or item.get('name'),
+            'overview': item.get('overview', ''),
+            'genre_ids': item.get('genre_ids', []),
+            'poster_path': item.get('poster_path'),
+            'release_date': item.get('release_date') or item.get('first_air_date'),
+            'vote_average': item.get('vote_average', 0),
+            'popularity': item.get('popularity', 0)
+        })
+    logging.info(f"Returning {len(results)} TMDb recommendations for {media_type} {tmdb_id}")
+    return jsonify({"tmdb_id": tmdb_id, "media_type": media_type, "results": results})
+
+@app.route('/validate_ids', methods=['POST'])
+def validate_ids():
+    """
+    Check a batch of IMDb IDs against TMDb in one request.
+    Each ID maps to {'valid': True, 'tmdb_id', 'media_type', 'title'} or {'valid': False};
+    IDs whose lookup failed are left out so the caller can treat them as unverified.
+    """
+    data = request.json or {}
+    imdb_ids = list(dict.fromkeys(i for i in data.get('imdb_ids', []) if isinstance(i, str) and i))
+    if len(imdb_ids) > VALIDATE_MAX_IDS:
+        return jsonify({"error": f"at most {VALIDATE_MAX_IDS} imdb_ids per request"}), 400
+
+    def lookup(imdb_id):
+        try:
+            return imdb_id, find_by_imdb_id(imdb_id), None
+        except Exception as e:
+            return imdb_id, None, e
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=VALIDATE_WORKERS) as executor:
+        for imdb_id, found, error in executor.map(lookup, imdb_ids):
+            if error is not None:
+                logging.error(f"Error validating IMDb ID {imdb_id}: {error}")
+            elif found:
+                results[imdb_id] = dict(found, valid=True)
+            else:
+                results[imdb_id] = {'valid': False}
+    logging.info(f"Validated {len(imdb_ids)} IMDb IDs, "
+                 f"{sum(1 for r in results.values() if r['valid'])} valid")
+    return jsonify({"results": results})
+
 def get_overseerr_id(title, media_type, tvdb_id=None):
     """
     Search Overseerr by title and get media ID.
-    Similar to what request_media_from_overseer does in watchlistrequests.
+    Similar to what resolve_overseerr_media does in watchlistrequests.
     """
     from urllib.parse import quote
     
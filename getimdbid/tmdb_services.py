@@ -39,6 +39,29 @@ def get_tmdb_id(imdb_id):
             print(f"Error fetching TMDB ID for IMDb ID {imdb_id}: {e}")
         return None
 
+def find_by_imdb_id(imdb_id):
+    """
+    Look an IMDb ID up on TMDb. Returns {'tmdb_id', 'media_type', 'title'} when it exists and
+    None when TMDb has no title for it; other request errors are raised to the caller.
+    """
+    url = f"https://api.themoviedb.org/3/find/{imdb_id}"
+    params = {
+        "api_key": TMDB_API_KEY,
+        "external_source": "imdb_id"
+    }
+    response = session.get(url, params=params, timeout=10)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+    if data.get('movie_results'):
+        item = data['movie_results'][0]
+        return {'tmdb_id': item['id'], 'media_type': 'movie', 'title': item.get('title')}
+    if data.get('tv_results'):
+        item = data['tv_results'][0]
+        return {'tmdb_id': item['id'], 'media_type': 'tv', 'title': item.get('name')}
+    return None
+
 def get_recommendations(tmdb_id, media_type, num_recommendations=200):
     url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}/recommendations"
     params = {
@@ -46,7 +69,11 @@ def get_recommendations(tmdb_id, media_type, num_recommendations=200):
         'language': 'en-US',
         'page': 1
     }
-    response = requests.get(url, params=params)
+    try:
+        response = session.get(url, params=params, timeout=10)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching recommendations for {media_type} {tmdb_id}: {e}")
+        return []
     if response.status_code == 200:
         recommendations = response.json().get('results', [])[:num_recommendations]
         return recommendations
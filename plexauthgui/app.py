@@ -1,10 +1,9 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 import requests
 import sqlite3
 import os
 from datetime import datetime
 from urllib.parse import urlencode
-from plexapi.myplex import MyPlexAccount
 import logging
 
 app = Flask(__name__)
@@ -206,6 +205,7 @@ def check_token(pin_id):
     r_json = r.json()
     auth_token = r_json.get("authToken")
     if (auth_token):
+        from plexapi.myplex import MyPlexAccount
         plex_account = MyPlexAccount(token=auth_token)
         user_id = plex_account.username
         
@@ -325,6 +325,52 @@ def search_ai():
         app.logger.error(f"AI Search: Unexpected error for user {user_id}: {e}")
         return jsonify({'error': 'An unexpected error occurred during AI search.', 'search_results': []}), 500
 
+@app.route('/search_ai/stream', methods=['POST'])
+def search_ai_stream():
+    """Relay recbyhistory's /ai_search/stream Server-Sent Events to the page as they arrive."""
+    data = request.json or {}
+    query = data.get('query')
+    user_id = data.get('user_id')
+    final_gemini_key = os.environ.get("GEMINI_API_KEY") or data.get('gemini_api_key')
+    final_tmdb_key = os.environ.get("TMDB_API_KEY") or data.get('tmdb_api_key')
+
+    if not query or not user_id:
+        app.logger.warning("AI Search Stream: Query or user_id missing from request.")
+        return jsonify({'search_results': []}), 200
+    if not final_gemini_key or not final_tmdb_key:
+        app.logger.error("AI Search Stream: API keys for Gemini or TMDB are missing from both environment and request.")
+        return jsonify({'error': 'API keys are not configured correctly. Please check server logs or provide them in the UI.', 'search_results': []}), 500
+
+    recbyhistory_url = os.environ.get("RECBYHISTORY_URL", "http://recbyhistory:5335")
+    stream_url = f"{recbyhistory_url}/ai_search/stream"
+    payload = {
+        'user_id': user_id,
+        'gemini_api_key': final_gemini_key,
+        'tmdb_api_key': final_tmdb_key,
+        'query': query
+    }
+    try:
+        # Connect timeout only bounds reaching recbyhistory; the read timeout applies between events
+        r = requests.post(stream_url, json=payload, stream=True, timeout=(5, 60))
+        r.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"AI Search Stream: Error calling {stream_url} for user {user_id}: {e}")
+        return jsonify({'error': f'Failed to connect to recommendation service: {e}', 'search_results': []}), 502
+
+    def relay():
+        try:
+            for chunk in r.iter_content(chunk_size=None):
+                if chunk:
+                    yield chunk
+        except requests.exceptions.RequestException as e:
+            app.logger.error(f"AI Search Stream: Stream from {stream_url} broke for user {user_id}: {e}")
+            yield 'event: error\ndata: {"error": "AI search stream interrupted."}\n\n'
+        finally:
+            r.close()
+
+    return Response(stream_with_context(relay()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/discovery', methods=['POST'])
 def discovery():
     """Calls recbyhistory's /discovery_recommendations."""
@@ -413,6 +459,17 @@ def discovery():
         app.logger.error(f"Discovery: Unexpected error for user {user_id}: {e}. Returning fallback.")
         return jsonify(fallback_recommendations)
 
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Relay a background job's status and result from recbyhistory."""
+    recbyhistory_url = os.environ.get("RECBYHISTORY_URL", "http://recbyhistory:5335")
+    try:
+        r = requests.get(f"{recbyhistory_url}/jobs/{job_id}/result", timeout=10)
+        return jsonify(r.json()), r.status_code
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Job Result: Error fetching job {job_id}: {e}")
+        return jsonify({'job_id': job_id, 'status': 'unknown', 'error': str(e)}), 502
+
 @app.route('/monthly_recs', methods=['GET'])
 def monthly_recs():
     """Get monthly recommendations from recbyhistory's /monthly_recommendations."""
@@ -421,6 +478,11 @@ def monthly_recs():
     monthly_url = f"{recbyhistory_url}/monthly_recommendations?user_id={user_id}"
     try:
         r = requests.get(monthly_url, timeout=30)  # Increased timeout
+
+        # Generation was queued in the background; the page polls /jobs/<job_id>/result
+        if r.status_code == 202:
+            app.logger.info(f"Monthly Recs: Generation queued for user {user_id}: {r.json().get('job_id')}")
+            return jsonify(r.json()), 202
         
         # Even if request fails, return fallback recommendations instead of 500 error
         if r.status_code != 200:
@@ -641,6 +703,7 @@ def connect():
             
             # using plexapi to retrieve some account info if needed
             app.logger.info(f"Connect: Account details requested for user_id: {user_id}. Admin status: {is_admin}")
+            from plexapi.myplex import MyPlexAccount
             account = MyPlexAccount(token=token)
             return jsonify({
                 'token': token,
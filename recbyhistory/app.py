@@ -1,6 +1,7 @@
 # recbyhistory/app.py
 
 import os
+import json
 import uvicorn
 import requests
 import logging
@@ -8,6 +9,7 @@ from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
@@ -17,11 +19,25 @@ from db import Database
 from get_history import PlexHistory
 from rec import (
     print_history_groups,
+    update_user_taste,
     generate_discovery_recommendations,
-    get_ai_search_results
+    get_cached_discovery,
+    get_ai_search_results,
+    stream_ai_search_results,
+    clean_json_output
 )
 from auth_client import PlexAuthClient
-from plexapi.myplex import MyPlexAccount
+from candidates import refresh_candidates, select_seeds, connect_cache, resolve_imdb_ids
+from search_index import build_index, search as search_catalog
+from config import SEARCH_PREFILTER_K
+from item_similarity import build_item_neighbors, get_also_watched
+import job_queue
+import llm_dispatch
+import task_registry
+from query_cache import search_cache
+from credentials import Credentials, remember as remember_credentials, for_user as credentials_for_user, tmdb_key
+from enrichment import update_recommendations_with_images
+from scheduler import UserScheduler
 
 # Configure logging
 logging.basicConfig(
@@ -45,6 +61,7 @@ class DiscoveryRequest(BaseModel):
     num_movies: int
     num_series: int
     extra_elements: str
+    background: bool = False
 
 class AISearchRequest(BaseModel):
     user_id: str
@@ -64,79 +81,72 @@ class WatchlistRequest(BaseModel):
     media_type: str  # e.g., "movie" or "series"
 
 # ----------------- Scheduled Task Functions -----------------
+def _history_task(user_id: str):
+    db = Database(user_id)
+    plex = PlexHistory(user_id)
+    plex.get_watch_history(db)  # בפנים מבוצעת כתיבה לטבלת watch_history
+    logging.info(f"History task executed for user {user_id}.")
+
+    # Precompute local recommendation candidates from the refreshed history
+    try:
+        refresh_candidates(db)
+    except Exception as e:
+        logging.error(f"Error refreshing candidates for user {user_id}: {e}")
+
 def run_history_task(user_id: str):
     """
     מריץ עדכון היסטוריית צפייה יומית למשתמש (כתיבה חדשה אם נמצאים פריטים isWatched).
     """
-    try:
-        db = Database(user_id)
-        plex = PlexHistory(user_id)
-        plex.get_watch_history(db)  # בפנים מבוצעת כתיבה לטבלת watch_history
-        logging.info(f"History task executed for user {user_id}.")
-    except Exception as e:
-        logging.error(f"Error in history task for user {user_id}: {e}")
+    return task_registry.run(user_id, "history", _history_task, user_id)
+
+def _taste_task(user_id: str):
+    db = Database(user_id)
+    
+    # Update taste from the history added since the last run (recommendations are monthly)
+    update_user_taste(db, credentials=credentials_for_user(user_id))
+    
+    # Now delete old taste records, keeping only the latest
+    cursor = db.conn.cursor()
+    latest_taste = cursor.execute(
+        'SELECT id FROM user_taste WHERE user_name = ? ORDER BY updated_at DESC LIMIT 1', 
+        (user_id,)
+    ).fetchone()
+    
+    if latest_taste:
+        # Delete all other tastes for this user
+        cursor.execute(
+            'DELETE FROM user_taste WHERE user_name = ? AND id != ?', 
+            (user_id, latest_taste[0])
+        )
+        db.conn.commit()
+        
+    logging.info(f"Taste task executed for user {user_id}, old taste records deleted.")
 
 def run_taste_task(user_id: str):
     """
     מריץ עדכון 'טעם' שבועי למשתמש.
     אינו כותב היסטוריה חדשה, רק מנתח הטבלה ומפיק taste.
     """
-    try:
-        db = Database(user_id)
-        
-        # Generate new taste
-        print_history_groups(db)
-        
-        # Now delete old taste records, keeping only the latest
-        cursor = db.conn.cursor()
-        latest_taste = cursor.execute(
-            'SELECT id FROM user_taste WHERE user_name = ? ORDER BY updated_at DESC LIMIT 1', 
-            (user_id,)
-        ).fetchone()
-        
-        if latest_taste:
-            # Delete all other tastes for this user
-            cursor.execute(
-                'DELETE FROM user_taste WHERE user_name = ? AND id != ?', 
-                (user_id, latest_taste[0])
-            )
-            db.conn.commit()
-            
-        logging.info(f"Taste task executed for user {user_id}, old taste records deleted.")
-    except Exception as e:
-        logging.error(f"Error in taste task for user {user_id}: {e}")
+    return task_registry.run(user_id, "taste", _taste_task, user_id)
+
+def _monthly_task(user_id: str):
+    db = Database(user_id)
+    
+    # Check if we already have recommendations and clear them first
+    cursor = db.conn.cursor()
+    cursor.execute('DELETE FROM ai_recommendations WHERE group_id="all"')
+    db.conn.commit()
+    
+    # Now generate new recommendations
+    print_history_groups(db, credentials_for_user(user_id))
+    logging.info(f"Monthly recommendations task executed for user {user_id}.")
 
 def run_monthly_task(user_id: str):
     """
     מריץ יצירת המלצות חודשיות למשתמש.
     אינו כותב היסטוריה חדשה, רק משתמש בנתונים שכבר קיימים בטבלה.
     """
-    global RUNNING_TASKS
-    
-    try:
-        # Mark task as running
-        RUNNING_TASKS[user_id] = True
-        
-        db = Database(user_id)
-        
-        # Check if we already have recommendations and clear them first
-        cursor = db.conn.cursor()
-        cursor.execute('DELETE FROM ai_recommendations WHERE group_id="all"')
-        db.conn.commit()
-        
-        # Now generate new recommendations
-        print_history_groups(db)
-        logging.info(f"Monthly recommendations task executed for user {user_id}.")
-    except Exception as e:
-        logging.error(f"Error in monthly task for user {user_id}: {e}")
-    finally:
-        # Always remove from running tasks when done
-        RUNNING_TASKS.pop(user_id, None)
-
-# גלובלי: נזכור מתי בפעם האחרונה הרצנו משימות לכל user_id
-USER_SCHEDULE = {}
-# גלובלי: נעקוב אחרי תהליכים שרצים כרגע
-RUNNING_TASKS = {}
+    return task_registry.run(user_id, "monthly", _monthly_task, user_id)
 
 def get_all_users_from_plexauth():
     """
@@ -152,66 +162,113 @@ def get_all_users_from_plexauth():
         logging.error(f"Error fetching user list from plexauthgui: {e}")
         return []
 
+# Per-user schedule: due times, fair dispatch to a bounded pool, and lag reporting
+user_scheduler = UserScheduler({
+    "history": run_history_task,
+    "taste": run_taste_task,
+    "monthly": run_monthly_task,
+})
+
 def process_all_users():
-    global USER_SCHEDULE
-    
+    """Queues every due per-user task; the scheduler's worker pool runs them."""
+    queued = user_scheduler.enqueue_due()
+    if queued:
+        logging.info(f"Queued {queued} due user tasks.")
+
+def check_new_users():
+    """Checks only for new users, runs more frequently. Their onboarding is queued, not run inline."""
+    user_list = get_all_users_from_plexauth()
+    if user_list:
+        user_scheduler.sync_users(user_list)
+
+def run_item_similarity_task():
+    """Rebuild the cross-user item-item neighbor table from every user's history."""
     user_list = get_all_users_from_plexauth()
     if not user_list:
-        logging.info("No users returned from plexauthgui; skipping tasks.")
+        logging.info("No users returned from plexauthgui; skipping item similarity.")
         return
+    try:
+        build_item_neighbors(user_list)
+    except Exception as e:
+        logging.error(f"Error building item similarity: {e}")
 
-    now = datetime.utcnow()
-    
-    for user_id in user_list:
-        if user_id not in USER_SCHEDULE:
-            # Initialize new user schedule with staggered times
-            logging.info(f"New user {user_id} detected; initializing schedule.")
-            USER_SCHEDULE[user_id] = {
-                'last_history': now - timedelta(days=1),  # Run history immediately 
-                'last_taste': now - timedelta(days=7),    # Run taste immediately
-                'last_monthly': now - timedelta(days=30)  # Run monthly immediately
-            }
-        
-        times = USER_SCHEDULE[user_id]
-        
-        # Daily history check with strict timing
-        if (now - times['last_history']).days >= 1:
-            logging.info(f"Running daily history task for user {user_id}")
-            run_history_task(user_id)
-            USER_SCHEDULE[user_id]['last_history'] = now
-            
-        # Weekly taste check with strict timing
-        if (now - times['last_taste']).days >= 7:
-            logging.info(f"Running weekly taste task for user {user_id}")
-            run_taste_task(user_id)
-            USER_SCHEDULE[user_id]['last_taste'] = now
-            
-        # Monthly recommendations check with strict timing
-        if (now - times['last_monthly']).days >= 30:
-            logging.info(f"Running monthly recommendations task for user {user_id}")
-            run_monthly_task(user_id)
-            USER_SCHEDULE[user_id]['last_monthly'] = now
+def run_search_index_task():
+    """Rebuild the local search index from the shared TMDb catalog cache."""
+    try:
+        build_index()
+    except Exception as e:
+        logging.error(f"Error building search index: {e}")
 
-def check_new_users():
-    """Checks only for new users, runs more frequently"""
-    global USER_SCHEDULE
-    user_list = get_all_users_from_plexauth()
-    now = datetime.utcnow()
-    
-    for user_id in user_list:
-        if user_id not in USER_SCHEDULE:
-            logging.info(f"New user {user_id} detected; initializing schedule.")
-            USER_SCHEDULE[user_id] = {
-                'last_history': now - timedelta(days=1),
-                'last_taste': now - timedelta(days=7),
-                'last_monthly': now - timedelta(days=30)
-            }
-            # Run initial tasks for new user
-            run_history_task(user_id)
-            run_taste_task(user_id)
-            run_monthly_task(user_id)
+def load_monthly_recommendations(db, since=None):
+    """Read the stored monthly recommendations, optionally only those created since a timestamp."""
+    cursor = db.conn.cursor()
+    if since:
+        cursor.execute('SELECT * FROM ai_recommendations WHERE group_id="all" AND created_at >= ?', (since,))
+    else:
+        cursor.execute('SELECT * FROM ai_recommendations WHERE group_id="all"')
+    return [{
+        "id": row[0],
+        "group_id": row[1],
+        "title": row[2],
+        "imdb_id": row[3],
+        "image_url": row[4],
+        "created_at": row[5]
+    } for row in cursor.fetchall()]
+
+def run_task_or_wait(user_id: str, task_type: str, run_task):
+    """
+    Run a registry task for the user, or wait for the run another caller (e.g. the scheduler)
+    already owns. Raises RuntimeError when the run failed.
+    """
+    outcome = run_task(user_id)
+    if outcome == task_registry.SKIPPED:
+        if not task_registry.wait_until_idle(user_id, task_type):
+            raise RuntimeError(f"Timed out waiting for the running {task_type} task")
+        state, _ = task_registry.last_outcome(user_id, task_type)
+        outcome = task_registry.FAILED if state == "failed" else task_registry.OK
+    if outcome == task_registry.FAILED:
+        _, error = task_registry.last_outcome(user_id, task_type)
+        raise RuntimeError(f"{task_type} task failed: {error}")
+
+def run_monthly_job(user_id: str):
+    run_task_or_wait(user_id, "monthly", run_monthly_task)
+    return load_monthly_recommendations(Database(user_id))
+
+def run_discovery_job(user_id: str, gemini_api_key: str, tmdb_api_key: str,
+                      num_movies: int, num_series: int, extra_elements: str):
+    return generate_discovery_recommendations(
+        user_id=user_id,
+        gemini_api_key=gemini_api_key,
+        tmdb_api_key=tmdb_api_key,
+        num_movies=num_movies,
+        num_series=num_series,
+        extra_elements=extra_elements
+    )
+
+job_queue.register("monthly", run_monthly_job)
+job_queue.register("discovery", run_discovery_job)
 
 # ----------------- Lifespan Event Handler -----------------
+# Progress of the background catch-up started at boot, reported by /readyz
+WARMUP = {"started_at": None, "finished_at": None, "step": "pending", "error": None}
+
+def run_warmup():
+    """Initial catch-up run off the startup path so the API can serve requests immediately."""
+    WARMUP["started_at"] = datetime.utcnow().isoformat()
+    try:
+        WARMUP["step"] = "syncing_users"
+        check_new_users()
+        WARMUP["step"] = "queueing_due_tasks"
+        process_all_users()
+        WARMUP["step"] = "done"
+    except Exception as e:
+        logging.error(f"Error during startup warm-up: {e}")
+        WARMUP["step"] = "failed"
+        WARMUP["error"] = str(e)
+    finally:
+        WARMUP["finished_at"] = datetime.utcnow().isoformat()
+        logging.info(f"Startup warm-up finished: {WARMUP['step']}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     scheduler = BackgroundScheduler()
@@ -219,20 +276,31 @@ async def lifespan(app: FastAPI):
     # Check for new users every 10 seconds
     scheduler.add_job(check_new_users, IntervalTrigger(seconds=10))
     
-    # Regular tasks every hour
-    scheduler.add_job(process_all_users, IntervalTrigger(hours=1))
+    # Queue due per-user tasks every minute
+    scheduler.add_job(process_all_users, IntervalTrigger(minutes=1))
+
+    # Cross-user "also watched" neighbors, rebuilt daily
+    scheduler.add_job(run_item_similarity_task, IntervalTrigger(hours=24))
+
+    # Local search index over the TMDb catalog cache, rebuilt daily
+    scheduler.add_job(run_search_index_task, IntervalTrigger(hours=24), next_run_time=datetime.now())
+
+    # Requeue jobs left by the previous process before any new job can be submitted; done in the
+    # background it would fail or rerun jobs this process just queued. It is a few SQLite statements.
+    job_queue.resume_jobs()
+
+    # Catch up on users in the background instead of before accepting requests
+    scheduler.add_job(run_warmup, next_run_time=datetime.now())
     
+    user_scheduler.start()
     scheduler.start()
-    
-    logging.info("Application startup: initializing scheduled tasks.")
-    # Run both checks immediately on startup
-    check_new_users()
-    process_all_users()
+    logging.info("Application startup: scheduled tasks registered, warm-up running in background.")
     
     try:
         yield
     finally:
         scheduler.shutdown()
+        user_scheduler.shutdown()
 
 app = FastAPI(
     title="RecByHistory",
@@ -242,6 +310,14 @@ app = FastAPI(
 )
 
 # ----------------- Endpoints -----------------
+def llm_busy_response(error):
+    logging.warning(f"Rejecting request: {error}")
+    return JSONResponse(
+        status_code=429,
+        content={"error": "LLM capacity exhausted, please retry later", "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.post("/init")
 def init_data(request: InitRequest):
     """
@@ -250,40 +326,25 @@ def init_data(request: InitRequest):
     """
     logging.info(f"Received init request for user {request.user_id}")
 
-    # הגדרת מפתחות בסביבה
-    os.environ["GEMINI_API_KEY"] = request.gemini_api_key
-    os.environ["TMDB_API_KEY"] = request.tmdb_api_key
-
-    db = Database(request.user_id)
-    plex = PlexHistory(request.user_id)
-    # get_watch_history - כותב לתוך db.watch_history
-    history = plex.get_watch_history(db)
-
-    # הוספת הפריטים שהוחזרו ב-history גם לטבלת watch_history (אם עוד לא הוספת בפונקציה עצמה)
-    # במידה וכבר כותבים בתוך get_watch_history, אין צורך בלולאה זו
-    for item in history:
-        db.add_item(
-            title=item['title'],
-            imdb_id=item['imdbID'],
-            user_rating=item['userRating'],
-            resolution=item.get('resolution', "Unknown")
-        )
-        if 'episodes' in item:
-            for ep in item['episodes']:
-                db.add_item(
-                    title=ep['title'],
-                    imdb_id=ep['imdbID'],
-                    user_rating=ep['userRating'],
-                    resolution=ep.get('resolution', "Unknown")
-                )
+    # Remember this user's keys for their scheduled runs instead of setting them process-wide
+    credentials = Credentials(request.gemini_api_key, request.tmdb_api_key)
+    remember_credentials(request.user_id, credentials)
 
     # הגדרת מספר הסרטים/סדרות להמלצות חודשיות
     from rec import NUM_MOVIES, NUM_SERIES
     NUM_MOVIES = request.monthly_movies
     NUM_SERIES = request.monthly_series
 
-    # הפקת המלצות
-    print_history_groups(db)
+    # History scan and recommendations go through the task registry, so they never overlap
+    # the scheduler's runs of the same tasks for this user
+    try:
+        # get_watch_history writes movies to watch_history and shows/episodes to their own tables
+        run_task_or_wait(request.user_id, "history", run_history_task)
+        # הפקת המלצות
+        run_task_or_wait(request.user_id, "monthly", run_monthly_task)
+    except RuntimeError as e:
+        logging.error(f"Init failed for user {request.user_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     logging.info("Init process completed successfully.")
     return {"status": "OK", "message": "DB, history, and monthly recommendations created."}
 
@@ -303,7 +364,7 @@ def get_user_history(user_id: str):
     מחזיר מידע מטבלת all_items, ללא עדכון היסטוריה חדש.
     """
     db = Database(user_id)
-    rows = db.get_all_items()
+    rows = db.get_history_summary()
     results = []
     for row in rows:
         results.append({
@@ -312,7 +373,9 @@ def get_user_history(user_id: str):
             "imdb_id": row[2],
             "user_rating": row[3],
             "resolution": row[4],
-            "added_at": row[5]
+            "added_at": row[5],
+            "watched_episodes": row[6],
+            "media_type": row[7]
         })
     logging.info(f"Returning history for user {user_id} with {len(results)} items.")
     return {"user_id": user_id, "history": results}
@@ -322,83 +385,300 @@ def get_monthly_recommendations(user_id: str):
     """
     מחזיר המלצות חודשיות (מקראיות מתוך ai_recommendations),
     ללא כתיבת היסטוריה חדשה. הפונקציה מחזירה רק המלצות מ-30 ימים אחרונים.
+    When none exist a background generation job is queued and 202 is returned with its job_id.
     """
     db = Database(user_id)
-    cursor = db.conn.cursor()
-    
+
     # Calculate date 30 days ago
     thirty_days_ago = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Filter recommendations by date (within last 30 days)
-    cursor.execute('SELECT * FROM ai_recommendations WHERE group_id="all" AND created_at >= ?', 
-                  (thirty_days_ago,))
-    rows = cursor.fetchall()
-    
-    # If no recent recommendations, check if we should generate new ones
-    if len(rows) == 0 and user_id not in RUNNING_TASKS:
-        logging.info(f"No recent recommendations for user {user_id}. Generating new ones.")
-        # Mark that task is running
-        RUNNING_TASKS[user_id] = True
-        try:
-            # Generate new recommendations
-            run_monthly_task(user_id)
-            # Fetch the newly generated recommendations
-            cursor.execute('SELECT * FROM ai_recommendations WHERE group_id="all"')
-            rows = cursor.fetchall()
-        finally:
-            # Always clear the running flag
-            RUNNING_TASKS.pop(user_id, None)
-    
-    recs = []
-    for row in rows:
-        recs.append({
-            "id": row[0],
-            "group_id": row[1],
-            "title": row[2],
-            "imdb_id": row[3],
-            "image_url": row[4],
-            "created_at": row[5]
+    recs = load_monthly_recommendations(db, since=thirty_days_ago)
+
+    if not recs:
+        job_id, created = job_queue.submit(user_id, "monthly")
+        if created:
+            logging.info(f"No recent recommendations for user {user_id}. Queued job {job_id}.")
+        return JSONResponse(status_code=202, content={
+            "user_id": user_id,
+            "job_id": job_id,
+            "status": "pending",
+            "monthly_recommendations": []
         })
+
     logging.info(f"Returning monthly recommendations for user {user_id}.")
     return {"user_id": user_id, "monthly_recommendations": recs}
 
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    job = job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_queue.get_job(job_id, include_result=True)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in job_queue.ACTIVE_STATUSES:
+        return JSONResponse(status_code=202, content=job)
+    return job
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness: ready once the startup warm-up has registered users and queued their work.
+    Catch-up of the queued tasks is reported as progress but does not block readiness.
+    """
+    report = user_scheduler.lag_report()
+    tasks = [task for user in report["users"].values() for task in user["tasks"].values()]
+    body = {
+        "ready": WARMUP["step"] == "done",
+        "warmup": dict(WARMUP),
+        "catch_up": {
+            "users": len(report["users"]),
+            "tasks_total": len(tasks),
+            "tasks_never_run": sum(1 for task in tasks if task["last_run"] is None),
+            "tasks_queued": report["queued"],
+            "tasks_running": sum(report["running"].values()),
+        },
+    }
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/llm/stats")
+def get_llm_stats():
+    """Per-model LLM dispatch usage against its concurrency and rate budgets."""
+    return llm_dispatch.stats()
+
+@app.get("/search_cache/stats")
+def get_search_cache_stats():
+    """Hit/miss counters and size of the semantic AI search cache."""
+    return search_cache.stats()
+
+@app.get("/tasks")
+def get_tasks(user_id: str = None):
+    """State, timestamps and last error of background tasks, optionally for one user."""
+    return {"tasks": task_registry.snapshot(user_id)}
+
+@app.get("/schedule")
+def get_schedule(user_id: str = None):
+    """How far behind schedule each user's tasks are, plus queue and worker usage."""
+    return user_scheduler.lag_report(user_id)
+
+@app.get("/also_watched")
+def get_also_watched_endpoint(user_id: str, imdb_id: str = None, limit: int = 20):
+    """
+    Titles other users on this server watched together with imdb_id, or with the
+    user's own best-rated recent titles when no imdb_id is given. Watched titles are excluded.
+    """
+    db = Database(user_id)
+    history = db.get_history_summary()
+    watched = {row[2] for row in history if row[2]}
+    if imdb_id:
+        seeds = [imdb_id]
+    else:
+        seeds = [seed["imdb_id"] for seed in select_seeds(history)]
+    results = get_also_watched(seeds, limit=limit, exclude=watched)
+    logging.info(f"Returning {len(results)} also-watched titles for user {user_id}.")
+    return {"user_id": user_id, "also_watched": results}
+
+def submit_discovery_job(request: DiscoveryRequest):
+    return job_queue.submit(
+        request.user_id,
+        "discovery",
+        params={
+            "num_movies": request.num_movies,
+            "num_series": request.num_series,
+            "extra_elements": request.extra_elements
+        },
+        secrets={"gemini_api_key": request.gemini_api_key, "tmdb_api_key": request.tmdb_api_key}
+    )
+
 @app.post("/discovery_recommendations")
 def post_discovery_recommendations(request: DiscoveryRequest):
     logging.info(f"Received discovery recommendations request for user {request.user_id}")
+
+    # Cached results are served immediately; stale ones are regenerated in the background
+    cached, fresh = get_cached_discovery(request.user_id, request.num_movies, request.num_series,
+                                         request.extra_elements)
+    if cached:
+        if not fresh:
+            job_id, created = submit_discovery_job(request)
+            logging.info(f"Serving stale discovery recommendations for user {request.user_id}, "
+                         f"refresh job {job_id}{'' if created else ' already running'}")
+        return {"discovery_recommendations": cached, "cache": "hit" if fresh else "stale"}
+
+    if request.background:
+        job_id, _ = submit_discovery_job(request)
+        return JSONResponse(status_code=202, content={"user_id": request.user_id, "job_id": job_id, "status": "pending"})
     
-    # Get the recommendations
-    final_recs = generate_discovery_recommendations(
-        user_id=request.user_id,
-        gemini_api_key=request.gemini_api_key,
-        tmdb_api_key=request.tmdb_api_key,
-        num_movies=request.num_movies,
-        num_series=request.num_series,
-        extra_elements=request.extra_elements
-    )
+    # Get the recommendations; the caller is waiting, so LLM calls go ahead of background work
+    try:
+        with llm_dispatch.interactive():
+            final_recs = generate_discovery_recommendations(
+                user_id=request.user_id,
+                gemini_api_key=request.gemini_api_key,
+                tmdb_api_key=request.tmdb_api_key,
+                num_movies=request.num_movies,
+                num_series=request.num_series,
+                extra_elements=request.extra_elements
+            )
+    except llm_dispatch.LLMBusyError as e:
+        return llm_busy_response(e)
     
     # Log what we're returning for debugging
     logging.info(f"Generated {len(final_recs)} discovery recommendations")
     
     # Return with the proper field name expected by the frontend
-    return {"discovery_recommendations": final_recs}
+    return {"discovery_recommendations": final_recs, "cache": "miss"}
 
-@app.post("/ai_search")
-def ai_search(request: AISearchRequest):
-    """
-    מבצע חיפוש AI בהתבסס על taste והיסטוריה קיימת, ללא עדכון היסטוריה חדש.
-    """
+def _ai_search_prompt(request: AISearchRequest):
+    """Local index candidates for the query, the system instruction built around them and the watched IMDb IDs."""
     db = Database(request.user_id)
     user_taste = db.get_latest_user_taste(request.user_id) or "No user taste available."
+    watched = {row[2] for row in db.get_history_summary() if row[2]}
+    local_results = search_catalog(request.query, SEARCH_PREFILTER_K, exclude=watched)
+
     system_instruction = (
         "Perform a search based on the following query and user taste.\n"
         "Query: " + request.query + "\n"
         "User Taste: " + user_taste + "\n\n"
-        "Return results in JSON format with keys: 'title', 'imdb_id', 'image_url'."
     )
-    results = get_ai_search_results(request.query, system_instruction)
+    if local_results:
+        candidate_lines = "\n".join(
+            f"- {item['title']} ({item['media_type']}, IMDb: {item['imdb_id'] or 'unknown'})"
+            for item in local_results
+        )
+        system_instruction += (
+            "Candidate titles from the local catalog (prefer these, add others only if clearly better):\n"
+            + candidate_lines + "\n\n"
+        )
+    system_instruction += "Return results in JSON format with keys: 'title', 'imdb_id', 'image_url'."
+    return local_results, system_instruction, watched
+
+def _local_search_results(local_results, watched):
+    """
+    Local index hits as search results, resolving missing IMDb IDs. Hits that had no IMDb ID
+    got past the index's exclusion, so the watched IDs are applied again once resolved.
+    """
+    missing = [(item["tmdb_id"], item["media_type"]) for item in local_results if not item["imdb_id"]]
+    if missing:
+        conn = connect_cache()
+        try:
+            resolved = resolve_imdb_ids(conn, missing)
+        finally:
+            conn.close()
+        for item in local_results:
+            item["imdb_id"] = item["imdb_id"] or resolved.get((item["tmdb_id"], item["media_type"]))
+    return [{"title": item["title"], "imdb_id": item["imdb_id"], "image_url": item["image_url"]}
+            for item in local_results if item["imdb_id"] and item["imdb_id"] not in watched]
+
+@app.post("/ai_search")
+def ai_search(request: AISearchRequest):
+    """
+    מבצע חיפוש AI בהתבסס על taste והיסטוריה קיימת, ללא עדכון היסטוריה חדש.
+    Local index candidates are retrieved first so the LLM only has to rank and refine them.
+    """
+    taste_version = Database(request.user_id).get_taste_version(request.user_id)
+    cached = search_cache.get(request.user_id, request.query, taste_version)
+    if cached:
+        logging.info(f"AI search cache hit for user {request.user_id} "
+                     f"('{request.query}' ~ '{cached['query']}', {cached['similarity']})")
+        return {"user_id": request.user_id, "search_results": cached["results"], "cached": True}
+
+    local_results, system_instruction, watched = _ai_search_prompt(request)
+
+    results = []
+    try:
+        credentials = Credentials(request.gemini_api_key, request.tmdb_api_key)
+        with llm_dispatch.interactive():
+            raw_results = get_ai_search_results(request.query, system_instruction, credentials)
+        parsed = json.loads(clean_json_output(raw_results))
+        results = [item for item in parsed if isinstance(item, dict) and item.get("title")]
+        search_cache.put(request.user_id, request.query, results, taste_version)
+    except llm_dispatch.LLMBusyError as e:
+        if not local_results:
+            return llm_busy_response(e)
+        logging.warning(f"LLM busy for AI search of user {request.user_id}, serving local results.")
+    except Exception as e:
+        logging.warning(f"Could not parse AI search results for user {request.user_id}: {e}")
+
+    if not results and local_results:
+        logging.info(f"Falling back to local search results for user {request.user_id}.")
+        results = _local_search_results(local_results, watched)
+
     logging.info(f"AI search executed for user {request.user_id}.")
     return {"user_id": request.user_id, "search_results": results}
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ai_search/stream")
+def ai_search_stream(request: AISearchRequest):
+    """
+    Streaming AI search as Server-Sent Events. Each result is sent as a `result` event as
+    soon as the model has written it and its poster is resolved, followed by one `done`
+    event ({count, source}). When the model is busy or returns nothing, local index results
+    are streamed instead; with neither, a `busy` event carries retry_after.
+    """
+    taste_version = Database(request.user_id).get_taste_version(request.user_id)
+    cached = search_cache.get(request.user_id, request.query, taste_version)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if cached:
+        logging.info(f"AI search cache hit for user {request.user_id} "
+                     f"('{request.query}' ~ '{cached['query']}', {cached['similarity']})")
+        body = "".join(sse_event("result", item) for item in cached["results"])
+        body += sse_event("done", {"count": len(cached["results"]), "source": "cache"})
+        return StreamingResponse(iter([body]), media_type="text/event-stream", headers=headers)
+
+    local_results, system_instruction, watched = _ai_search_prompt(request)
+    credentials = Credentials(request.gemini_api_key, request.tmdb_api_key)
+
+    def events():
+        sent = set()
+        streamed = []
+        source = "ai"
+        # Only a stream that ran to the end is a complete answer worth caching
+        completed = False
+        try:
+            for item in stream_ai_search_results(request.query, system_instruction, credentials):
+                key = item.get("imdb_id") or item.get("title")
+                if key in sent:
+                    continue
+                sent.add(key)
+                item = update_recommendations_with_images([{
+                    "title": item.get("title"),
+                    "imdb_id": item.get("imdb_id", ""),
+                    "image_url": item.get("image_url", ""),
+                }], tmdb_key(credentials))[0]
+                streamed.append(item)
+                yield sse_event("result", item)
+            completed = True
+        except llm_dispatch.LLMBusyError as e:
+            if not local_results:
+                yield sse_event("busy", {"error": str(e), "retry_after": e.retry_after})
+                return
+            logging.warning(f"LLM busy for streaming AI search of user {request.user_id}, serving local results.")
+        count = len(streamed)
+        if streamed:
+            if completed:
+                search_cache.put(request.user_id, request.query, streamed, taste_version)
+        elif local_results:
+            source = "local"
+            for item in _local_search_results(local_results, watched):
+                count += 1
+                yield sse_event("result", item)
+        logging.info(f"Streaming AI search executed for user {request.user_id}: {count} results ({source}).")
+        yield sse_event("done", {"count": count, "source": source})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 @app.post("/add_to_watchlist")
 def add_to_watchlist(request: WatchlistRequest):
     """Add items to the Plex watchlist using user's token"""
@@ -416,6 +696,7 @@ def add_to_watchlist(request: WatchlistRequest):
             raise HTTPException(status_code=404, detail="User token not found")
             
         # Create Plex account instance with user's token
+        from plexapi.myplex import MyPlexAccount
         plex_account = MyPlexAccount(token=user_token)
         
         # Add item to user's watchlist
@@ -1,5 +1,4 @@
 import requests
-from plexapi.myplex import MyPlexAccount
 
 class PlexAuthClient:
     def __init__(self, base_url="http://plexauthgui:5332"):
@@ -58,6 +57,7 @@ class PlexAuthClient:
                 return None
             
             # Build a MyPlexAccount using the token
+            from plexapi.myplex import MyPlexAccount
             plexuser = MyPlexAccount(token=plex_token)
             
             # Attempt to connect to servers
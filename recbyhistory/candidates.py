@@ -0,0 +1,379 @@
+# recbyhistory/candidates.py
+"""
+Local candidate generation.
+
+The user's best-rated and most recent watched titles are used as seeds. TMDb recommendations
+for each seed come from getimdbid and are cached in a shared SQLite file. Candidates are
+scored with NumPy (seed weight x rank relevance), watched and owned titles are dropped, and
+the result is stored per user so monthly and discovery picks can be read without an LLM call.
+"""
+import os
+import json
+import time
+import math
+import sqlite3
+import logging
+import requests
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    DB_FOLDER, CANDIDATE_SEEDS, CANDIDATE_POOL_SIZE,
+    CANDIDATE_RECENCY_HALF_LIFE_DAYS, TMDB_CACHE_TTL_SECONDS
+)
+
+TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
+CACHE_FILE = os.path.join(DB_FOLDER, "tmdb_cache.db")
+
+# Unrated titles (Plex reports 0.0) are treated as an average rating
+NEUTRAL_RATING = 6.0
+RECOMMENDATIONS_PER_SEED = 20
+FETCH_WORKERS = 8
+
+
+def _getimdbid_url():
+    return os.environ.get("GETIMDBID_URL", "http://getimdbid:5331")
+
+
+def connect_cache():
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(CACHE_FILE, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS imdb_to_tmdb (
+            imdb_id TEXT PRIMARY KEY,
+            tmdb_id INTEGER,
+            media_type TEXT,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tmdb_recommendations (
+            tmdb_id INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            results TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (tmdb_id, media_type)
+        )
+    ''')
+    # Every title seen in TMDb responses; imdb_id is filled in once it has been resolved
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tmdb_items (
+            tmdb_id INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            imdb_id TEXT,
+            title TEXT,
+            overview TEXT,
+            genre_ids TEXT,
+            poster_path TEXT,
+            release_date TEXT,
+            vote_average FLOAT,
+            popularity FLOAT,
+            updated_at REAL,
+            PRIMARY KEY (tmdb_id, media_type)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tmdb_items_imdb ON tmdb_items (imdb_id)')
+    return conn
+
+
+def _convert(payload):
+    r = requests.post(f"{_getimdbid_url()}/convert_ids", json=payload, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
+def resolve_tmdb_ids(conn, seeds):
+    """Map seed IMDb IDs to (tmdb_id, media_type), using the cache where possible."""
+    resolved = {}
+    missing = []
+    for seed in seeds:
+        row = conn.execute(
+            'SELECT tmdb_id, media_type FROM imdb_to_tmdb WHERE imdb_id = ?', (seed["imdb_id"],)
+        ).fetchone()
+        if row:
+            if row[0]:
+                resolved[seed["imdb_id"]] = (row[0], row[1])
+        else:
+            missing.append(seed)
+
+    def lookup(seed):
+        try:
+            result = _convert({"imdb_id": seed["imdb_id"], "title": seed["title"], "media_type": seed["media_type"]})
+            return seed, result.get("tmdb_id")
+        except Exception as e:
+            logging.warning(f"Could not resolve TMDb ID for {seed['imdb_id']}: {e}")
+            return seed, None
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for seed, tmdb_id in executor.map(lookup, missing):
+            conn.execute(
+                'INSERT OR REPLACE INTO imdb_to_tmdb (imdb_id, tmdb_id, media_type, fetched_at) VALUES (?, ?, ?, ?)',
+                (seed["imdb_id"], tmdb_id, seed["media_type"], time.time())
+            )
+            if tmdb_id:
+                resolved[seed["imdb_id"]] = (int(tmdb_id), seed["media_type"])
+    conn.commit()
+    return resolved
+
+
+def fetch_recommendations(conn, seed_keys):
+    """Return {(tmdb_id, media_type): [items]} for the seeds, refreshing expired cache entries."""
+    results = {}
+    stale = []
+    for key in seed_keys:
+        row = conn.execute(
+            'SELECT results, fetched_at FROM tmdb_recommendations WHERE tmdb_id = ? AND media_type = ?', key
+        ).fetchone()
+        if row and time.time() - row[1] < TMDB_CACHE_TTL_SECONDS:
+            results[key] = json.loads(row[0])
+        else:
+            stale.append(key)
+
+    def fetch(key):
+        try:
+            r = requests.post(f"{_getimdbid_url()}/tmdb_recommendations",
+                              json={"tmdb_id": key[0], "media_type": key[1], "limit": RECOMMENDATIONS_PER_SEED},
+                              timeout=15)
+            r.raise_for_status()
+            return key, r.json().get("results", [])
+        except Exception as e:
+            logging.warning(f"Could not fetch TMDb recommendations for {key}: {e}")
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for key, items in executor.map(fetch, stale):
+            if items is None:
+                continue
+            results[key] = items
+            conn.execute(
+                'INSERT OR REPLACE INTO tmdb_recommendations (tmdb_id, media_type, results, fetched_at) VALUES (?, ?, ?, ?)',
+                (key[0], key[1], json.dumps(items), time.time())
+            )
+            for item in items:
+                conn.execute('''
+                    INSERT INTO tmdb_items (tmdb_id, media_type, title, overview, genre_ids, poster_path,
+                                            release_date, vote_average, popularity, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (tmdb_id, media_type) DO UPDATE SET
+                        title = excluded.title, overview = excluded.overview, genre_ids = excluded.genre_ids,
+                        poster_path = excluded.poster_path, release_date = excluded.release_date,
+                        vote_average = excluded.vote_average, popularity = excluded.popularity,
+                        updated_at = excluded.updated_at
+                ''', (item["tmdb_id"], item["media_type"], item.get("title"), item.get("overview"),
+                      json.dumps(item.get("genre_ids", [])), item.get("poster_path"), item.get("release_date"),
+                      item.get("vote_average"), item.get("popularity"), time.time()))
+    conn.commit()
+    return results
+
+
+def resolve_imdb_ids(conn, keys):
+    """Fill in IMDb IDs for candidate (tmdb_id, media_type) keys, caching them in tmdb_items."""
+    resolved = {}
+    missing = []
+    for key in keys:
+        row = conn.execute(
+            'SELECT imdb_id FROM tmdb_items WHERE tmdb_id = ? AND media_type = ?', key
+        ).fetchone()
+        if row and row[0]:
+            resolved[key] = row[0]
+        else:
+            missing.append(key)
+
+    def lookup(key):
+        try:
+            return key, _convert({"tmdb_id": key[0], "media_type": key[1]}).get("imdb_id")
+        except Exception as e:
+            logging.warning(f"Could not resolve IMDb ID for TMDb {key}: {e}")
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for key, imdb_id in executor.map(lookup, missing):
+            if imdb_id:
+                resolved[key] = imdb_id
+                conn.execute('UPDATE tmdb_items SET imdb_id = ? WHERE tmdb_id = ? AND media_type = ?',
+                             (imdb_id, key[0], key[1]))
+    conn.commit()
+    return resolved
+
+
+def validate_imdb_ids(imdb_ids):
+    """
+    Check IMDb IDs against the local TMDb catalog, asking getimdbid's /validate_ids in one
+    batch for the ones not cached yet. Returns {imdb_id: {"tmdb_id", "media_type", "title"}}
+    for known titles and {imdb_id: None} for IDs TMDb does not know; IDs that could not be
+    checked (getimdbid unreachable) are left out.
+    """
+    imdb_ids = list(dict.fromkeys(i for i in imdb_ids if i))
+    if not imdb_ids:
+        return {}
+    conn = connect_cache()
+    try:
+        placeholders = ",".join("?" * len(imdb_ids))
+        known = {}
+        for imdb_id, tmdb_id, media_type in conn.execute(
+            f'SELECT imdb_id, tmdb_id, media_type FROM imdb_to_tmdb WHERE tmdb_id IS NOT NULL AND imdb_id IN ({placeholders})',
+            imdb_ids
+        ):
+            known[imdb_id] = {"tmdb_id": tmdb_id, "media_type": media_type, "title": None}
+        for imdb_id, tmdb_id, media_type, title in conn.execute(
+            f'SELECT imdb_id, tmdb_id, media_type, title FROM tmdb_items WHERE imdb_id IN ({placeholders})',
+            imdb_ids
+        ):
+            known[imdb_id] = {"tmdb_id": tmdb_id, "media_type": media_type, "title": title}
+
+        missing = [i for i in imdb_ids if i not in known]
+        if missing:
+            try:
+                r = requests.post(f"{_getimdbid_url()}/validate_ids", json={"imdb_ids": missing}, timeout=30)
+                r.raise_for_status()
+                results = r.json().get("results", {})
+            except Exception as e:
+                logging.warning(f"Could not validate {len(missing)} IMDb IDs: {e}")
+                results = {}
+            for imdb_id, result in results.items():
+                if not result.get("valid"):
+                    known[imdb_id] = None
+                    continue
+                known[imdb_id] = {k: result.get(k) for k in ("tmdb_id", "media_type", "title")}
+                conn.execute(
+                    'INSERT OR REPLACE INTO imdb_to_tmdb (imdb_id, tmdb_id, media_type, fetched_at) VALUES (?, ?, ?, ?)',
+                    (imdb_id, result.get("tmdb_id"), result.get("media_type"), time.time())
+                )
+            conn.commit()
+    finally:
+        conn.close()
+    logging.info(f"Validated {len(imdb_ids)} IMDb IDs: {sum(1 for v in known.values() if v)} known, "
+                 f"{sum(1 for v in known.values() if v is None)} unknown to TMDb, "
+                 f"{len(imdb_ids) - len(known)} unchecked")
+    return known
+
+
+def seed_weights(seeds):
+    """Vectorized seed weights: normalized user rating times an exponential recency decay."""
+    import numpy as np
+    ratings = np.array([s["rating"] if s["rating"] else NEUTRAL_RATING for s in seeds], dtype=np.float64)
+    ages = np.array([s["age_days"] for s in seeds], dtype=np.float64)
+    decay = np.power(0.5, ages / CANDIDATE_RECENCY_HALF_LIFE_DAYS)
+    return (ratings / 10.0) * decay
+
+
+def _age_days(timestamp, now):
+    try:
+        return max((now - datetime.fromisoformat(str(timestamp))).total_seconds() / 86400.0, 0.0)
+    except (TypeError, ValueError):
+        return CANDIDATE_RECENCY_HALF_LIFE_DAYS
+
+
+def select_seeds(history, limit=CANDIDATE_SEEDS):
+    """Pick the top-rated watched titles, most recent first among equal ratings."""
+    now = datetime.now()
+    seeds = [{
+        "imdb_id": row[2],
+        "title": row[1],
+        "rating": row[3] or 0.0,
+        "age_days": _age_days(row[5], now),
+        "media_type": row[7],
+    } for row in history if row[2]]
+    seeds.sort(key=lambda s: (s["rating"] or NEUTRAL_RATING, -s["age_days"]), reverse=True)
+    return seeds[:limit]
+
+
+def score_candidates(seeds, seed_keys, recommendations):
+    """
+    Return (candidate_keys, scores). Each seed contributes weight / sqrt(1 + rank) to every
+    title TMDb recommends for it, computed as one weights x relevance matrix product.
+    """
+    import numpy as np
+    weights = seed_weights(seeds)
+    index = {}
+    rows, cols, values = [], [], []
+    for s, key in enumerate(seed_keys):
+        for rank, item in enumerate(recommendations.get(key, [])):
+            cand = (item["tmdb_id"], item["media_type"])
+            c = index.setdefault(cand, len(index))
+            rows.append(s)
+            cols.append(c)
+            values.append(1.0 / math.sqrt(1 + rank))
+    if not index:
+        return [], np.zeros(0)
+    relevance = np.zeros((len(seed_keys), len(index)))
+    relevance[rows, cols] = values
+    scores = weights @ relevance
+    return list(index.keys()), scores
+
+
+def build_candidates(history, owned_imdb_ids=(), pool_size=CANDIDATE_POOL_SIZE):
+    """Compute the ranked candidate list for one user's history summary rows."""
+    import numpy as np
+    seeds = select_seeds(history)
+    if not seeds:
+        return []
+    conn = connect_cache()
+    try:
+        resolved = resolve_tmdb_ids(conn, seeds)
+        seeds = [s for s in seeds if s["imdb_id"] in resolved]
+        seed_keys = [resolved[s["imdb_id"]] for s in seeds]
+        if not seed_keys:
+            return []
+        recommendations = fetch_recommendations(conn, seed_keys)
+        keys, scores = score_candidates(seeds, seed_keys, recommendations)
+        if not keys:
+            return []
+
+        # Drop anything already watched in TMDb ID space before paying for IMDb lookups
+        watched_imdb = {row[2] for row in history if row[2]}
+        excluded = set(owned_imdb_ids) | watched_imdb
+        watched_tmdb = {
+            (tmdb_id, media_type) for imdb_id, tmdb_id, media_type in conn.execute(
+                'SELECT imdb_id, tmdb_id, media_type FROM imdb_to_tmdb WHERE tmdb_id IS NOT NULL'
+            ) if imdb_id in watched_imdb
+        }
+        mask = np.array([key not in watched_tmdb for key in keys])
+        order = np.argsort(-scores)
+        order = order[mask[order]][:pool_size * 2]
+        top_keys = [keys[i] for i in order]
+
+        imdb_ids = resolve_imdb_ids(conn, top_keys)
+        items = {
+            (row[0], row[1]): row[2:] for row in conn.execute(
+                f'SELECT tmdb_id, media_type, title, poster_path FROM tmdb_items WHERE tmdb_id IN ({",".join("?" * len(top_keys))})',
+                [key[0] for key in top_keys]
+            )
+        }
+    finally:
+        conn.close()
+
+    candidates = []
+    for i in order:
+        key = keys[i]
+        imdb_id = imdb_ids.get(key)
+        if not imdb_id or imdb_id in excluded or key not in items:
+            continue
+        title, poster_path = items[key]
+        candidates.append({
+            "imdb_id": imdb_id,
+            "tmdb_id": key[0],
+            "media_type": key[1],
+            "title": title,
+            "image_url": f"{TMDB_IMAGE_BASE_URL}{poster_path}" if poster_path else "",
+            "score": float(scores[i]),
+        })
+        excluded.add(imdb_id)
+        if len(candidates) >= pool_size:
+            break
+    return candidates
+
+
+def refresh_candidates(db):
+    """Rebuild and store the candidate list for db.user_id; returns how many were stored."""
+    history = db.get_history_summary()
+    owned = {row[2] for row in db.get_all_library_items() if row[2]}
+    candidates = build_candidates(history, owned)
+    if not candidates:
+        # Lookup failures also end up here, so the previous list is kept; get_candidates stops
+        # serving it once it is older than CANDIDATE_MAX_AGE_SECONDS
+        logging.warning(f"Candidate refresh for user {db.user_id} produced nothing; "
+                        f"keeping the previous list until it expires")
+        return 0
+    db.replace_candidates(candidates)
+    logging.info(f"Stored {len(candidates)} recommendation candidates for user {db.user_id}")
+    return len(candidates)
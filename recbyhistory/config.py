@@ -1,5 +1,6 @@
 # recbyhistory/config.py
 import os
+import json
 
 # API Keys and Overseerr configuration
 TMDB_API_KEY = os.environ.get("TMDB_API_KEY", "your_tmdb_api_key_here")
@@ -10,3 +11,91 @@ OVERSEERR_URL = os.environ.get("OVERSEERR_URL", "http://localhost:5055")
 # Database and application configuration
 DB_FOLDER = os.environ.get("DB_FOLDER", "db")
 ITEMS_PER_GROUP = int(os.environ.get("ITEMS_PER_GROUP", "5000"))
+
+# LLM gateway: identical Gemini requests are served from this cache until they expire.
+# The default outlives the weekly taste run so unchanged history costs no paid call.
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(8 * 24 * 3600)))
+
+# Weekly taste runs only send history added since the last profile, unless more than
+# TASTE_DELTA_MAX_ITEMS new titles piled up, in which case the profile is rebuilt from scratch.
+INCREMENTAL_TASTE = os.environ.get("INCREMENTAL_TASTE", "true").lower() == "true"
+TASTE_DELTA_MAX_ITEMS = int(os.environ.get("TASTE_DELTA_MAX_ITEMS", "200"))
+
+# Map-reduce taste generation: each ITEMS_PER_GROUP chunk of history is summarized on its own
+# (cached by chunk hash) and the summaries are merged. "auto" enables it once history spans
+# more than one chunk.
+TASTE_MAP_REDUCE = os.environ.get("TASTE_MAP_REDUCE", "auto").lower()
+TASTE_MAP_WORKERS = int(os.environ.get("TASTE_MAP_WORKERS", "4"))
+
+# Poster enrichment: recommendations are resolved concurrently with a per-call timeout and an
+# overall deadline; poster URLs are cached in memory by IMDb ID.
+ENRICH_WORKERS = int(os.environ.get("ENRICH_WORKERS", "8"))
+ENRICH_CALL_TIMEOUT_SECONDS = float(os.environ.get("ENRICH_CALL_TIMEOUT_SECONDS", "5"))
+ENRICH_DEADLINE_SECONDS = float(os.environ.get("ENRICH_DEADLINE_SECONDS", "15"))
+POSTER_CACHE_TTL_SECONDS = int(os.environ.get("POSTER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Local candidate engine (TMDb recommendations of the user's best-rated titles)
+CANDIDATE_SEEDS = int(os.environ.get("CANDIDATE_SEEDS", "30"))
+CANDIDATE_POOL_SIZE = int(os.environ.get("CANDIDATE_POOL_SIZE", "50"))
+CANDIDATE_RECENCY_HALF_LIFE_DAYS = float(os.environ.get("CANDIDATE_RECENCY_HALF_LIFE_DAYS", "180"))
+# Candidates older than this are not served; a refresh that finds nothing keeps the old list until then
+CANDIDATE_MAX_AGE_SECONDS = int(os.environ.get("CANDIDATE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+TMDB_CACHE_TTL_SECONDS = int(os.environ.get("TMDB_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Item-item collaborative filtering across every user's watch history
+ITEM_SIM_TOP_K = int(os.environ.get("ITEM_SIM_TOP_K", "20"))
+ITEM_SIM_MIN_SUPPORT = int(os.environ.get("ITEM_SIM_MIN_SUPPORT", "2"))
+
+# Local semantic search index (TF-IDF + truncated SVD over the TMDb catalog cache)
+SEARCH_INDEX_DIM = int(os.environ.get("SEARCH_INDEX_DIM", "128"))
+SEARCH_PREFILTER_K = int(os.environ.get("SEARCH_PREFILTER_K", "25"))
+
+# Background job queue for monthly and discovery generation
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_RETENTION_HOURS = int(os.environ.get("JOB_RETENTION_HOURS", "24"))
+
+# Per-user task scheduler: worker pool size, per-task-type concurrency and start jitter
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "8"))
+SCHEDULER_TYPE_LIMITS = {
+    "history": int(os.environ.get("SCHEDULER_HISTORY_CONCURRENCY", "6")),
+    "taste": int(os.environ.get("SCHEDULER_TASTE_CONCURRENCY", "2")),
+    "monthly": int(os.environ.get("SCHEDULER_MONTHLY_CONCURRENCY", "2")),
+}
+SCHEDULER_JITTER_SECONDS = int(os.environ.get("SCHEDULER_JITTER_SECONDS", "300"))
+# How long a task is put off when another caller (e.g. /init or a job) is already running it
+SCHEDULER_DEFER_SECONDS = int(os.environ.get("SCHEDULER_DEFER_SECONDS", "600"))
+
+# LLM dispatch: per-model concurrency and rate budgets, interactive wait budget.
+# LLM_MODEL_LIMITS overrides per model, e.g. {"gemini-2.0-pro-exp-02-05": {"rpm": 2, "concurrency": 1}}
+LLM_MODEL_CONCURRENCY = int(os.environ.get("LLM_MODEL_CONCURRENCY", "4"))
+LLM_RPM = int(os.environ.get("LLM_RPM", "15"))
+LLM_TPM = int(os.environ.get("LLM_TPM", "1000000"))
+LLM_MODEL_LIMITS = json.loads(os.environ.get("LLM_MODEL_LIMITS", "{}"))
+LLM_INTERACTIVE_MAX_WAIT_SECONDS = float(os.environ.get("LLM_INTERACTIVE_MAX_WAIT_SECONDS", "10"))
+LLM_RATE_LIMIT_COOLDOWN_SECONDS = int(os.environ.get("LLM_RATE_LIMIT_COOLDOWN_SECONDS", "30"))
+
+# Watch history prompts: token budget per model (PROMPT_MODEL_BUDGETS overrides by model name)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_MODEL_BUDGETS = json.loads(os.environ.get("PROMPT_MODEL_BUDGETS", "{}"))
+PROMPT_RECENCY_HALF_LIFE_DAYS = float(os.environ.get("PROMPT_RECENCY_HALF_LIFE_DAYS", "365"))
+PROMPT_HISTOGRAM_BINS = int(os.environ.get("PROMPT_HISTOGRAM_BINS", "8"))
+
+# Structured recommendation output: follow-up calls asking only for titles that failed validation
+LLM_REPAIR_ATTEMPTS = int(os.environ.get("LLM_REPAIR_ATTEMPTS", "1"))
+
+# Discovery result cache: served as fresh within the TTL when taste and history are unchanged,
+# otherwise served stale (up to the max age) while a background job regenerates it
+DISCOVERY_CACHE_TTL_SECONDS = int(os.environ.get("DISCOVERY_CACHE_TTL_SECONDS", str(6 * 3600)))
+DISCOVERY_CACHE_MAX_STALE_SECONDS = int(os.environ.get("DISCOVERY_CACHE_MAX_STALE_SECONDS", str(7 * 24 * 3600)))
+
+# Semantic AI search cache: cosine similarity needed for a hit, entry TTL, LRU bounds
+SEARCH_CACHE_SIMILARITY = float(os.environ.get("SEARCH_CACHE_SIMILARITY", "0.9"))
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", str(24 * 3600)))
+SEARCH_CACHE_PER_USER = int(os.environ.get("SEARCH_CACHE_PER_USER", "50"))
+SEARCH_CACHE_MAX_USERS = int(os.environ.get("SEARCH_CACHE_MAX_USERS", "200"))
+
+# Per-user exclusion set (watched + owned + requested): how often it is topped up
+# incrementally, and how often it is rebuilt from scratch to drop removed titles
+WATCHLIST_URL = os.environ.get("WATCHLIST_URL", "http://watchlistrequests:5333")
+EXCLUSION_REFRESH_SECONDS = int(os.environ.get("EXCLUSION_REFRESH_SECONDS", "60"))
+EXCLUSION_REBUILD_SECONDS = int(os.environ.get("EXCLUSION_REBUILD_SECONDS", str(24 * 3600)))
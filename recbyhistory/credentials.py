@@ -0,0 +1,48 @@
+# recbyhistory/credentials.py
+"""
+Request-scoped API credentials.
+
+Keys arrive with each request (or once via /init) and are passed explicitly through the
+recommendation pipeline instead of being written to os.environ, so runs for different
+users with different keys can execute concurrently. Keys registered through /init are
+remembered in memory per user for scheduled runs. The container environment is the
+fallback when a user has none.
+"""
+import os
+import threading
+from typing import NamedTuple, Optional
+
+
+class Credentials(NamedTuple):
+    gemini_api_key: Optional[str] = None
+    tmdb_api_key: Optional[str] = None
+
+
+_user_credentials = {}
+_lock = threading.Lock()
+
+
+def remember(user_id, credentials):
+    """Store the keys a user registered so scheduled runs for that user can use them."""
+    with _lock:
+        _user_credentials[user_id] = credentials
+
+
+def for_user(user_id):
+    """The user's registered keys, or the environment defaults."""
+    with _lock:
+        return _user_credentials.get(user_id) or Credentials()
+
+
+def gemini_key(credentials):
+    """The Gemini key to use, falling back to GEMINI_API_KEY from the environment."""
+    if credentials and credentials.gemini_api_key:
+        return credentials.gemini_api_key
+    return os.environ.get("GEMINI_API_KEY", "")
+
+
+def tmdb_key(credentials):
+    """The TMDb key to use, falling back to TMDB_API_KEY from the environment."""
+    if credentials and credentials.tmdb_api_key:
+        return credentials.tmdb_api_key
+    return os.environ.get("TMDB_API_KEY")
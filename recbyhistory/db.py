@@ -1,5 +1,6 @@
 import sqlite3
 import os
+import time
 from datetime import datetime
 
 class Database:
@@ -10,6 +11,7 @@ class Database:
         self.db_file = os.path.join(self.db_path, "watch_history.db")
         
         self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute('PRAGMA foreign_keys = ON')
         self.create_tables()
 
     def create_tables(self):
@@ -30,6 +32,50 @@ class Database:
             )
         ''')
 
+        # Older databases keyed watch_history on (user_id, imdb_id, resolution), so the same
+        # title could appear once per resolution. Collapse those and key on the IMDb ID only.
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_watch_history_user_imdb'"
+        )
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                DELETE FROM watch_history WHERE id NOT IN (
+                    SELECT MIN(id) FROM watch_history GROUP BY user_id, imdb_id
+                )
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX idx_watch_history_user_imdb
+                ON watch_history (user_id, imdb_id)
+            ''')
+
+        # Shows are stored once, with a compact summary of the watched episodes
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shows (
+                id INTEGER PRIMARY KEY,
+                imdb_id TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                user_rating FLOAT,
+                resolution TEXT,
+                watched_episodes INTEGER NOT NULL DEFAULT 0,
+                first_watched_at TIMESTAMP,
+                last_watched_at TIMESTAMP
+            )
+        ''')
+
+        # Episodes only keep what is needed to count them against their show
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS episodes (
+                id INTEGER PRIMARY KEY,
+                show_id INTEGER NOT NULL REFERENCES shows(id) ON DELETE CASCADE,
+                imdb_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                user_rating FLOAT,
+                added_at TIMESTAMP,
+                UNIQUE (show_id, imdb_id) ON CONFLICT IGNORE
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_episodes_show ON episodes (show_id)')
+
         # all_items remains persistent
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS all_items (
@@ -43,6 +89,19 @@ class Database:
             )
         ''')
 
+        # Locally generated recommendation candidates (see candidates.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS candidates (
+                imdb_id TEXT PRIMARY KEY,
+                tmdb_id INTEGER,
+                media_type TEXT,
+                title TEXT NOT NULL,
+                image_url TEXT,
+                score FLOAT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
         # Recommendations table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ai_recommendations (
@@ -64,20 +123,108 @@ class Database:
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Newest history timestamp the taste was built from, for incremental updates
+        self._ensure_column(cursor, 'user_taste', 'history_watermark', 'TIMESTAMP')
+
+        # Release year and comma-separated Plex genres, used for prompt histograms
+        for table in ('watch_history', 'shows'):
+            self._ensure_column(cursor, table, 'year', 'INTEGER')
+            self._ensure_column(cursor, table, 'genres', 'TEXT')
+
+        # Discovery results per request parameters, with the taste and history state they were built from
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS discovery_cache (
+                params_hash TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                taste_version TEXT,
+                history_watermark TEXT,
+                results TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+        # Map step summaries for map-reduce taste generation, keyed by a hash of the chunk
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS taste_chunk_summaries (
+                chunk_hash TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                item_count INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         
         self.conn.commit()
 
+    def _ensure_column(self, cursor, table, column, definition):
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
     # Functions for watch_history and all_items
-    def add_item(self, title, imdb_id, user_rating, resolution):
+    def add_item(self, title, imdb_id, user_rating, resolution, year=None, genres=None):
         """
         Insert a record for watch_history with user_id,
-        avoiding duplicates via the UNIQUE constraint on (user_id, imdb_id, resolution).
+        avoiding duplicates via the UNIQUE index on (user_id, imdb_id).
+        Year and genres are filled in on existing rows that were stored without them.
         """
         cursor = self.conn.cursor()
+        genres_text = ",".join(genres) if genres else None
+        cursor.execute('''
+            INSERT OR IGNORE INTO watch_history (user_id, title, imdb_id, user_rating, resolution, added_at, year, genres)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (self.user_id, title, imdb_id, user_rating, resolution, datetime.now(), year, genres_text))
+        if cursor.rowcount == 0 and (year or genres_text):
+            cursor.execute('''
+                UPDATE watch_history SET year = COALESCE(year, ?), genres = COALESCE(genres, ?)
+                WHERE user_id = ? AND imdb_id = ?
+            ''', (year, genres_text, self.user_id, imdb_id))
+        self.conn.commit()
+
+    def _upsert_show(self, cursor, title, imdb_id, user_rating, resolution, year=None, genres=None):
+        now = datetime.now()
         cursor.execute('''
-            INSERT INTO watch_history (user_id, title, imdb_id, user_rating, resolution, added_at)
+            INSERT OR IGNORE INTO shows (imdb_id, title, user_rating, resolution, first_watched_at, last_watched_at)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (self.user_id, title, imdb_id, user_rating, resolution, datetime.now()))
+        ''', (imdb_id, title, user_rating, resolution, now, now))
+        cursor.execute('''
+            UPDATE shows SET title = ?, user_rating = ?, resolution = ?,
+                             year = COALESCE(?, year), genres = COALESCE(?, genres)
+            WHERE imdb_id = ?
+        ''', (title, user_rating, resolution, year, ",".join(genres) if genres else None, imdb_id))
+        # Rows written by older versions kept the show itself in watch_history
+        cursor.execute('DELETE FROM watch_history WHERE imdb_id = ?', (imdb_id,))
+        cursor.execute('SELECT id FROM shows WHERE imdb_id = ?', (imdb_id,))
+        return cursor.fetchone()[0]
+
+    def add_show(self, title, imdb_id, user_rating, resolution, year=None, genres=None):
+        """
+        Insert or refresh a watched show without touching its episode summary.
+        """
+        cursor = self.conn.cursor()
+        self._upsert_show(cursor, title, imdb_id, user_rating, resolution, year, genres)
+        self.conn.commit()
+
+    def add_episode(self, show_title, show_imdb_id, show_rating, show_resolution,
+                    title, imdb_id, user_rating, show_year=None, show_genres=None):
+        """
+        Record a watched episode under its show. The show's watched_episodes and
+        last_watched_at summary only moves when the episode was not seen before.
+        """
+        cursor = self.conn.cursor()
+        show_id = self._upsert_show(cursor, show_title, show_imdb_id, show_rating, show_resolution,
+                                    show_year, show_genres)
+        now = datetime.now()
+        cursor.execute('''
+            INSERT INTO episodes (show_id, imdb_id, title, user_rating, added_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (show_id, imdb_id, title, user_rating, now))
+        if cursor.rowcount == 1:
+            cursor.execute('''
+                UPDATE shows
+                SET watched_episodes = watched_episodes + 1, last_watched_at = ?
+                WHERE id = ?
+            ''', (now, show_id))
+        cursor.execute('DELETE FROM watch_history WHERE imdb_id = ?', (imdb_id,))
         self.conn.commit()
 
     def add_all_item(self, title, imdb_id, user_rating, resolution):
@@ -93,6 +240,40 @@ class Database:
         cursor.execute('SELECT * FROM watch_history ORDER BY added_at DESC')
         return cursor.fetchall()
 
+    def get_history_summary(self, since=None):
+        """
+        Watched movies plus one aggregated row per show, newest first.
+        Rows are (id, title, imdb_id, user_rating, resolution, added_at, watched_episodes, media_type,
+        year, genres, first_seen_at), where watched_episodes is 0 for movies, added_at is the last
+        watch for shows, first_seen_at is when the movie or the show's first episode was recorded,
+        media_type is 'movie' for watch_history rows and 'tv' for shows, and genres is a
+        comma-separated string (year and genres may be NULL for rows stored before they were captured).
+        With since, only rows added (or shows watched) after that timestamp are returned.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, title, imdb_id, user_rating, resolution, added_at, 0 AS watched_episodes,
+                   'movie' AS media_type, year, genres, added_at AS first_seen_at
+            FROM watch_history
+            WHERE ? IS NULL OR added_at > ?
+            UNION ALL
+            SELECT id, title, imdb_id, user_rating, resolution, last_watched_at, watched_episodes,
+                   'tv' AS media_type, year, genres, first_watched_at
+            FROM shows
+            WHERE ? IS NULL OR last_watched_at > ?
+            ORDER BY 6 DESC
+        ''', (since, since, since, since))
+        return cursor.fetchall()
+
+    def get_imdb_ids_after(self, table, after_id=0):
+        """(id, imdb_id) rows of watch_history, shows or all_items with id > after_id, for incremental scans."""
+        if table not in ('watch_history', 'shows', 'all_items'):
+            raise ValueError(f"Unsupported table: {table}")
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT id, imdb_id FROM {table} WHERE id > ? AND imdb_id IS NOT NULL ORDER BY id',
+                       (after_id,))
+        return cursor.fetchall()
+
     def get_all_library_items(self):
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM all_items ORDER BY added_at DESC')
@@ -131,12 +312,12 @@ class Database:
         self.conn.commit()
 
     # Functions for user_taste
-    def add_user_taste(self, user_name, taste):
+    def add_user_taste(self, user_name, taste, history_watermark=None):
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO user_taste (user_name, taste)
-            VALUES (?, ?)
-        ''', (user_name, taste))
+            INSERT INTO user_taste (user_name, taste, history_watermark)
+            VALUES (?, ?, ?)
+        ''', (user_name, taste, history_watermark))
         self.conn.commit()
 
     def get_latest_user_taste(self, user_name):
@@ -144,8 +325,122 @@ class Database:
         cursor.execute('''
             SELECT taste FROM user_taste 
             WHERE user_name = ?
-            ORDER BY updated_at DESC 
+            ORDER BY updated_at DESC, id DESC
             LIMIT 1
         ''', (user_name,))
         row = cursor.fetchone()
         return row[0] if row else None
+
+    def get_latest_taste_record(self, user_name):
+        """
+        Return (taste, history_watermark) for the newest taste, or None.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT taste, history_watermark FROM user_taste
+            WHERE user_name = ?
+            ORDER BY updated_at DESC, id DESC
+            LIMIT 1
+        ''', (user_name,))
+        return cursor.fetchone()
+
+    def get_taste_version(self, user_name):
+        """Identifier of the newest taste row; changes whenever a taste is added."""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, updated_at FROM user_taste
+            WHERE user_name = ?
+            ORDER BY updated_at DESC, id DESC
+            LIMIT 1
+        ''', (user_name,))
+        row = cursor.fetchone()
+        return f"{row[0]}@{row[1]}" if row else None
+
+    def get_history_watermark(self):
+        """Newest added_at / last_watched_at across movies and shows, or None without history."""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT MAX(stamp) FROM (
+                SELECT MAX(added_at) AS stamp FROM watch_history
+                UNION ALL
+                SELECT MAX(last_watched_at) FROM shows
+            )
+        ''')
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    # Functions for discovery_cache
+    def get_discovery_cache(self, params_hash):
+        """Return (taste_version, history_watermark, results_json, created_at) or None."""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT taste_version, history_watermark, results, created_at
+            FROM discovery_cache WHERE params_hash = ?
+        ''', (params_hash,))
+        return cursor.fetchone()
+
+    def put_discovery_cache(self, params_hash, params, taste_version, history_watermark, results, max_age_seconds):
+        """Store discovery results for params_hash and drop entries older than max_age_seconds."""
+        now = time.time()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO discovery_cache
+                (params_hash, params, taste_version, history_watermark, results, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (params_hash, params, taste_version, history_watermark, results, now))
+        cursor.execute('DELETE FROM discovery_cache WHERE created_at < ?', (now - max_age_seconds,))
+        self.conn.commit()
+
+    # Functions for taste_chunk_summaries
+    def get_chunk_summaries(self, chunk_hashes):
+        """Return {chunk_hash: summary} for the hashes that were already summarized."""
+        if not chunk_hashes:
+            return {}
+        cursor = self.conn.cursor()
+        placeholders = ",".join("?" * len(chunk_hashes))
+        cursor.execute(
+            f'SELECT chunk_hash, summary FROM taste_chunk_summaries WHERE chunk_hash IN ({placeholders})',
+            list(chunk_hashes)
+        )
+        return dict(cursor.fetchall())
+
+    def add_chunk_summary(self, chunk_hash, summary, item_count):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO taste_chunk_summaries (chunk_hash, summary, item_count)
+            VALUES (?, ?, ?)
+        ''', (chunk_hash, summary, item_count))
+        self.conn.commit()
+
+    def prune_chunk_summaries(self, keep_hashes):
+        """Drop summaries of chunks that no longer exist in the history."""
+        cursor = self.conn.cursor()
+        placeholders = ",".join("?" * len(keep_hashes))
+        cursor.execute(
+            f'DELETE FROM taste_chunk_summaries WHERE chunk_hash NOT IN ({placeholders})',
+            list(keep_hashes)
+        )
+        self.conn.commit()
+
+    # Functions for candidates
+    def replace_candidates(self, candidates):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM candidates')
+        cursor.executemany('''
+            INSERT OR IGNORE INTO candidates (imdb_id, tmdb_id, media_type, title, image_url, score)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(c["imdb_id"], c.get("tmdb_id"), c.get("media_type"), c["title"],
+               c.get("image_url", ""), c.get("score", 0.0)) for c in candidates])
+        self.conn.commit()
+
+    def get_candidates(self, limit=None, max_age_seconds=None):
+        """Stored candidates, best first; with max_age_seconds only those stored within that time."""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT imdb_id, tmdb_id, media_type, title, image_url, score
+            FROM candidates
+            WHERE ? IS NULL OR created_at >= datetime('now', ?)
+            ORDER BY score DESC LIMIT ?
+        ''', (max_age_seconds, f"-{max_age_seconds} seconds", limit if limit is not None else -1))
+        keys = ["imdb_id", "tmdb_id", "media_type", "title", "image_url", "score"]
+        return [dict(zip(keys, row)) for row in cursor.fetchall()]
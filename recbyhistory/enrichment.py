@@ -0,0 +1,182 @@
+# recbyhistory/enrichment.py
+"""
+Poster enrichment for recommendations.
+
+All recommendations are resolved at once on a shared thread pool, over one pooled HTTP
+session, with a timeout per call and a deadline for the whole batch. Poster URLs are cached
+by IMDb ID, and items that already have an image_url are left alone.
+"""
+import os
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from config import (
+    ENRICH_WORKERS, ENRICH_CALL_TIMEOUT_SECONDS, ENRICH_DEADLINE_SECONDS, POSTER_CACHE_TTL_SECONDS
+)
+
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
+
+# Lookups that found nothing are retried sooner than successful ones
+POSTER_MISS_TTL_SECONDS = 600
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(ENRICH_WORKERS, 10))
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+# The pool outlives each batch so lookups that miss the deadline still finish and warm the cache
+_executor = ThreadPoolExecutor(max_workers=max(1, ENRICH_WORKERS), thread_name_prefix="enrich")
+
+_poster_cache = {}  # imdb_id -> (image_url or None, cached_at)
+_poster_lock = threading.Lock()
+
+
+def _cached_poster(imdb_id):
+    with _poster_lock:
+        entry = _poster_cache.get(imdb_id)
+    if not entry:
+        return False, None
+    image_url, cached_at = entry
+    ttl = POSTER_CACHE_TTL_SECONDS if image_url else POSTER_MISS_TTL_SECONDS
+    if time.time() - cached_at > ttl:
+        return False, None
+    return True, image_url
+
+
+def _store_poster(imdb_id, image_url):
+    with _poster_lock:
+        _poster_cache[imdb_id] = (image_url, time.time())
+
+
+def get_tmdb_poster(imdb_id, tmdb_api_key=None):
+    tmdb_api_key = tmdb_api_key or os.environ.get("TMDB_API_KEY")
+    if not tmdb_api_key or not imdb_id:
+        return None
+    url = f"{TMDB_BASE_URL}/find/{imdb_id}"
+    params = {
+        "api_key": tmdb_api_key,
+        "external_source": "imdb_id"
+    }
+    try:
+        r = session.get(url, params=params, timeout=ENRICH_CALL_TIMEOUT_SECONDS)
+        r.raise_for_status()
+        data = r.json()
+        results = data.get("movie_results", [])
+        if not results:
+            results = data.get("tv_results", [])
+        if results:
+            poster_path = results[0].get("poster_path")
+            if poster_path:
+                return TMDB_IMAGE_BASE_URL + poster_path
+    except Exception as e:
+        print(f"Error fetching TMDB poster for {imdb_id}: {e}")
+    return None
+
+
+def get_tmdb_details(tmdb_id, media_type, tmdb_api_key=None):
+    tmdb_api_key = tmdb_api_key or os.environ.get("TMDB_API_KEY")
+    if not tmdb_api_key:
+        return {}
+    path = "tv" if media_type == "tv" else "movie"
+    try:
+        r = session.get(f"{TMDB_BASE_URL}/{path}/{tmdb_id}", params={"api_key": tmdb_api_key},
+                        timeout=ENRICH_CALL_TIMEOUT_SECONDS)
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        logging.warning(f"Error fetching TMDb {path} details for {tmdb_id}: {e}")
+        return {}
+
+
+def find_poster(imdb_id, title, tmdb_api_key=None):
+    """
+    Resolve a poster URL: convert the IMDb ID through getimdbid, read the poster from the
+    TMDb details, and fall back to TMDb's find endpoint.
+    """
+    getimdbid_url = os.environ.get("GETIMDBID_URL", "http://getimdbid:5331")
+
+    # First guess if it's a movie or TV show based on title or other heuristics
+    likely_media_type = "movie"
+    if any(term in title.lower() for term in ["tv", "series", "show", "season"]):
+        likely_media_type = "tv"
+
+    try:
+        payload = {
+            "imdb_id": imdb_id,
+            "title": title,
+            "media_type": likely_media_type
+        }
+        response = session.post(f"{getimdbid_url}/convert_ids", json=payload,
+                                timeout=ENRICH_CALL_TIMEOUT_SECONDS)
+        if response.status_code == 200:
+            result = response.json()
+            tmdb_id = result.get("tmdb_id")
+            if tmdb_id:
+                details = get_tmdb_details(tmdb_id, result.get("media_type"), tmdb_api_key)
+                if details.get("poster_path"):
+                    image_url = f"{TMDB_IMAGE_BASE_URL}{details['poster_path']}"
+                    logging.info(f"Found image URL via convert_ids: {image_url}")
+                    return image_url
+            else:
+                logging.warning(f"No TMDb ID found for IMDb ID: {imdb_id}")
+        else:
+            logging.warning(f"convert_ids request failed with status {response.status_code}")
+    except Exception as e:
+        logging.error(f"Error using convert_ids for {title} ({imdb_id}): {e}")
+
+    # Fallback to direct method
+    image_url = get_tmdb_poster(imdb_id, tmdb_api_key)
+    if image_url:
+        logging.info(f"Found image URL via fallback method: {image_url}")
+    else:
+        logging.warning(f"No image found for {title} ({imdb_id})")
+    return image_url
+
+
+def _lookup_and_cache(imdb_id, title, tmdb_api_key):
+    image_url = find_poster(imdb_id, title, tmdb_api_key)
+    _store_poster(imdb_id, image_url)
+    return image_url
+
+
+def update_recommendations_with_images(recommendations, tmdb_api_key=None):
+    """Update recommendations with image URLs using the getimdbid service and the caller's TMDb key"""
+    pending = {}
+    for rec in recommendations:
+        imdb_id = rec.get("imdb_id")
+        if not imdb_id or rec.get("image_url"):
+            continue
+        hit, image_url = _cached_poster(imdb_id)
+        if hit:
+            if image_url:
+                rec["image_url"] = image_url
+            continue
+        pending.setdefault(imdb_id, []).append(rec)
+
+    logging.info(f"Updating {len(recommendations)} recommendations with images, {len(pending)} lookups needed")
+    if not pending:
+        return recommendations
+
+    futures = {
+        _executor.submit(_lookup_and_cache, imdb_id, recs[0].get("title", "UNKNOWN"), tmdb_api_key): imdb_id
+        for imdb_id, recs in pending.items()
+    }
+    done, not_done = wait(futures, timeout=ENRICH_DEADLINE_SECONDS)
+    for future in done:
+        imdb_id = futures[future]
+        try:
+            image_url = future.result()
+        except Exception as e:
+            logging.error(f"Error enriching {imdb_id}: {e}")
+            continue
+        if image_url:
+            for rec in pending[imdb_id]:
+                rec["image_url"] = image_url
+    if not_done:
+        logging.warning(f"{len(not_done)} poster lookups missed the {ENRICH_DEADLINE_SECONDS}s deadline")
+
+    return recommendations
@@ -0,0 +1,107 @@
+# recbyhistory/exclusions.py
+"""
+Per-user exclusion set for recommendations.
+
+Recommending a title the user already watched, already has in the Plex library, or already
+requested through watchlistrequests only produces a pointless Overseerr request or watchlist
+add downstream. Each user gets an in-memory set of those IMDb IDs, filled once and then
+topped up incrementally: new rows of watch_history, shows and all_items are read by row ID,
+and new requests are fetched from watchlistrequests' /api/requests with since_id. The set
+is rebuilt from scratch every EXCLUSION_REBUILD_SECONDS so titles that left the library
+stop being excluded.
+
+Recommendations are filtered against it before enrichment, so no poster lookups or LLM
+repair calls are spent on titles that would be dropped anyway.
+"""
+import time
+import logging
+import threading
+import requests
+from db import Database
+from config import WATCHLIST_URL, EXCLUSION_REFRESH_SECONDS, EXCLUSION_REBUILD_SECONDS
+
+LOCAL_SOURCES = ("watch_history", "shows", "all_items")
+
+
+class _UserExclusions:
+    def __init__(self):
+        self.ids = set()
+        self.last_ids = {source: 0 for source in LOCAL_SOURCES}
+        self.last_request_id = 0
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+
+_users = {}
+_users_lock = threading.Lock()
+
+
+def _fetch_requests(user_id, since_id):
+    """New watchlistrequests rows for user_id as (id, imdb_id); None when the service is unreachable."""
+    try:
+        r = requests.get(f"{WATCHLIST_URL}/api/requests",
+                         params={"user_id": user_id, "since_id": since_id}, timeout=5)
+        r.raise_for_status()
+        return [(row["id"], row.get("imdb_id")) for row in r.json()]
+    except Exception as e:
+        logging.warning(f"Could not fetch watchlist requests for user {user_id}: {e}")
+        return None
+
+
+def _refresh(user_id, state, now):
+    if now - state.built_at > EXCLUSION_REBUILD_SECONDS:
+        state.ids = set()
+        state.last_ids = {source: 0 for source in LOCAL_SOURCES}
+        state.last_request_id = 0
+        state.built_at = now
+
+    added = 0
+    db = Database(user_id)
+    try:
+        for source in LOCAL_SOURCES:
+            for row_id, imdb_id in db.get_imdb_ids_after(source, state.last_ids[source]):
+                state.ids.add(imdb_id)
+                state.last_ids[source] = row_id
+                added += 1
+    finally:
+        db.conn.close()
+
+    new_requests = _fetch_requests(user_id, state.last_request_id)
+    for request_id, imdb_id in new_requests or ():
+        if imdb_id:
+            state.ids.add(imdb_id)
+        state.last_request_id = max(state.last_request_id, request_id)
+        added += 1
+    state.refreshed_at = now
+    if added:
+        logging.info(f"Exclusion set for user {user_id}: +{added} rows, {len(state.ids)} IMDb IDs")
+
+
+def get_exclusions(user_id, force=False):
+    """The user's excluded IMDb IDs (watched, owned and requested), refreshed when due."""
+    with _users_lock:
+        state = _users.setdefault(user_id, _UserExclusions())
+    with state.lock:
+        now = time.time()
+        if force or now - state.refreshed_at > EXCLUSION_REFRESH_SECONDS:
+            try:
+                _refresh(user_id, state, now)
+            except Exception as e:
+                logging.error(f"Could not refresh exclusion set for user {user_id}: {e}")
+        return frozenset(state.ids)
+
+
+def filter_excluded(recommendations, excluded):
+    """Drop recommendations whose IMDb ID is in excluded, and duplicates."""
+    kept = []
+    seen = set()
+    for rec in recommendations:
+        imdb_id = rec.get("imdb_id")
+        if imdb_id in excluded or imdb_id in seen:
+            continue
+        seen.add(imdb_id)
+        kept.append(rec)
+    if len(kept) < len(recommendations):
+        logging.info(f"Excluded {len(recommendations) - len(kept)} watched, owned or requested recommendations")
+    return kept
@@ -25,6 +25,13 @@ class PlexHistory:
             logging.error(f"Error getting resolution for {item.title}: {e}")
             return "Unknown"
 
+    def get_item_genres(self, item):
+        try:
+            return [genre.tag for genre in (getattr(item, 'genres', None) or []) if genre.tag]
+        except Exception as e:
+            logging.error(f"Error getting genres for {item.title}: {e}")
+            return []
+
     def get_imdb_id(self, item):
         title = item.title if item.title else ""
         if not title:
@@ -74,6 +81,8 @@ class PlexHistory:
                         user_rating = self.get_user_rating(item)
                         imdb_id = self.get_imdb_id(item)
                         title = item.title if item.title else "Untitled"
+                        year = getattr(item, 'year', None)
+                        genres = self.get_item_genres(item)
 
                         # מוסיף ל-all_items (למשל db.add_all_item(...)) אם צריך
                         db.add_all_item(title, imdb_id, user_rating, resolution)
@@ -97,36 +106,43 @@ class PlexHistory:
                                         show_imdb = self.get_imdb_id(show)
                                         show_rating = show.userRating if (hasattr(show, 'userRating') and show.userRating != 0.0) else user_rating
                                         show_resolution = self.get_item_resolution(show)
+                                        show_year = getattr(show, 'year', None)
+                                        show_genres = self.get_item_genres(show)
 
-                                        # (1) Add the show-level record to watch_history as well
-                                        if show_imdb:
-                                            db.add_item(
-                                                title=show_title,
-                                                imdb_id=show_imdb,
-                                                user_rating=show_rating,
-                                                resolution=show_resolution
-                                            )
-
-                                        # (2) Continue adding the episode
                                         episode_rating = self.get_user_rating(item)
                                         if episode_rating == 0.0:
                                             episode_rating = show_rating
-                                        episode_imdb = self.get_imdb_id(item)
+                                        episode_imdb = imdb_id
                                         episode_resolution = resolution
 
-                                        grouped_episodes[show_title]['episodes'].append({
+                                        show_entry = grouped_episodes.setdefault(show_title, {
+                                            'title': show_title,
+                                            'imdbID': show_imdb,
+                                            'userRating': show_rating,
+                                            'resolution': show_resolution,
+                                            'episodes': []
+                                        })
+                                        show_entry['episodes'].append({
                                             'title': item.title,
                                             'imdbID': episode_imdb,
                                             'userRating': episode_rating,
                                             'resolution': episode_resolution
                                         })
 
-                                        db.add_item(
-                                            title=item.title,
-                                            imdb_id=episode_imdb,
-                                            user_rating=episode_rating,
-                                            resolution=episode_resolution
-                                        )
+                                        # The episode is stored under its show, which keeps
+                                        # the watched-count summary used for prompts
+                                        if show_imdb and episode_imdb:
+                                            db.add_episode(
+                                                show_title=show_title,
+                                                show_imdb_id=show_imdb,
+                                                show_rating=show_rating,
+                                                show_resolution=show_resolution,
+                                                title=item.title,
+                                                imdb_id=episode_imdb,
+                                                user_rating=episode_rating,
+                                                show_year=show_year,
+                                                show_genres=show_genres
+                                            )
                                         print(f"Added episode {item.title} to {show_title}")
                                     else:
                                         # אם לא הצלחנו למצוא show, נוסיף את הפרק כפריט רגיל
@@ -162,7 +178,9 @@ class PlexHistory:
                                     title=title,
                                     imdb_id=imdb_id,
                                     user_rating=user_rating,
-                                    resolution=resolution
+                                    resolution=resolution,
+                                    year=year,
+                                    genres=genres
                                 )
                                 print(f"Added movie {title}")
                             else:
@@ -174,11 +192,13 @@ class PlexHistory:
                                     'resolution': resolution
                                 }
                                 history.append(info)
-                                db.add_item(
+                                db.add_show(
                                     title=title,
                                     imdb_id=imdb_id,
                                     user_rating=user_rating,
-                                    resolution=resolution
+                                    resolution=resolution,
+                                    year=year,
+                                    genres=genres
                                 )
                                 print(f"Added show {title}")
 
@@ -0,0 +1,186 @@
+# recbyhistory/item_similarity.py
+"""
+Offline item-item collaborative filtering.
+
+Every user's watch history summary is loaded into a sparse user x item matrix, item columns
+are L2-normalized and the item-item cosine similarity is computed with one sparse product.
+Only the top-k neighbors per item that were co-watched by at least ITEM_SIM_MIN_SUPPORT users
+are kept, in a compact SQLite table clustered by item, so "users on this server who watched X
+also watched Y" is an indexed lookup.
+"""
+import os
+import logging
+import sqlite3
+from db import Database
+from config import DB_FOLDER, ITEM_SIM_TOP_K, ITEM_SIM_MIN_SUPPORT
+
+NEIGHBORS_FILE = os.path.join(DB_FOLDER, "item_neighbors.db")
+
+# Unrated titles (Plex reports 0.0) count as an average rating
+NEUTRAL_RATING = 6.0
+
+
+def connect():
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(NEIGHBORS_FILE, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            imdb_id TEXT PRIMARY KEY,
+            title TEXT,
+            media_type TEXT,
+            watchers INTEGER
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS item_neighbors (
+            imdb_id TEXT NOT NULL,
+            neighbor_imdb_id TEXT NOT NULL,
+            score REAL NOT NULL,
+            support INTEGER NOT NULL,
+            PRIMARY KEY (imdb_id, neighbor_imdb_id)
+        ) WITHOUT ROWID
+    ''')
+    return conn
+
+
+def load_interactions(user_ids):
+    """Return (user_index, item_index, values, items) gathered from every user's history."""
+    items = {}
+    rows, cols, values = [], [], []
+    for u, user_id in enumerate(user_ids):
+        try:
+            db = Database(user_id)
+            history = db.get_history_summary()
+            db.conn.close()
+        except Exception as e:
+            logging.error(f"Could not read history for user {user_id}: {e}")
+            continue
+        seen = set()
+        for row in history:
+            imdb_id = row[2]
+            if not imdb_id or imdb_id in seen:
+                continue
+            seen.add(imdb_id)
+            if imdb_id not in items:
+                items[imdb_id] = (len(items), row[1], row[7])
+            rows.append(u)
+            cols.append(items[imdb_id][0])
+            values.append((row[3] or NEUTRAL_RATING) / 10.0)
+    return rows, cols, values, items
+
+
+def top_k_neighbors(matrix, support, k):
+    """Yield (item, neighbor, score, support) for the k best neighbors of each item row."""
+    import numpy as np
+    matrix = matrix.tocsr()
+    support = support.tocsr()
+    support.sort_indices()
+    for i in range(matrix.shape[0]):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        if start == end:
+            continue
+        neighbors = matrix.indices[start:end]
+        scores = matrix.data[start:end]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+            neighbors, scores = neighbors[best], scores[best]
+        # Every kept pair is present in the support row, so a sorted search finds its count
+        s_start, s_end = support.indptr[i], support.indptr[i + 1]
+        positions = np.searchsorted(support.indices[s_start:s_end], neighbors)
+        counts = support.data[s_start:s_end][positions]
+        for j, score, count in zip(neighbors, scores, counts):
+            yield i, int(j), float(score), int(count)
+
+
+def build_item_neighbors(user_ids, k=ITEM_SIM_TOP_K, min_support=ITEM_SIM_MIN_SUPPORT):
+    """Rebuild the neighbor table from all users' histories; returns the number of rows stored."""
+    import numpy as np
+    import scipy.sparse as sp
+    rows, cols, values, items = load_interactions(user_ids)
+    if not items:
+        logging.info("No watch history found for item similarity; skipping.")
+        return 0
+
+    n_users, n_items = len(user_ids), len(items)
+    ratings = sp.csr_matrix((np.array(values, dtype=np.float32), (rows, cols)), shape=(n_users, n_items))
+    watched = ratings.copy()
+    watched.data[:] = 1.0
+
+    # Cosine similarity between item columns
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0))).ravel()
+    norms[norms == 0] = 1.0
+    normalized = ratings @ sp.diags(1.0 / norms)
+    similarity = (normalized.T @ normalized).tocsr()
+    support = (watched.T @ watched).tocsr()
+
+    # Drop self-similarity and pairs watched together by too few users
+    similarity.setdiag(0)
+    keep = support.multiply(support >= min_support)
+    similarity = similarity.multiply(keep > 0).tocsr()
+    similarity.eliminate_zeros()
+
+    imdb_by_index = {index: imdb_id for imdb_id, (index, _, _) in items.items()}
+    watchers = np.asarray(watched.sum(axis=0)).ravel()
+    neighbor_rows = [
+        (imdb_by_index[i], imdb_by_index[j], score, count)
+        for i, j, score, count in top_k_neighbors(similarity, support, k)
+    ]
+
+    conn = connect()
+    try:
+        with conn:
+            conn.execute('DELETE FROM items')
+            conn.execute('DELETE FROM item_neighbors')
+            conn.executemany(
+                'INSERT INTO items (imdb_id, title, media_type, watchers) VALUES (?, ?, ?, ?)',
+                [(imdb_id, title, media_type, int(watchers[index]))
+                 for imdb_id, (index, title, media_type) in items.items()]
+            )
+            conn.executemany(
+                'INSERT INTO item_neighbors (imdb_id, neighbor_imdb_id, score, support) VALUES (?, ?, ?, ?)',
+                neighbor_rows
+            )
+    finally:
+        conn.close()
+    logging.info(f"Item similarity rebuilt: {n_users} users, {n_items} items, {len(neighbor_rows)} neighbor rows")
+    return len(neighbor_rows)
+
+
+def get_also_watched(imdb_ids, limit=20, exclude=()):
+    """
+    Titles most often watched alongside imdb_ids, with their summed similarity.
+    Returns a list of {imdb_id, title, media_type, score, support}.
+    """
+    imdb_ids = list(dict.fromkeys(imdb_ids))
+    if not imdb_ids or not os.path.exists(NEIGHBORS_FILE):
+        return []
+    exclude = set(exclude) | set(imdb_ids)
+    conn = connect()
+    try:
+        totals = {}
+        # Chunk the lookup to stay under SQLite's host parameter limit
+        for i in range(0, len(imdb_ids), 500):
+            chunk = imdb_ids[i:i + 500]
+            for neighbor, score, support in conn.execute(
+                f'SELECT neighbor_imdb_id, score, support FROM item_neighbors WHERE imdb_id IN ({",".join("?" * len(chunk))})',
+                chunk
+            ):
+                if neighbor in exclude:
+                    continue
+                total = totals.setdefault(neighbor, [0.0, 0])
+                total[0] += score
+                total[1] = max(total[1], support)
+        ranked = sorted(totals.items(), key=lambda kv: kv[1][0], reverse=True)[:limit]
+        results = []
+        for neighbor, (score, support) in ranked:
+            row = conn.execute('SELECT title, media_type FROM items WHERE imdb_id = ?', (neighbor,)).fetchone()
+            results.append({
+                "imdb_id": neighbor,
+                "title": row[0] if row else None,
+                "media_type": row[1] if row else None,
+                "score": round(score, 4),
+                "support": support,
+            })
+        return results
+    finally:
+        conn.close()
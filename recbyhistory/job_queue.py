@@ -0,0 +1,186 @@
+# recbyhistory/job_queue.py
+"""
+Persistent background job queue for long-running generation work.
+
+Jobs are stored in DB_FOLDER/jobs.db and run on a bounded thread pool. A user can only
+have one queued or running job of each type (enforced by a partial unique index), so
+repeated requests attach to the existing job instead of starting another generation.
+Secrets such as API keys are only kept in memory and are never written to the table.
+"""
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_FOLDER, JOB_WORKERS, JOB_RETENTION_HOURS
+
+DB_PATH = os.path.join(DB_FOLDER, "jobs.db")
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_handlers = {}
+_secrets = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+def _connect():
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            job_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT,
+            needs_secrets INTEGER DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active
+        ON jobs (user_id, job_type) WHERE status IN ('queued', 'running')
+    ''')
+    return conn
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def register(job_type, handler):
+    """Register handler(user_id, **params) for a job type; its return value is the job result."""
+    _handlers[job_type] = handler
+
+
+def submit(user_id, job_type, params=None, secrets=None):
+    """
+    Queue a job and return (job_id, created). When the user already has an active job
+    of this type, that job's ID is returned with created=False.
+    """
+    if job_type not in _handlers:
+        raise ValueError(f"Unknown job type: {job_type}")
+    with _lock:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                'SELECT id FROM jobs WHERE user_id = ? AND job_type = ? AND status IN (?, ?)',
+                (user_id, job_type) + ACTIVE_STATUSES
+            ).fetchone()
+            if row:
+                return row[0], False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO jobs (id, user_id, job_type, status, params, needs_secrets, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, job_type, "queued", json.dumps(params or {}), 1 if secrets else 0, _now())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        if secrets:
+            _secrets[job_id] = secrets
+    _executor.submit(_run, job_id)
+    logging.info(f"Queued {job_type} job {job_id} for user {user_id}")
+    return job_id, True
+
+
+def _run(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT user_id, job_type, params FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return
+        user_id, job_type, params = row
+        # Claim the job atomically so a duplicate submission of the same ID cannot run it twice
+        claimed = conn.execute(
+            'UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?',
+            ("running", _now(), job_id, "queued")
+        ).rowcount
+        conn.commit()
+        if not claimed:
+            logging.info(f"{job_type} job {job_id} is no longer queued; not running it again")
+            return
+    finally:
+        conn.close()
+
+    kwargs = json.loads(params or "{}")
+    kwargs.update(_secrets.pop(job_id, {}))
+    try:
+        result = _handlers[job_type](user_id, **kwargs)
+        status, error = "done", None
+    except Exception as e:
+        logging.error(f"{job_type} job {job_id} for user {user_id} failed: {e}")
+        result, status, error = None, "failed", str(e)
+
+    conn = _connect()
+    try:
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+            (status, json.dumps(result) if result is not None else None, error, _now(), job_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    logging.info(f"{job_type} job {job_id} for user {user_id} finished with status {status}")
+
+
+def get_job(job_id, include_result=False):
+    """Return the job as a dict, or None when it does not exist."""
+    conn = _connect()
+    try:
+        row = conn.execute('''
+            SELECT id, user_id, job_type, status, error, created_at, started_at, finished_at, result
+            FROM jobs WHERE id = ?
+        ''', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    job = {
+        "job_id": row[0],
+        "user_id": row[1],
+        "job_type": row[2],
+        "status": row[3],
+        "error": row[4],
+        "created_at": row[5],
+        "started_at": row[6],
+        "finished_at": row[7],
+    }
+    if include_result:
+        job["result"] = json.loads(row[8]) if row[8] else None
+    return job
+
+
+def resume_jobs():
+    """
+    Requeue jobs left queued or running by a previous process and prune old finished jobs.
+    Jobs that depended on in-memory secrets cannot be resumed and are marked failed.
+    """
+    conn = _connect()
+    try:
+        conn.execute('''
+            UPDATE jobs SET status = 'failed', error = 'Interrupted by restart', finished_at = ?
+            WHERE status IN ('queued', 'running') AND needs_secrets = 1
+        ''', (_now(),))
+        conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        cutoff = (datetime.utcnow() - timedelta(hours=JOB_RETENTION_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+        conn.commit()
+        pending = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()]
+    finally:
+        conn.close()
+    for job_id in pending:
+        _executor.submit(_run, job_id)
+    if pending:
+        logging.info(f"Resumed {len(pending)} queued jobs")
@@ -0,0 +1,206 @@
+# recbyhistory/llm_dispatch.py
+"""
+Priority-aware admission control for Gemini calls.
+
+Every call made through llm_gateway takes a slot here first. Per model there is a limit on
+concurrent calls, requests per minute and tokens per minute (estimated from the prompt
+size). Waiting calls are admitted in priority order, so interactive requests (search,
+synchronous discovery) go ahead of background taste and monthly runs, and background work
+leaves the last concurrency slot free for interactive calls when the model allows two or more
+(with a limit of 1 it has to share the only slot, or it would never run). Interactive calls that would wait longer than
+LLM_INTERACTIVE_MAX_WAIT_SECONDS fail fast with LLMBusyError, which the API turns into
+429 with Retry-After. A rate-limit answer from the API pauses the model for a cooldown.
+"""
+import time
+import heapq
+import logging
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from config import (
+    LLM_MODEL_CONCURRENCY, LLM_RPM, LLM_TPM, LLM_MODEL_LIMITS,
+    LLM_INTERACTIVE_MAX_WAIT_SECONDS, LLM_RATE_LIMIT_COOLDOWN_SECONDS
+)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+WINDOW_SECONDS = 60
+CHARS_PER_TOKEN = 4
+
+_priority = contextvars.ContextVar("llm_priority", default=BACKGROUND)
+
+
+class LLMBusyError(Exception):
+    """Raised when an interactive call cannot be admitted within its wait budget."""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"LLM model {model} is over budget, retry in {retry_after}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+@contextmanager
+def interactive():
+    """Run the enclosed LLM calls (in this thread) at interactive priority."""
+    token = _priority.set(INTERACTIVE)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def estimate_tokens(*texts):
+    """Cheap token estimate from character counts; good enough for budgeting."""
+    return sum(len(text) for text in texts if text) // CHARS_PER_TOKEN + 1
+
+
+class _ModelBudget:
+    def __init__(self, model):
+        limits = LLM_MODEL_LIMITS.get(model, {})
+        self.model = model
+        self.concurrency = int(limits.get("concurrency", LLM_MODEL_CONCURRENCY))
+        self.rpm = int(limits.get("rpm", LLM_RPM))
+        self.tpm = int(limits.get("tpm", LLM_TPM))
+        self.in_flight = 0
+        self.window = deque()  # [timestamp, tokens] for calls admitted in the last minute
+        self.window_tokens = 0
+        self.blocked_until = 0.0
+        self.waiters = []      # heap of (priority, seq)
+        self.admitted = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _trim(self, now):
+        while self.window and self.window[0][0] <= now - WINDOW_SECONDS:
+            _, tokens = self.window.popleft()
+            self.window_tokens -= tokens
+
+    def wait_time(self, priority, tokens, now):
+        """Seconds until a call of this priority and size could start; 0 when it can start now."""
+        self._trim(now)
+        waits = [max(0.0, self.blocked_until - now)]
+        # Background work leaves one slot free for interactive calls, unless there is only one
+        limit = self.concurrency if priority == INTERACTIVE else max(1, self.concurrency - 1)
+        if self.in_flight >= limit:
+            waits.append(1.0)
+        if self.rpm and len(self.window) >= self.rpm:
+            waits.append(self.window[0][0] + WINDOW_SECONDS - now)
+        if self.tpm and self.window and self.window_tokens + tokens > self.tpm:
+            # Wait for enough of the window to expire to fit this call
+            freed = 0
+            for stamp, used in self.window:
+                freed += used
+                if self.window_tokens - freed + tokens <= self.tpm:
+                    waits.append(stamp + WINDOW_SECONDS - now)
+                    break
+            else:
+                waits.append(WINDOW_SECONDS)
+        return max(waits)
+
+
+_lock = threading.Lock()
+_cond = threading.Condition(_lock)
+_budgets = {}
+_seq = itertools.count()
+
+
+def _budget(model):
+    if model not in _budgets:
+        _budgets[model] = _ModelBudget(model)
+    return _budgets[model]
+
+
+@contextmanager
+def slot(model, tokens, priority=None):
+    """
+    Hold a dispatch slot for one call to model. Blocks until the call is admitted;
+    interactive calls raise LLMBusyError instead of waiting past their budget.
+    Yields a callable that replaces the token estimate with the count the API reported.
+    """
+    priority = current_priority() if priority is None else priority
+    deadline = time.monotonic() + LLM_INTERACTIVE_MAX_WAIT_SECONDS if priority == INTERACTIVE else None
+    with _cond:
+        budget = _budget(model)
+        entry = (priority, next(_seq))
+        heapq.heappush(budget.waiters, entry)
+        try:
+            while True:
+                now = time.time()
+                wait = budget.wait_time(priority, tokens, now)
+                if budget.waiters[0] == entry and wait <= 0:
+                    break
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    budget.rejected += 1
+                    raise LLMBusyError(model, max(1, int(wait + 0.999)))
+                timeout = wait if wait > 0 else 1.0
+                if deadline is not None:
+                    timeout = min(timeout, max(0.01, deadline - time.monotonic()))
+                _cond.wait(timeout)
+        finally:
+            budget.waiters.remove(entry)
+            heapq.heapify(budget.waiters)
+            _cond.notify_all()
+        budget.in_flight += 1
+        record = [time.time(), tokens]
+        budget.window.append(record)
+        budget.window_tokens += tokens
+        budget.admitted[priority] += 1
+
+    def report_tokens(actual):
+        if not actual:
+            return
+        with _cond:
+            if any(item is record for item in budget.window):
+                budget.window_tokens += actual - record[1]
+            record[1] = actual
+
+    try:
+        yield report_tokens
+    finally:
+        with _cond:
+            budget.in_flight -= 1
+            _cond.notify_all()
+
+
+def report_rate_limited(model):
+    """Pause a model after the API itself answered with a rate-limit error."""
+    with _cond:
+        budget = _budget(model)
+        budget.blocked_until = time.time() + LLM_RATE_LIMIT_COOLDOWN_SECONDS
+        budget.rate_limited += 1
+        _cond.notify_all()
+    logging.warning(f"LLM model {model} rate limited by the API, pausing for {LLM_RATE_LIMIT_COOLDOWN_SECONDS}s")
+
+
+def is_rate_limit_error(error):
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+def stats():
+    """Per-model usage and limits for monitoring."""
+    with _cond:
+        now = time.time()
+        result = {}
+        for model, budget in _budgets.items():
+            budget._trim(now)
+            result[model] = {
+                "in_flight": budget.in_flight,
+                "waiting": len(budget.waiters),
+                "requests_last_minute": len(budget.window),
+                "tokens_last_minute": budget.window_tokens,
+                "limits": {"concurrency": budget.concurrency, "rpm": budget.rpm, "tpm": budget.tpm},
+                "paused_for_seconds": max(0, int(budget.blocked_until - now)),
+                "admitted_interactive": budget.admitted[INTERACTIVE],
+                "admitted_background": budget.admitted[BACKGROUND],
+                "rejected": budget.rejected,
+                "rate_limited": budget.rate_limited,
+            }
+        return result
@@ -0,0 +1,185 @@
+# recbyhistory/llm_gateway.py
+"""
+Single entry point for Gemini calls.
+
+Clients are created once per API key and reused, and responses are cached in
+SQLite keyed by a hash of (model, system instruction, contents, config), so a
+repeated prompt returns without a paid call until its TTL runs out.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import llm_dispatch
+from config import DB_FOLDER, LLM_CACHE_TTL_SECONDS
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+CACHE_FILE = os.path.join(DB_FOLDER, "llm_cache.db")
+
+
+def get_client(api_key=None):
+    """Return the pooled Gemini client for api_key (defaults to GEMINI_API_KEY)."""
+    if api_key is None:
+        api_key = os.environ.get("GEMINI_API_KEY", "")
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            from google import genai  # deferred: the SDK adds ~0.4s to import time
+            client = genai.Client(api_key=api_key)
+            _clients[api_key] = client
+        return client
+
+
+def _connect():
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(CACHE_FILE, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    return conn
+
+
+def _dump(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+def cache_key(model, contents, config=None):
+    config_data = _dump(config) if config is not None else {}
+    payload = {
+        "model": model,
+        "system_instruction": config_data.pop("system_instruction", None),
+        "contents": _dump(contents),
+        "config": config_data,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def get_cached(key, ttl=None):
+    ttl = LLM_CACHE_TTL_SECONDS if ttl is None else ttl
+    conn = _connect()
+    try:
+        row = conn.execute(
+            'SELECT response FROM llm_cache WHERE cache_key = ? AND created_at >= ?',
+            (key, time.time() - ttl)
+        ).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def put_cached(key, model, response_text):
+    conn = _connect()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO llm_cache (cache_key, model, response, created_at) VALUES (?, ?, ?, ?)',
+            (key, model, response_text, time.time())
+        )
+        conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - LLM_CACHE_TTL_SECONDS,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _estimate(contents, config):
+    system_instruction = getattr(config, "system_instruction", None) if config is not None else None
+    return llm_dispatch.estimate_tokens(
+        contents if isinstance(contents, str) else json.dumps(contents, default=str),
+        system_instruction if isinstance(system_instruction, str) else None,
+    ) + (getattr(config, "max_output_tokens", None) or 0)
+
+
+def generate_content(model, contents, config=None, api_key=None, cache_ttl=None):
+    """
+    Run client.models.generate_content through the pooled client and return the response text.
+    Set cache_ttl=0 to bypass the cache for a call. Errors from the API are raised to the caller.
+    Cache misses wait for an llm_dispatch slot at the calling context's priority, which can
+    raise llm_dispatch.LLMBusyError for interactive calls.
+    """
+    use_cache = cache_ttl != 0
+    key = cache_key(model, contents, config) if use_cache else None
+    if use_cache:
+        try:
+            cached = get_cached(key, cache_ttl)
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            logging.info(f"LLM cache hit for {model} ({key[:12]})")
+            return cached
+
+    client = get_client(api_key)
+    with llm_dispatch.slot(model, _estimate(contents, config)) as report_tokens:
+        try:
+            response = client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            if llm_dispatch.is_rate_limit_error(e):
+                llm_dispatch.report_rate_limited(model)
+            raise
+        usage = getattr(response, "usage_metadata", None)
+        report_tokens(getattr(usage, "total_token_count", None))
+    text = response.text or ""
+
+    # Empty answers are not worth keeping, the next call should try again
+    if use_cache and text.strip():
+        try:
+            put_cached(key, model, text)
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache write failed: {e}")
+    return text
+
+
+def generate_content_stream(model, contents, config=None, api_key=None, cache_ttl=None, priority=None):
+    """
+    Streaming variant of generate_content: yields the response text in chunks as the model
+    produces it. A cache hit yields the whole cached text at once, and a completed stream is
+    cached like a normal call. The dispatch slot is held until the stream is exhausted or
+    closed; pass priority explicitly when the generator is consumed across threads.
+    """
+    use_cache = cache_ttl != 0
+    key = cache_key(model, contents, config) if use_cache else None
+    if use_cache:
+        try:
+            cached = get_cached(key, cache_ttl)
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            logging.info(f"LLM cache hit for {model} ({key[:12]})")
+            yield cached
+            return
+
+    client = get_client(api_key)
+    parts = []
+    with llm_dispatch.slot(model, _estimate(contents, config), priority) as report_tokens:
+        usage = None
+        try:
+            for chunk in client.models.generate_content_stream(model=model, contents=contents, config=config):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            if llm_dispatch.is_rate_limit_error(e):
+                llm_dispatch.report_rate_limited(model)
+            raise
+        report_tokens(getattr(usage, "total_token_count", None))
+
+    text = "".join(parts)
+    if use_cache and text.strip():
+        try:
+            put_cached(key, model, text)
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache write failed: {e}")
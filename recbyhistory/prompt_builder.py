@@ -0,0 +1,142 @@
+# recbyhistory/prompt_builder.py
+"""
+Token-budgeted watch history prompts.
+
+Instead of one line per watched title, the prompt carries a compact genre/decade profile of
+the whole history plus the highest scoring titles that fit the model's token budget. Titles
+are scored in one vectorized pass from the user's rating, how recently they were watched,
+and for shows how many episodes were watched.
+"""
+import logging
+from datetime import datetime
+from functools import lru_cache
+from llm_dispatch import estimate_tokens
+from config import (
+    PROMPT_TOKEN_BUDGET, PROMPT_MODEL_BUDGETS, PROMPT_RECENCY_HALF_LIFE_DAYS, PROMPT_HISTOGRAM_BINS
+)
+
+NEUTRAL_RATING = 6.0
+RATING_WEIGHT = 0.5
+RECENCY_WEIGHT = 0.3
+ENGAGEMENT_WEIGHT = 0.2
+
+
+_encoding_unavailable = False
+
+
+@lru_cache(maxsize=None)
+def get_token_encoding():
+    """The tiktoken encoder, built once per process."""
+    import tiktoken  # slow to import, so it is loaded on first use
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    """
+    tiktoken count of text. When the encoder cannot be loaded (its data is downloaded on first
+    use) this falls back to llm_dispatch's chars/4 estimate for the rest of the process.
+    """
+    global _encoding_unavailable
+    if not _encoding_unavailable:
+        try:
+            return len(get_token_encoding().encode(text))
+        except Exception as e:
+            _encoding_unavailable = True
+            logging.warning(f"tiktoken encoder unavailable, estimating prompt tokens instead: {e}")
+    return estimate_tokens(text)
+
+
+def token_budget(model):
+    return int(PROMPT_MODEL_BUDGETS.get(model, PROMPT_TOKEN_BUDGET))
+
+
+def score_items(rows, now=None):
+    """
+    Score get_history_summary rows; higher means more representative of the user's taste.
+    Unrated titles count as NEUTRAL_RATING, recency decays with PROMPT_RECENCY_HALF_LIFE_DAYS,
+    and show engagement grows with the log of the watched episode count.
+    """
+    import numpy as np
+    if not rows:
+        return np.zeros(0)
+    now = np.datetime64(now or datetime.now(), "s")
+    ratings = np.array([row[3] or NEUTRAL_RATING for row in rows], dtype=np.float64)
+    watched_at = np.array([str(row[5]) if row[5] else "NaT" for row in rows], dtype="datetime64[s]")
+    age_days = (now - watched_at).astype(np.float64) / 86400.0
+    age_days = np.where(np.isnat(watched_at), PROMPT_RECENCY_HALF_LIFE_DAYS, np.maximum(age_days, 0.0))
+    episodes = np.array([(row[6] or 0) if len(row) > 6 else 0 for row in rows], dtype=np.float64)
+
+    rating_score = np.clip(ratings / 10.0, 0.0, 1.0)
+    recency_score = np.exp2(-age_days / PROMPT_RECENCY_HALF_LIFE_DAYS)
+    engagement = np.log1p(episodes)
+    engagement_score = engagement / engagement.max() if engagement.max() > 0 else engagement
+    # Movies have no episode count; give them the median show engagement so they are not penalized
+    is_movie = episodes == 0
+    if (~is_movie).any():
+        engagement_score = np.where(is_movie, np.median(engagement_score[~is_movie]), engagement_score)
+    return RATING_WEIGHT * rating_score + RECENCY_WEIGHT * recency_score + ENGAGEMENT_WEIGHT * engagement_score
+
+
+def _histogram_line(label, counts, total):
+    top = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:PROMPT_HISTOGRAM_BINS]
+    return f"{label}: " + ", ".join(f"{name} {round(100 * n / total)}%" for name, n in top)
+
+
+def history_profile(rows):
+    """Compact genre, decade and media type distribution of the whole history."""
+    genres, decades, types = {}, {}, {}
+    for row in rows:
+        media_type = row[7] if len(row) > 7 else "movie"
+        types[media_type] = types.get(media_type, 0) + 1
+        year = row[8] if len(row) > 8 else None
+        if year:
+            decade = f"{int(year) // 10 * 10}s"
+            decades[decade] = decades.get(decade, 0) + 1
+        for genre in ((row[9] or "").split(",") if len(row) > 9 else []):
+            if genre.strip():
+                genres[genre.strip()] = genres.get(genre.strip(), 0) + 1
+    lines = [f"Watched titles: {len(rows)} ("
+             + ", ".join(f"{n} {'TV series' if t == 'tv' else 'movies'}" for t, n in sorted(types.items())) + ")"]
+    if genres:
+        lines.append(_histogram_line("Top genres", genres, sum(genres.values())))
+    if decades:
+        lines.append(_histogram_line("Decades", decades, sum(decades.values())))
+    return "\n".join(lines)
+
+
+def format_item(row):
+    rating = row[3] if row[3] else "N/A"
+    line = f"Watch History - Title: {row[1]}, IMDB ID: {row[2]}, User Rating: {rating}"
+    if len(row) > 8 and row[8]:
+        line += f", Year: {row[8]}"
+    if len(row) > 6 and row[6]:
+        line += f", Episodes Watched: {row[6]}"
+    return line
+
+
+def build_history_prompt(rows, model, budget=None):
+    """
+    History text for model that fits its token budget: the profile of the whole history,
+    then the highest scoring titles in score order until the budget is used up.
+    """
+    import numpy as np
+    rows = [row for row in rows if row[1] and row[2]]
+    if not rows:
+        return ""
+    budget = budget or token_budget(model)
+    profile = "User history profile\n" + history_profile(rows) + "\n\nMost representative titles:\n"
+    used = count_tokens(profile)
+    order = np.argsort(-score_items(rows), kind="stable")
+
+    lines = []
+    for i in order:
+        line = format_item(rows[i])
+        cost = count_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+
+    if len(lines) < len(rows):
+        logging.info(f"History prompt for {model}: {len(lines)} of {len(rows)} titles, ~{used} tokens")
+    return profile + "\n".join(lines) + "\n"
@@ -0,0 +1,230 @@
+# recbyhistory/query_cache.py
+"""
+Per-user semantic cache for AI search results.
+
+Queries are normalized (case, punctuation, stop words, plurals, decade spellings such as
+"90s" / "1990s" / "nineties") and embedded locally as hashed word and character-trigram
+vectors, so "90s sci-fi thrillers" and "sci-fi thrillers from the 1990s" land on the same
+entry. A lookup returns the cached results of the most similar earlier query when the
+cosine similarity reaches SEARCH_CACHE_SIMILARITY, its content words are the same apart from
+one-letter typos (so "female detective" never answers "male detective"), and the entry was
+built from the user's current taste within SEARCH_CACHE_TTL_SECONDS.
+
+Entries live in memory, in LRU order, bounded per user (SEARCH_CACHE_PER_USER) and in the
+number of users (SEARCH_CACHE_MAX_USERS).
+"""
+import re
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from config import (
+    SEARCH_CACHE_SIMILARITY, SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_PER_USER, SEARCH_CACHE_MAX_USERS
+)
+
+DIMENSIONS = 1024
+TRIGRAM_WEIGHT = 0.5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_DECADE_RE = re.compile(r"^(19|20)?(\d)0s$")
+
+STOP_WORDS = {
+    "a", "an", "the", "from", "of", "in", "on", "with", "and", "or", "for", "to", "about",
+    "me", "i", "some", "any", "like", "that", "are", "is", "set", "era", "good", "best", "find",
+    "give", "recommend", "something", "s",
+}
+# "show" is a verb in "show me ..." and a synonym of tv otherwise
+IMPERATIVE_OBJECTS = {"me", "us"}
+DECADE_WORDS = {
+    "fifties": "1950s", "sixties": "1960s", "seventies": "1970s", "eighties": "1980s",
+    "nineties": "1990s", "noughties": "2000s",
+}
+SYNONYMS = {
+    "scifi": ["sci", "fi"], "science": ["sci"], "fiction": ["fi"],
+    "film": ["movie"], "flick": ["movie"], "series": ["tv"], "show": ["tv"], "television": ["tv"],
+    "rom": ["romantic"], "com": ["comedy"], "romcom": ["romantic", "comedy"],
+}
+
+
+# Plurals of words ending in "ie", which the "ies" -> "y" rule would get wrong
+IE_PLURALS = {"movies", "zombies", "indies", "rookies", "hippies", "cookies", "genies", "pixies", "selfies"}
+# Words whose trailing "s" is not a plural
+NO_STEM = {"news", "series", "species", "chaos", "lens", "texas", "atlas", "christmas", "vegas", "mars",
+           "paris", "marvelous", "always", "perhaps", "whereas"}
+TYPO_MIN_LENGTH = 5
+
+
+def _stem(word):
+    if word in NO_STEM:
+        return word
+    if word in IE_PLURALS:
+        return word[:-1]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize(query):
+    """Canonical form of a query: sorted unique normalized tokens."""
+    tokens = set()
+    words = _WORD_RE.findall(query.lower())
+    for i, word in enumerate(words):
+        if word in STOP_WORDS:
+            continue
+        if word == "show" and i + 1 < len(words) and words[i + 1] in IMPERATIVE_OBJECTS:
+            continue
+        decade = _DECADE_RE.match(word)
+        if decade:
+            century = decade.group(1) or ("20" if decade.group(2) in "012" else "19")
+            tokens.add(f"{century}{decade.group(2)}0s")
+            continue
+        if word in DECADE_WORDS:
+            tokens.add(DECADE_WORDS[word])
+            continue
+        # Stem first so plurals and singulars reach the same synonym
+        stem = _stem(word)
+        tokens.update(SYNONYMS.get(stem) or SYNONYMS.get(word) or [stem])
+    return " ".join(sorted(tokens))
+
+
+def _one_edit_apart(a, b):
+    """True when a and b differ by one substitution, insertion or deletion."""
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i + (len(a) == len(b)):] == b[i + 1:]
+
+
+def same_content(normalized_a, normalized_b):
+    """True when two normalized queries share their words, allowing one-letter typos in longer words."""
+    a, b = set(normalized_a.split()), set(normalized_b.split())
+    only_a, only_b = sorted(a - b), sorted(b - a)
+    if len(only_a) != len(only_b):
+        return False
+    for word in only_a:
+        match = next((other for other in only_b
+                      if min(len(word), len(other)) >= TYPO_MIN_LENGTH and _one_edit_apart(word, other)), None)
+        if match is None:
+            return False
+        only_b.remove(match)
+    return True
+
+
+def embed(normalized):
+    """L2-normalized hashed vector of the normalized query's words and character trigrams."""
+    import numpy as np
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for token in normalized.split():
+        vector[zlib.crc32(token.encode("utf-8")) % DIMENSIONS] += 1.0
+        padded = f"#{token}#"
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(("3:" + padded[i:i + 3]).encode("utf-8")) % DIMENSIONS] += TRIGRAM_WEIGHT
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticQueryCache:
+    def __init__(self, threshold=SEARCH_CACHE_SIMILARITY, ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+                 per_user=SEARCH_CACHE_PER_USER, max_users=SEARCH_CACHE_MAX_USERS):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.per_user = per_user
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> OrderedDict(normalized -> entry), both in LRU order
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                          "expired": 0, "evictions": 0}
+
+    def get(self, user_id, query, taste_version=None):
+        """Cached results for the most similar earlier query, or None on a miss."""
+        import numpy as np
+        normalized = normalize(query)
+        now = time.time()
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries:
+                # Entries built from an older taste or past their TTL can never hit again
+                for key in [k for k, e in entries.items()
+                            if e["taste_version"] != taste_version or now - e["created_at"] > self.ttl_seconds]:
+                    del entries[key]
+                    self._counters["expired"] += 1
+            if not entries or not normalized:
+                self._counters["misses"] += 1
+                return None
+
+            if normalized in entries:
+                key, similarity = normalized, 1.0
+                self._counters["exact_hits"] += 1
+            else:
+                keys = list(entries)
+                scores = np.stack([entries[k]["vector"] for k in keys]) @ embed(normalized)
+                key, similarity = None, 0.0
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    if same_content(normalized, keys[i]):
+                        key, similarity = keys[i], float(scores[i])
+                        break
+                if key is None:
+                    self._counters["misses"] += 1
+                    return None
+                self._counters["semantic_hits"] += 1
+            self._counters["hits"] += 1
+            entries.move_to_end(key)
+            self._users.move_to_end(user_id)
+            entry = entries[key]
+            entry["hits"] += 1
+            return {"results": entry["results"], "query": entry["query"], "similarity": round(similarity, 3)}
+
+    def put(self, user_id, query, results, taste_version=None):
+        normalized = normalize(query)
+        if not normalized or not results:
+            return
+        entry = {"query": query, "vector": embed(normalized), "results": results,
+                 "taste_version": taste_version, "created_at": time.time(), "hits": 0}
+        with self._lock:
+            entries = self._users.setdefault(user_id, OrderedDict())
+            self._users.move_to_end(user_id)
+            entries[normalized] = entry
+            entries.move_to_end(normalized)
+            while len(entries) > self.per_user:
+                entries.popitem(last=False)
+                self._counters["evictions"] += 1
+            while len(self._users) > self.max_users:
+                _, evicted = self._users.popitem(last=False)
+                self._counters["evictions"] += len(evicted)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(
+                self._counters,
+                hit_rate=round(self._counters["hits"] / lookups, 3) if lookups else None,
+                users=len(self._users),
+                entries=sum(len(entries) for entries in self._users.values()),
+                threshold=self.threshold,
+            )
+
+
+search_cache = SemanticQueryCache()
+
+
+if __name__ == "__main__":
+    # Quick self-check of paraphrases that must share a cache entry: python query_cache.py
+    for a, b in [("horror movies", "horror films"), ("horror movies", "horror movie"),
+                 ("crime shows", "crime show"), ("show me crime series", "crime shows"),
+                 ("90s sci-fi thrillers", "sci-fi thrillers from the 1990s"),
+                 ("rom-coms", "romantic comedy")]:
+        assert normalize(a) == normalize(b), (a, normalize(a), b, normalize(b))
+    assert _stem("news") == "news" and _stem("thrillers") == "thriller"
+    cache = SemanticQueryCache()
+    cache.put("check", "slow burn scandinavian crime drama series with a female detective", [{"title": "x"}])
+    assert cache.get("check", "slow burn scandinavian crime drama series with a male detective") is None
+    assert cache.get("check", "slow burn scandinavian crime drama series with a female detectve") is not None
+    print("ok")
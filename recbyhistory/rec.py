@@ -1,53 +1,63 @@
 # recbyhistory/rec.py
-import os
 import time
 import json
 import re
+import hashlib
 import requests
-import tiktoken
-from google import genai
-from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
 from db import Database
-from config import ITEMS_PER_GROUP, OVERSEERR_URL, OVERSEERR_API_TOKEN
+import llm_gateway
+import llm_dispatch
+from llm_dispatch import LLMBusyError
+from enrichment import update_recommendations_with_images
+from prompt_builder import build_history_prompt, get_token_encoding
+from candidates import validate_imdb_ids
+from exclusions import get_exclusions, filter_excluded
+from credentials import Credentials, for_user, gemini_key, tmdb_key
+from config import (
+    ITEMS_PER_GROUP, OVERSEERR_URL, OVERSEERR_API_TOKEN,
+    INCREMENTAL_TASTE, TASTE_DELTA_MAX_ITEMS, TASTE_MAP_REDUCE, TASTE_MAP_WORKERS,
+    CANDIDATE_POOL_SIZE, CANDIDATE_MAX_AGE_SECONDS, LLM_REPAIR_ATTEMPTS, DISCOVERY_CACHE_TTL_SECONDS, DISCOVERY_CACHE_MAX_STALE_SECONDS
+)
 import logging
 import datetime
 from pathlib import Path
-import asyncio
-import nest_asyncio
+from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 
-# Apply nest_asyncio to allow nested event loops (important for thread contexts)
-try:
-    nest_asyncio.apply()
-except Exception as e:
-    print(f"Warning: Could not apply nest_asyncio: {e}")
-
 # Control variables
 NUM_MOVIES = 3
 NUM_SERIES = 2
 RATING_THRESHOLD = 5.0
 
-TMDB_API_KEY = os.environ.get("TMDB_API_KEY")
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
+# Model that writes recommendations; history prompts are budgeted for it
+RECOMMENDATION_MODEL = "gemini-2.0-flash-exp"
 
-def init_gemini_client():
-    """Initialize Gemini client with API key"""
-    try:        # Ensure we have an event loop in this thread
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            # If no event loop exists in this thread, create one
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-        return genai.Client(api_key=os.environ.get("GEMINI_API_KEY", ""))
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return None
+# Response schemas for structured output
+RECOMMENDATION_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "imdb_id": {"type": "STRING"},
+            "media_type": {"type": "STRING", "enum": ["movie", "tv"]},
+        },
+        "required": ["title", "imdb_id", "media_type"],
+    },
+}
+IMDB_ID_LIST_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+
+IMDB_ID_RE = re.compile(r"^tt\d{7,10}$")
+
+# google.genai.types is slow to import, so it is loaded on first use
+def generate_content_config(**kwargs):
+    from google.genai.types import GenerateContentConfig
+    return GenerateContentConfig(**kwargs)
 
-# Initialize tools
-google_search_tool = Tool(google_search=GoogleSearch())
+@lru_cache(maxsize=None)
+def google_search_tool():
+    from google.genai.types import Tool, GoogleSearch
+    return Tool(google_search=GoogleSearch())
 
 def setup_debug_logging():
     """Set up dedicated logging for debugging IMDB ID issues"""
@@ -79,199 +89,118 @@ def format_history_for_ai(group):
     prompt = ""
     for item in group:
         rating = item[3] if item[3] is not None else "N/A"
-        prompt += f"Watch History - Title: {item[1]}, IMDB ID: {item[2]}, User Rating: {rating}\n"
+        line = f"Watch History - Title: {item[1]}, IMDB ID: {item[2]}, User Rating: {rating}"
+        # Rows from get_history_summary carry the number of watched episodes for shows
+        if len(item) > 6 and item[6]:
+            line += f", Episodes Watched: {item[6]}"
+        prompt += line + "\n"
     return prompt
 
-def get_user_taste(all_groups_history):
+def get_user_taste(all_groups_history, credentials=None):
     if not all_groups_history.strip():
         return "No watch history available to determine user taste."
     
-    client = init_gemini_client()
-    if not client:
-        return "Error initializing AI client."
-        
     system_instruction = (
         "Analyze the following watch history and provide a detailed, authentic description of the user's taste in films and TV shows. "
         "Include preferred genres, styles, directors, and unique characteristics. Return only the detailed description."
     )
-    config = GenerateContentConfig(
+    config = generate_content_config(
         system_instruction=system_instruction,
         temperature=0.1,
         top_p=0.95,
         top_k=40,
         max_output_tokens=512,
         response_mime_type="text/plain",
-        tools=[google_search_tool],
+        tools=[google_search_tool()],
     )
     
     try:
-        response = client.models.generate_content(
+        response_text = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
             contents=all_groups_history,
             model="gemini-2.0-pro-exp-02-05",
             config=config,
         )
-        return response.text.strip()
+        return response_text.strip()
     except Exception as e:
         print(f"Error generating user taste: {e}")
         return "Error generating user taste profile."
 
-def get_ai_recommendations(all_groups_history, user_taste):
+def get_incremental_user_taste(previous_taste, new_history, credentials=None):
+    """
+    Update an existing taste description with only the newly watched titles.
+    Returns None when the model call fails so the caller can keep the previous profile.
+    """
+    system_instruction = (
+        "You maintain a detailed, authentic description of a user's taste in films and TV shows.\n"
+        "Current description:\n" + previous_taste + "\n\n"
+        "You will receive only the titles watched since that description was written. "
+        "Update the description to reflect them: keep what still holds, adjust or extend preferred genres, "
+        "styles, directors and unique characteristics where the new viewing shows a change. "
+        "Return only the full updated description."
+    )
+    config = generate_content_config(
+        system_instruction=system_instruction,
+        temperature=0.1,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=512,
+        response_mime_type="text/plain",
+        tools=[google_search_tool()],
+    )
+    try:
+        response_text = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
+            contents=new_history,
+            model="gemini-2.0-pro-exp-02-05",
+            config=config,
+        )
+        return response_text.strip() or None
+    except Exception as e:
+        print(f"Error updating user taste incrementally: {e}")
+        return None
+
+def get_ai_recommendations(all_groups_history, user_taste, credentials=None,
+                           num_movies=NUM_MOVIES, num_series=NUM_SERIES, avoid=()):
     logging.info("Starting AI recommendation generation")
-    client = init_gemini_client()
-    if not client:
-        logging.error("Failed to initialize Gemini client")
-        return "[]"
     
-    # Format very explicitly to ensure valid JSON output
     system_instruction = (
         "You will receive a user's watch history and taste description.\n"
         "User Taste: " + user_taste + "\n\n"
-        "The watch history format is:\n"
+        "The watch history starts with a profile of the user's genres and decades, followed by\n"
+        "their most representative titles in the format:\n"
         "Watch History - Title: <title>, IMDB ID: <imdbID>, User Rating: <userRating>\n\n"
-        f"Your task is to recommend exactly {NUM_MOVIES} movies and {NUM_SERIES} TV series.\n"
+        f"Your task is to recommend exactly {num_movies} movies and {num_series} TV series.\n"
         "Do NOT recommend items that appear in the watch history.\n"
-        "FORMAT: Return a JSON array with objects having exactly these fields:\n"
-        "- \"title\": The title of the movie or show\n"
-        "- \"imdb_id\": A valid IMDb ID starting with 'tt' followed by numbers\n"
-        "- \"image_url\": Can be empty string or omitted\n"
-        "EXAMPLE OUTPUT:\n"
-        "[{\"title\":\"The Godfather\",\"imdb_id\":\"tt0068646\",\"image_url\":\"\"}]\n"
-        "IMPORTANT: Return ONLY valid JSON with NO explanations or markdown formatting."
+        + avoid_instruction(avoid) +
+        "Every imdb_id must be the real IMDb ID of that title, 'tt' followed by digits."
     )
     
-    config = GenerateContentConfig(
+    # The response schema constrains the answer to the expected JSON; Gemini does not allow
+    # a schema together with the search tool, so titles are checked against the catalog instead
+    config = generate_content_config(
         system_instruction=system_instruction,
         temperature=0.7,
         top_p=0.95,
         top_k=40,
         max_output_tokens=8192,
-        response_mime_type="application/json",  # Specify JSON output format
-        tools=[google_search_tool],
+        response_mime_type="application/json",
+        response_schema=RECOMMENDATION_SCHEMA,
     )
     
     try:
-        response = client.models.generate_content(
+        response_text = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
             contents=all_groups_history,
-            model="gemini-2.0-flash-exp",
+            model=RECOMMENDATION_MODEL,
             config=config,
         )
         logging.info("Successfully received AI response")
-        return response.text
+        return response_text
     except Exception as e:
         logging.error(f"Error generating recommendations: {e}")
         return "[]" # Return empty JSON array on error
 
-def get_tmdb_poster(imdb_id):
-    if not TMDB_API_KEY or not imdb_id:
-        return None
-    url = f"{TMDB_BASE_URL}/find/{imdb_id}"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "external_source": "imdb_id"
-    }
-    try:
-        r = requests.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("movie_results", [])
-        if not results:
-            results = data.get("tv_results", [])
-        if results:
-            poster_path = results[0].get("poster_path")
-            if poster_path:
-                return TMDB_IMAGE_BASE_URL + poster_path
-    except Exception as e:
-        print(f"Error fetching TMDB poster for {imdb_id}: {e}")
-    return None
-
-def update_recommendations_with_images(recommendations):
-    """Update recommendations with image URLs using the getimdbid service"""
-    logging.info(f"Updating {len(recommendations)} recommendations with images")
-    getimdbid_url = os.environ.get("GETIMDBID_URL", "http://getimdbid:5331")
-    updated = []
-    
-    for i, rec in enumerate(recommendations):
-        imdb_id = rec.get("imdb_id")
-        title = rec.get("title", "UNKNOWN")
-        logging.info(f"Finding image for recommendation #{i+1}: '{title}', IMDB_ID='{imdb_id}'")
-        
-        # Try using convert_ids endpoint first
-        try:
-            # First guess if it's a movie or TV show based on title or other heuristics
-            likely_media_type = "movie"  # Default to movie
-            if any(term in title.lower() for term in ["tv", "series", "show", "season"]):
-                likely_media_type = "tv"
-                
-            # Make request to convert_ids endpoint
-            payload = {
-                "imdb_id": imdb_id,
-                "title": title,
-                "media_type": likely_media_type
-            }
-            
-            response = requests.post(f"{getimdbid_url}/convert_ids", json=payload, timeout=10)
-            if response.status_code == 200:
-                result = response.json()
-                tmdb_id = result.get("tmdb_id")
-                
-                # If we got a TMDb ID, fetch the poster
-                if tmdb_id:
-                    # Construct TMDb poster URL
-                    poster_path = None
-                    # Try to use the poster info from convert_ids if available
-                    # Otherwise construct TMDB URL directly
-                    if result.get("media_type") == "tv":
-                        # TV shows
-                        tv_details = get_tv_details(tmdb_id)
-                        if tv_details and tv_details.get("poster_path"):
-                            poster_path = tv_details.get("poster_path")
-                    else:
-                        # Movies
-                        movie_details = get_movie_details(tmdb_id)
-                        if movie_details and movie_details.get("poster_path"):
-                            poster_path = movie_details.get("poster_path")
-                    
-                    if poster_path:
-                        rec["image_url"] = f"{TMDB_IMAGE_BASE_URL}{poster_path}"
-                        logging.info(f"Found image URL via convert_ids: {rec['image_url']}")
-                    else:
-                        # Fallback to direct method
-                        tmdb_url = get_tmdb_poster(imdb_id)
-                        if tmdb_url:
-                            rec["image_url"] = tmdb_url
-                            logging.info(f"Found image URL via fallback method: {tmdb_url}")
-                        else:
-                            logging.warning(f"No image found for TMDb ID: {tmdb_id}")
-                else:
-                    # Fallback to direct method
-                    tmdb_url = get_tmdb_poster(imdb_id)
-                    if tmdb_url:
-                        rec["image_url"] = tmdb_url
-                        logging.info(f"Found image URL via fallback method: {tmdb_url}")
-                    else:
-                        logging.warning(f"No TMDb ID found for IMDb ID: {imdb_id}")
-            else:
-                # Fallback to direct method if convert_ids fails
-                tmdb_url = get_tmdb_poster(imdb_id)
-                if tmdb_url:
-                    rec["image_url"] = tmdb_url
-                    logging.info(f"Found image URL via fallback method: {tmdb_url}")
-                else:
-                    logging.warning(f"convert_ids request failed with status {response.status_code}")
-        except Exception as e:
-            logging.error(f"Error using convert_ids for {title} ({imdb_id}): {e}")
-            # Fallback to direct method
-            tmdb_url = get_tmdb_poster(imdb_id)
-            if tmdb_url:
-                rec["image_url"] = tmdb_url
-                logging.info(f"Found image URL via fallback method: {tmdb_url}")
-            else:
-                logging.warning(f"Fallback lookup also failed for {imdb_id}")
-                
-        updated.append(rec)
-    
-    return updated
-
 def clean_json_output(text):
     logging.info(f"Starting JSON cleaning, raw text length: {len(text)}")
     
@@ -311,12 +240,11 @@ def clean_json_output(text):
     logging.info(f"Final cleaned JSON length: {len(cleaned)}")
     return cleaned
 
-def filter_new_recommendations(recommendations, watch_history):
-    watched_imdbs = {item[2] for item in watch_history}
-    logging.info(f"Filtering against {len(watched_imdbs)} watched IMDB IDs")
-    logging.debug(f"Watched IMDB IDs: {list(watched_imdbs)[:10]}...")
+def filter_new_recommendations(recommendations, excluded):
+    """Drop recommendations that are watched, owned or already requested (see exclusions.py)."""
+    logging.info(f"Filtering against {len(excluded)} excluded IMDB IDs")
     
-    filtered = [rec for rec in recommendations if rec.get("imdb_id") not in watched_imdbs]
+    filtered = filter_excluded(recommendations, excluded)
     logging.info(f"After filtering: {len(filtered)}/{len(recommendations)} recommendations remaining")
     
     for i, rec in enumerate(filtered):
@@ -326,32 +254,24 @@ def filter_new_recommendations(recommendations, watch_history):
     
     return filtered
 
-def print_history_groups(db):
-    log_file = setup_debug_logging()
-    logging.info(f"Starting recommendation process for user {db.user_id}, debug log: {log_file}")
-    
-    raw_items = db.get_all_items()
-    logging.info(f"Retrieved {len(raw_items)} raw history items")
-    
-    # Break early if no items
-    if not raw_items:
-        print("No watch history available. Skipping recommendations.")
-        return
-    
+def get_unique_history(db, since=None):
+    """History summary rows with an IMDb ID, one per IMDb ID."""
     unique_items = []
     seen = set()
-    for item in raw_items:
+    for item in db.get_history_summary(since):
         if item[2] and item[2] not in seen:
             seen.add(item[2])
             unique_items.append(item)
-    
-    # Break early if no unique items
-    if not unique_items:
-        print("No valid watch history with IMDB IDs. Skipping recommendations.")
-        return
-    
+    return unique_items
+
+def history_watermark(items):
+    """Newest added_at among the rows, used to find what was watched after a taste was built."""
+    stamps = [str(item[5]) for item in items if item[5]]
+    return max(stamps) if stamps else None
+
+def build_groups_history(unique_items):
     all_groups_history = ""
-    encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_token_encoding()
     
     for i in range(0, len(unique_items), ITEMS_PER_GROUP):
         group = unique_items[i:i + ITEMS_PER_GROUP]
@@ -359,65 +279,359 @@ def print_history_groups(db):
         token_count = len(encoding.encode(group_history))
         print(f"Group {(i // ITEMS_PER_GROUP) + 1} token count: {token_count}")
         all_groups_history += group_history + "\n" + ("-" * 50) + "\n"
-    
-    if not all_groups_history.strip():
-        print("No watch history available. Skipping recommendations.")
-        return
-    
-    # Get user taste
+    return all_groups_history
+
+CHUNK_SUMMARY_VERSION = "v2"
+
+def use_map_reduce(unique_items):
+    if TASTE_MAP_REDUCE == "true":
+        return True
+    if TASTE_MAP_REDUCE == "auto":
+        return len(unique_items) > ITEMS_PER_GROUP
+    return False
+
+def summarize_history_chunk(chunk_history, credentials=None):
+    """Map step: describe the viewing patterns of one chunk of history."""
+    system_instruction = (
+        "You will receive one portion of a user's watch history. "
+        "Summarize the viewing patterns it shows: preferred genres, styles, directors, eras, "
+        "recurring themes and how the user rated what they watched. Mention a few representative titles. "
+        "Return only the summary."
+    )
+    config = generate_content_config(
+        system_instruction=system_instruction,
+        temperature=0.1,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=512,
+        response_mime_type="text/plain",
+    )
+    response_text = llm_gateway.generate_content(
+        api_key=gemini_key(credentials),
+        contents=chunk_history,
+        model="gemini-2.0-flash-exp",
+        config=config,
+    )
+    return response_text.strip()
+
+def summarize_history_chunks(db, unique_items, credentials=None):
+    """
+    Split the history into ITEMS_PER_GROUP chunks and return one summary per chunk.
+
+    Items are ordered by when they were first seen, which never changes (a show that gets a
+    new episode keeps its place), so new viewing lands in the last chunk and earlier chunks
+    keep their hash. The hash covers each item's IMDb ID, title and rating but not volatile
+    counts such as episodes watched. Summaries are stored per chunk hash, so only new or
+    changed chunks are sent to the model, concurrently on up to TASTE_MAP_WORKERS threads.
+    """
+    ordered = sorted(unique_items, key=lambda item: (str(item[10] or ""), item[2]))
+    chunks = []
+    for i in range(0, len(ordered), ITEMS_PER_GROUP):
+        group = ordered[i:i + ITEMS_PER_GROUP]
+        chunk_history = format_history_for_ai(group)
+        chunk_identity = "\n".join(f"{item[2]}|{item[1]}|{item[3]}" for item in group)
+        chunk_hash = hashlib.sha256((CHUNK_SUMMARY_VERSION + chunk_identity).encode("utf-8")).hexdigest()
+        chunks.append((chunk_hash, chunk_history, len(group)))
+
+    summaries = db.get_chunk_summaries([chunk_hash for chunk_hash, _, _ in chunks])
+    missing = [chunk for chunk in chunks if chunk[0] not in summaries]
+    print(f"History split into {len(chunks)} chunks, {len(missing)} need summarizing")
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, TASTE_MAP_WORKERS)) as executor:
+            futures = {
+                executor.submit(summarize_history_chunk, chunk_history, credentials): (chunk_hash, item_count)
+                for chunk_hash, chunk_history, item_count in missing
+            }
+            for future, (chunk_hash, item_count) in futures.items():
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    print(f"Error summarizing history chunk {chunk_hash[:12]}: {e}")
+                    continue
+                if summary:
+                    # The SQLite connection belongs to this thread, so writes happen here
+                    db.add_chunk_summary(chunk_hash, summary, item_count)
+                    summaries[chunk_hash] = summary
+
+    db.prune_chunk_summaries([chunk_hash for chunk_hash, _, _ in chunks])
+    return [summaries[chunk_hash] for chunk_hash, _, _ in chunks if chunk_hash in summaries]
+
+def format_chunk_summaries(chunk_summaries):
+    return "\n".join(
+        f"Watch History Summary {i + 1}:\n{summary}\n" + ("-" * 50)
+        for i, summary in enumerate(chunk_summaries)
+    )
+
+def reduce_taste_summaries(chunk_summaries, credentials=None):
+    """Reduce step: merge per-chunk summaries into one taste description."""
+    if not chunk_summaries:
+        return "No watch history available to determine user taste."
+    system_instruction = (
+        "You will receive summaries of consecutive portions of one user's watch history, oldest first. "
+        "Merge them into a single detailed, authentic description of the user's taste in films and TV shows. "
+        "Include preferred genres, styles, directors, and unique characteristics, giving more weight to recent viewing. "
+        "Return only the detailed description."
+    )
+    config = generate_content_config(
+        system_instruction=system_instruction,
+        temperature=0.1,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=512,
+        response_mime_type="text/plain",
+    )
+    try:
+        response_text = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
+            contents=format_chunk_summaries(chunk_summaries),
+            model="gemini-2.0-pro-exp-02-05",
+            config=config,
+        )
+        return response_text.strip()
+    except Exception as e:
+        print(f"Error merging taste summaries: {e}")
+        return "Error generating user taste profile."
+
+def update_user_taste(db, unique_items=None, all_groups_history=None, credentials=None):
+    """
+    Refresh the stored taste for db.user_id and return it.
+
+    When a previous taste has a history watermark, only the titles watched since then are
+    sent along with the previous profile. A full rebuild from the whole history happens when
+    there is no usable previous taste or more than TASTE_DELTA_MAX_ITEMS titles were added.
+    """
+    previous = db.get_latest_taste_record(db.user_id)
+    prev_taste = previous[0] if previous else None
+
+    if INCREMENTAL_TASTE and previous and previous[1]:
+        prev_watermark = previous[1]
+        delta_items = get_unique_history(db, since=prev_watermark)
+        if not delta_items:
+            print("No new watch history since the last taste profile, keeping it.")
+            return prev_taste
+        if len(delta_items) <= TASTE_DELTA_MAX_ITEMS:
+            print(f"Updating user taste from {len(delta_items)} new history items...")
+            new_taste = get_incremental_user_taste(prev_taste, format_history_for_ai(delta_items), credentials)
+            if not new_taste:
+                return prev_taste
+            print("--- Updated User Taste ---")
+            print(new_taste)
+            db.add_user_taste(db.user_id, new_taste, history_watermark(delta_items))
+            return new_taste
+        print(f"{len(delta_items)} new history items exceed TASTE_DELTA_MAX_ITEMS, rebuilding taste.")
+
+    if unique_items is None:
+        unique_items = get_unique_history(db)
+    if not unique_items:
+        print("No watch history available. Skipping taste generation.")
+        return prev_taste
     print("Generating user taste...")
-    new_taste = get_user_taste(all_groups_history)
+    if use_map_reduce(unique_items):
+        new_taste = reduce_taste_summaries(summarize_history_chunks(db, unique_items, credentials), credentials)
+    else:
+        if all_groups_history is None:
+            all_groups_history = build_groups_history(unique_items)
+        new_taste = get_user_taste(all_groups_history, credentials)
     print("--- New User Taste ---")
     print(new_taste)
     
     # Compare with previous taste
-    prev_taste = db.get_latest_user_taste(db.user_id)
     chosen_taste = prev_taste if prev_taste and len(new_taste.split()) < len(prev_taste.split()) else new_taste
     print("--- Chosen User Taste ---")
     print(chosen_taste)
-    db.add_user_taste(db.user_id, chosen_taste)
+    db.add_user_taste(db.user_id, chosen_taste, history_watermark(unique_items))
+    return chosen_taste
+
+def parse_recommendations(response_text):
+    """Parse a schema-constrained answer; anything that is not a JSON array counts as empty."""
+    try:
+        parsed = json.loads(response_text or "[]")
+    except json.JSONDecodeError as e:
+        logging.error(f"Structured output was not valid JSON: {e}")
+        return []
+    if not isinstance(parsed, list):
+        logging.error(f"Structured output was not a JSON array: {type(parsed).__name__}")
+        return []
+    return [item for item in parsed if isinstance(item, dict)]
+
+def avoid_instruction(avoid):
+    """Prompt line listing IMDb IDs the model must not return again."""
+    if not avoid:
+        return ""
+    return "Do NOT recommend any of these IMDb IDs: " + ", ".join(sorted(avoid)) + "\n"
+
+def validate_recommendations(proposed, exclude=()):
+    """
+    Split proposed recommendations into usable ones and rejected IMDb IDs.
+    IDs are checked for format and then against the local catalog in one bulk lookup; the
+    catalog's media type wins over the model's. IDs the catalog could not check are kept.
+    """
+    well_formed = []
+    rejected = set()
+    for rec in proposed:
+        imdb_id = str(rec.get("imdb_id") or "").strip()
+        if not IMDB_ID_RE.match(imdb_id) or not rec.get("title"):
+            logging.error(f"Invalid recommendation: Title='{rec.get('title')}', IMDB_ID='{imdb_id}'")
+            if imdb_id:
+                rejected.add(imdb_id)
+            continue
+        if imdb_id in exclude:
+            rejected.add(imdb_id)
+            continue
+        well_formed.append(dict(rec, imdb_id=imdb_id))
+
+    catalog = validate_imdb_ids([rec["imdb_id"] for rec in well_formed])
+    valid = []
+    for rec in well_formed:
+        info = catalog.get(rec["imdb_id"], {})
+        if info is None:
+            logging.error(f"IMDb ID not found in catalog: Title='{rec['title']}', IMDB_ID='{rec['imdb_id']}'")
+            rejected.add(rec["imdb_id"])
+            continue
+        media_type = info.get("media_type") or rec.get("media_type")
+        valid.append({
+            "title": rec["title"],
+            "imdb_id": rec["imdb_id"],
+            "image_url": rec.get("image_url") or "",
+            "media_type": "tv" if media_type in ("tv", "show", "series") else "movie",
+        })
+    return valid, rejected
+
+def collect_valid_recommendations(ask, num_movies, num_series, exclude=()):
+    """
+    Ask the model for recommendations and keep the ones that pass validation.
+    ask(num_movies, num_series, avoid) returns parsed recommendation dicts. When validation
+    leaves a quota short, up to LLM_REPAIR_ATTEMPTS follow-up calls ask for just the missing
+    movies/series, listing the IDs already used or rejected, instead of regenerating everything.
+    """
+    exclude = set(exclude)
+    picked, rejected = [], set()
+    for attempt in range(1 + LLM_REPAIR_ATTEMPTS):
+        missing_movies = num_movies - sum(1 for rec in picked if rec["media_type"] == "movie")
+        missing_series = num_series - sum(1 for rec in picked if rec["media_type"] == "tv")
+        if missing_movies <= 0 and missing_series <= 0:
+            break
+        avoid = rejected | {rec["imdb_id"] for rec in picked}
+        if attempt:
+            logging.info(f"Repair call for {max(0, missing_movies)} movies and {max(0, missing_series)} "
+                         f"series, avoiding {len(avoid)} IDs")
+        try:
+            proposed = ask(max(0, missing_movies), max(0, missing_series), avoid)
+        except LLMBusyError:
+            if not attempt:
+                raise
+            # Keep what the first call produced rather than failing the whole request
+            logging.warning("LLM busy, skipping the repair call")
+            break
+        valid, invalid = validate_recommendations(proposed, exclude | avoid)
+        rejected |= invalid
+        picked += _pick_by_type(valid, missing_movies, missing_series)
+    logging.info(f"Kept {len(picked)} validated recommendations, rejected {len(rejected)} IDs")
+    return picked
+
+def generate_llm_recommendations(all_groups_history, chosen_taste, credentials=None, exclude=()):
+    """Ask the model for recommendations from the history itself and keep the valid ones."""
+    def ask(num_movies, num_series, avoid):
+        print("Processing recommendations...")
+        return parse_recommendations(get_ai_recommendations(
+            all_groups_history, chosen_taste, credentials, num_movies, num_series, avoid
+        ))
+    return collect_valid_recommendations(ask, NUM_MOVIES, NUM_SERIES, exclude)
+
+def _pick_by_type(ordered, num_movies, num_series):
+    """Take candidates in order until the movie and series quotas are filled."""
+    quotas = {"movie": num_movies, "tv": num_series}
+    picked = []
+    seen = set()
+    for cand in ordered:
+        if cand["imdb_id"] in seen or quotas.get(cand.get("media_type"), 0) <= 0:
+            continue
+        seen.add(cand["imdb_id"])
+        quotas[cand["media_type"]] -= 1
+        picked.append({
+            "title": cand["title"],
+            "imdb_id": cand["imdb_id"],
+            "image_url": cand.get("image_url", ""),
+            "media_type": cand["media_type"],
+        })
+    return picked
+
+def rerank_candidates(candidates, user_taste, num_movies, num_series, extra_elements="", credentials=None):
+    """
+    Let the model choose among locally generated candidates instead of inventing titles.
+    Anything it does not pick (or a failed call) is filled from the candidates' own scores.
+    """
+    listing = "\n".join(
+        f"Candidate - Title: {c['title']}, IMDB ID: {c['imdb_id']}, Type: {c['media_type']}"
+        for c in candidates
+    )
+    system_instruction = (
+        "You will receive a list of candidate titles and a user's taste description.\n"
+        "User Taste: " + user_taste + "\n"
+        + (f"Discovery Elements: {extra_elements}\n" if extra_elements else "") +
+        f"\nChoose the {num_movies} movies and {num_series} TV series (Type: tv) from the candidates "
+        "that best fit the user, best first.\n"
+        "Return the chosen IMDb IDs, using only IMDb IDs from the candidate list."
+    )
+    config = generate_content_config(
+        system_instruction=system_instruction,
+        temperature=0.2,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=1024,
+        response_mime_type="application/json",
+        response_schema=IMDB_ID_LIST_SCHEMA,
+    )
+    chosen_ids = []
+    try:
+        response_text = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
+            contents=listing,
+            model="gemini-2.0-flash-exp",
+            config=config,
+        )
+        chosen_ids = json.loads(response_text)
+    except Exception as e:
+        logging.error(f"Error re-ranking candidates, using local scores: {e}")
+
+    by_id = {c["imdb_id"]: c for c in candidates}
+    if not isinstance(chosen_ids, list):
+        chosen_ids = []
+    chosen = [by_id[i] for i in chosen_ids if isinstance(i, str) and i in by_id]
+    logging.info(f"Model picked {len(chosen)} of {len(candidates)} candidates")
+    return _pick_by_type(chosen + candidates, num_movies, num_series)
+
+def print_history_groups(db, credentials=None):
+    log_file = setup_debug_logging()
+    logging.info(f"Starting recommendation process for user {db.user_id}, debug log: {log_file}")
     
-    # Generate recommendations
-    print("Generating recommendations...")
-    final_recommendations_text = get_ai_recommendations(all_groups_history, chosen_taste)
+    unique_items = get_unique_history(db)
+    logging.info(f"Retrieved {len(unique_items)} history items (movies and aggregated shows)")
+    seen = {item[2] for item in unique_items}
     
-    # Clean and parse JSON
-    print("Processing recommendations...")
-    cleaned_text = clean_json_output(final_recommendations_text)
+    # Break early if no unique items
+    if not unique_items:
+        print("No valid watch history with IMDB IDs. Skipping recommendations.")
+        return
     
-    # Try multiple parsing strategies with detailed error logging
-    recommendations = []
-    try:
-        logging.info(f"Attempting to parse JSON: {cleaned_text[:100]}...")
-        recommendations = json.loads(cleaned_text)
-        logging.info(f"Successfully parsed JSON with {len(recommendations)} items")
-        
-        # Log IMDB IDs from recommendations
-        for i, rec in enumerate(recommendations):
-            imdb_id = rec.get("imdb_id", "MISSING")
-            title = rec.get("title", "UNKNOWN")
-            logging.info(f"Recommendation #{i+1}: Title='{title}', IMDB_ID='{imdb_id}'")
-            
-            # Validate IMDB ID format
-            if not imdb_id or not isinstance(imdb_id, str) or not imdb_id.startswith("tt"):
-                logging.error(f"Invalid IMDB ID format: '{imdb_id}' for title '{title}'")
-    except json.JSONDecodeError as je:
-        logging.error(f"Error parsing JSON: {je}")
-        logging.error(f"Problematic JSON: {cleaned_text}")
-        
-        # Create emergency fallback recommendations
-        logging.info("Creating fallback recommendations...")
-        recommendations = [
-            {"title": "The Shawshank Redemption", "imdb_id": "tt0111161", "image_url": ""},
-            {"title": "The Godfather", "imdb_id": "tt0068646", "image_url": ""},
-            {"title": "The Dark Knight", "imdb_id": "tt0468569", "image_url": ""},
-            {"title": "Breaking Bad", "imdb_id": "tt0903747", "image_url": ""},
-            {"title": "Game of Thrones", "imdb_id": "tt0944947", "image_url": ""}
-        ]
+    chosen_taste = update_user_taste(db, unique_items, credentials=credentials) or ""
+    
+    # Watched, owned and already requested titles are never worth recommending
+    excluded = seen | get_exclusions(db.user_id)
+    candidates = filter_excluded(db.get_candidates(CANDIDATE_POOL_SIZE, CANDIDATE_MAX_AGE_SECONDS), excluded)
+    if len(candidates) >= (NUM_MOVIES + NUM_SERIES):
+        print(f"Re-ranking {len(candidates)} local candidates...")
+        recommendations = rerank_candidates(candidates, chosen_taste, NUM_MOVIES, NUM_SERIES, credentials=credentials)
+    else:
+        print("Generating recommendations...")
+        # Rating/recency-ranked slice of the history plus a genre/decade profile, within budget
+        history_prompt = build_history_prompt(unique_items, RECOMMENDATION_MODEL)
+        recommendations = generate_llm_recommendations(history_prompt, chosen_taste, credentials, excluded)
     
-    # Update with images 
-    updated_recommendations = update_recommendations_with_images(recommendations)
-    new_recommendations = filter_new_recommendations(updated_recommendations, unique_items)
+    # Filter before enrichment so no poster lookups are spent on dropped titles
+    new_recommendations = filter_new_recommendations(recommendations, excluded)
+    new_recommendations = update_recommendations_with_images(new_recommendations, tmdb_key(credentials))
     
     # Ensure we have enough recommendations
     if len(new_recommendations) < (NUM_MOVIES + NUM_SERIES):
@@ -429,13 +643,13 @@ def print_history_groups(db):
             {"title": "Stranger Things", "imdb_id": "tt4574334", "image_url": ""}
         ]
         
-        # Add fallbacks that aren't in watch history
+        # Add fallbacks that aren't watched, owned or requested
         for item in fallbacks:
-            if item["imdb_id"] not in seen and len(new_recommendations) < (NUM_MOVIES + NUM_SERIES):
+            if item["imdb_id"] not in excluded and len(new_recommendations) < (NUM_MOVIES + NUM_SERIES):
                 new_recommendations.append(item)
                 
         # Update these with images too
-        new_recommendations = update_recommendations_with_images(new_recommendations)
+        new_recommendations = update_recommendations_with_images(new_recommendations, tmdb_key(credentials))
     
     print(f"Final recommendations count: {len(new_recommendations)}")
     
@@ -464,31 +678,89 @@ def print_history_groups(db):
         logging.getLogger().removeHandler(handler)
     print(f"Recommendation process completed. See log file for details: {log_file}")
 
-def get_ai_search_results(query: str, system_instruction: str):
-    client = init_gemini_client()
-    if not client:
-        return "[]"
-        
-    config = GenerateContentConfig(
+def ai_search_config(system_instruction):
+    return generate_content_config(
         system_instruction=system_instruction,
         temperature=0.1,
         top_p=0.95,
         top_k=40,
         max_output_tokens=1024,
         response_mime_type="text/plain",
-        tools=[google_search_tool],
+        tools=[google_search_tool()],
     )
+
+def get_ai_search_results(query: str, system_instruction: str, credentials=None):
     try:
-        response = client.models.generate_content(
+        return llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
             contents=query,
             model="gemini-2.0-flash-exp",
-            config=config,
+            config=ai_search_config(system_instruction),
         )
-        return response.text
+    except LLMBusyError:
+        raise
     except Exception as e:
         print(f"Error in AI search: {e}")
         return "[]"
 
+def iter_json_array_items(chunks):
+    """
+    Yield the elements of a JSON array as soon as each one is complete in a stream of text
+    chunks. Text before the opening bracket (markdown fences, prose) is skipped, and parsing
+    stops at the closing bracket or at the first element that is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = -1  # index just after the opening bracket, -1 until it has been seen
+    for chunk in chunks:
+        buffer += chunk
+        if pos < 0:
+            start = buffer.find("[")
+            if start < 0:
+                continue
+            pos = start + 1
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # An object or string may just be incomplete; wait for more text
+                if buffer[pos] not in '{["':
+                    logging.warning(f"Stopping JSON stream at invalid element: {buffer[pos:pos + 50]!r}")
+                    return
+                break
+            yield item
+            pos = end
+
+def stream_ai_search_results(query: str, system_instruction: str, credentials=None):
+    """
+    Streaming variant of get_ai_search_results: yields result dicts as the model writes them.
+    Runs at interactive priority, so LLMBusyError is raised before the first item when the
+    model is over budget; other errors end the stream.
+    """
+    chunks = llm_gateway.generate_content_stream(
+        api_key=gemini_key(credentials),
+        contents=query,
+        model="gemini-2.0-flash-exp",
+        config=ai_search_config(system_instruction),
+        priority=llm_dispatch.INTERACTIVE,
+    )
+    try:
+        for item in iter_json_array_items(chunks):
+            if isinstance(item, dict) and item.get("title"):
+                yield item
+    except LLMBusyError:
+        raise
+    except Exception as e:
+        print(f"Error in streaming AI search: {e}")
+    finally:
+        chunks.close()
+
 def push_discovery_recommendations(user_id: str, recommendations: list):
     if not OVERSEERR_URL or not OVERSEERR_API_TOKEN:
         return False
@@ -510,12 +782,95 @@ def push_discovery_recommendations(user_id: str, recommendations: list):
         print(f"Error pushing discovery recommendations to Overseerr: {e}")
         return None
 
+def generate_llm_discovery(user_history_text, taste, num_movies, num_series, extra_elements, credentials=None,
+                           exclude=()):
+    """Ask the model for discovery picks; returns None when nothing usable came back."""
+    def ask(missing_movies, missing_series, avoid):
+        # Create a specific prompt for discovery
+        discovery_prompt = f"""
+Based on the user's watch history and taste, recommend {missing_movies} movies and {missing_series} TV shows.
+The recommendations should be highly personalized and diverse.
+{extra_elements if extra_elements else ""}
+
+Please focus on quality content that matches the user's taste profile but introduces new elements.
+"""
+        system_instruction = (
+            "You will receive a user's watch history, taste description, and discovery elements.\n\n"
+            f"User Taste: {taste}\n"
+            f"Discovery Elements: {extra_elements}\n\n"
+            f"{user_history_text}\n\n"
+            f"Your task is to recommend {missing_movies} movies and {missing_series} TV series.\n"
+            "Do NOT recommend items that appear in the watch history.\n"
+            + avoid_instruction(avoid) +
+            "Every imdb_id must be the real IMDb ID of that title, 'tt' followed by digits."
+        )
+        config = generate_content_config(
+            system_instruction=system_instruction,
+            temperature=0.1,
+            top_p=0.95,
+            top_k=40,
+            max_output_tokens=8192,
+            response_mime_type="application/json",
+            response_schema=RECOMMENDATION_SCHEMA,
+        )
+        raw_output = llm_gateway.generate_content(
+            api_key=gemini_key(credentials),
+            contents=discovery_prompt,
+            model=RECOMMENDATION_MODEL,
+            config=config,
+        )
+        print(f"Received raw AI response of length: {len(raw_output)}")
+        recommendations = parse_recommendations(raw_output)
+        print(f"Parsed {len(recommendations)} recommendations from AI")
+        return recommendations
+
+    try:
+        recommendations = collect_valid_recommendations(ask, num_movies, num_series, exclude)
+    except LLMBusyError:
+        # Over the LLM budget: let the API answer 429 instead of serving fallbacks
+        raise
+    except Exception as e:
+        print(f"Error generating discovery recommendations: {e}")
+        return None
+    if not recommendations:
+        print("AI returned no usable recommendations, using fallbacks")
+        return None
+    return recommendations
+
+def discovery_params(num_movies, num_series, extra_elements):
+    """Canonical discovery parameters and their hash, the discovery cache key within a user's DB."""
+    params = json.dumps({
+        "num_movies": int(num_movies),
+        "num_series": int(num_series),
+        "extra_elements": " ".join((extra_elements or "").split()).lower(),
+    }, sort_keys=True)
+    return params, hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+def get_cached_discovery(user_id, num_movies, num_series, extra_elements):
+    """
+    Look up cached discovery results for these parameters. Returns (recommendations, fresh):
+    fresh when the entry was built from the current taste and history within
+    DISCOVERY_CACHE_TTL_SECONDS, stale when older or built from an earlier taste/history but
+    within DISCOVERY_CACHE_MAX_STALE_SECONDS, and (None, False) when there is nothing usable.
+    """
+    db = Database(user_id)
+    _, params_hash = discovery_params(num_movies, num_series, extra_elements)
+    row = db.get_discovery_cache(params_hash)
+    if not row:
+        return None, False
+    taste_version, watermark, results, created_at = row
+    age = time.time() - created_at
+    if age > DISCOVERY_CACHE_MAX_STALE_SECONDS:
+        return None, False
+    current = (db.get_taste_version(user_id), db.get_history_watermark())
+    fresh = age <= DISCOVERY_CACHE_TTL_SECONDS and (taste_version, watermark) == current
+    return json.loads(results), fresh
+
 def generate_discovery_recommendations(user_id: str, gemini_api_key: str, tmdb_api_key: str, num_movies: int, num_series: int, extra_elements: str):
     print(f"Generating discovery recommendations for user {user_id}")
     
-    # Set environment variables for this function call
-    os.environ["GEMINI_API_KEY"] = gemini_api_key
-    os.environ["TMDB_API_KEY"] = tmdb_api_key
+    # Keys are scoped to this call so concurrent requests with different keys don't race
+    credentials = Credentials(gemini_api_key, tmdb_api_key)
     
     # Define fallback recommendations in case things fail
     fallback_recommendations = [
@@ -533,87 +888,37 @@ def generate_discovery_recommendations(user_id: str, gemini_api_key: str, tmdb_a
     
     db = Database(user_id)
     
+    # State the results are built from, recorded with them in the discovery cache
+    params, params_hash = discovery_params(num_movies, num_series, extra_elements)
+    taste_version, watermark = db.get_taste_version(user_id), db.get_history_watermark()
+    
     # Check if we have history items
-    items = db.get_all_items()
+    items = db.get_history_summary()
     if not items:
         print(f"No history items found for user {user_id}, using fallbacks")
         return fallback_recommendations
     
-    user_history_text = ""
-    for row in items:
-        if row[1] and row[2]:  # Make sure we have title and imdb_id
-            user_history_text += f"Watch History - Title: {row[1]}, IMDB ID: {row[2]}, User Rating: {row[3]}\n"
+    # Titles without an IMDb ID are dropped; the rest is cut to the model's token budget
+    user_history_text = build_history_prompt(items, RECOMMENDATION_MODEL)
     
     print(f"Found {len(items)} history items for user")
     
     taste = db.get_latest_user_taste(user_id) or ""
     
-    # Create a specific prompt for discovery
-    discovery_prompt = f"""
-Based on the user's watch history and taste, recommend {num_movies} movies and {num_series} TV shows.
-The recommendations should be highly personalized and diverse.
-{extra_elements if extra_elements else ""}
-
-Please focus on quality content that matches the user's taste profile but introduces new elements.
-"""
-    
-    system_instruction = (
-        "You will receive a user's watch history, taste description, and discovery elements.\n\n"
-        f"User Taste: {taste}\n"
-        f"Discovery Elements: {extra_elements}\n\n"
-        f"{user_history_text}\n\n"
-        f"Your task is to recommend {num_movies} movies and {num_series} TV series.\n"
-        "Do NOT recommend items that appear in the watch history.\n"
-        "FORMAT: Return a JSON array with exactly these fields:\n"
-        "- \"title\": The title of the movie or show\n"
-        "- \"imdb_id\": A valid IMDb ID starting with 'tt' followed by numbers\n"
-        "- \"image_url\": Can be empty string\n"
-        "IMPORTANT: Return ONLY valid JSON with NO explanations."
-    )
-    
-    client = init_gemini_client()
-    if not client:
-        print("Failed to initialize Gemini client, returning fallback recommendations")
-        return fallback_recommendations
-        
-    config = GenerateContentConfig(
-        system_instruction=system_instruction,
-        temperature=0.1,
-        top_p=0.95,
-        top_k=40,
-        max_output_tokens=8192,
-        response_mime_type="application/json",
-        tools=[google_search_tool],
-    )
-    
-    try:
-        # FIX: Send the actual discovery prompt instead of empty string
-        response = client.models.generate_content(
-            contents=discovery_prompt,
-            model="gemini-2.0-flash-exp",
-            config=config,
-        )
-        raw_output = response.text
-        print(f"Received raw AI response of length: {len(raw_output)}")
-        cleaned_text = clean_json_output(raw_output)
-        recommendations = json.loads(cleaned_text)
-        print(f"Parsed {len(recommendations)} recommendations from AI")
-        
-        if not recommendations:
-            print("AI returned empty recommendations, using fallbacks")
-            return fallback_recommendations
-            
-    except json.JSONDecodeError as je:
-        print(f"Error parsing JSON: {je}")
-        print(f"Problematic JSON: {cleaned_text[:200]}...")
-        return fallback_recommendations
-    except Exception as e:
-        print(f"Error generating discovery recommendations: {e}")
+    # Watched, owned and already requested titles are never worth recommending
+    excluded = {row[2] for row in items if row[2]} | get_exclusions(user_id)
+    candidates = filter_excluded(db.get_candidates(CANDIDATE_POOL_SIZE, CANDIDATE_MAX_AGE_SECONDS), excluded)
+    if len(candidates) >= num_movies + num_series:
+        print(f"Re-ranking {len(candidates)} local candidates for discovery")
+        recommendations = rerank_candidates(candidates, taste, num_movies, num_series, extra_elements, credentials)
+    else:
+        recommendations = generate_llm_discovery(user_history_text, taste, num_movies, num_series, extra_elements,
+                                                 credentials, excluded)
+    if not recommendations:
         return fallback_recommendations
     
-    updated_recommendations = update_recommendations_with_images(recommendations)
-    watched_imdbs = {row[2] for row in items if row[2]}
-    final_recs = [r for r in updated_recommendations if r.get("imdb_id") not in watched_imdbs]
+    # Filter before enrichment so no poster lookups are spent on dropped titles
+    final_recs = update_recommendations_with_images(filter_excluded(recommendations, excluded), tmdb_key(credentials))
     
     print(f"Final recommendations after filtering: {len(final_recs)}")
     for rec in final_recs:
@@ -628,6 +933,8 @@ Please focus on quality content that matches the user's taste profile but introd
     try:
         db.add_recommendation("discovery", "Discovery Recommendations", "mixed", 
                             json.dumps(final_recs, ensure_ascii=False))
+        db.put_discovery_cache(params_hash, params, taste_version, watermark,
+                               json.dumps(final_recs, ensure_ascii=False), DISCOVERY_CACHE_MAX_STALE_SECONDS)
     except Exception as e:
         print(f"Error saving discovery recommendations: {e}")
     
@@ -645,5 +952,5 @@ def run_monthly_task(user_id):
     """Run the monthly recommendations task for a specific user"""
     print(f"Running monthly task for user {user_id}")
     db = Database(user_id)
-    print_history_groups(db)
+    print_history_groups(db, for_user(user_id))
 #recbyhistory
\ No newline at end of file
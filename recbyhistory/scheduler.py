@@ -0,0 +1,322 @@
+# recbyhistory/scheduler.py
+"""
+Per-user task scheduler.
+
+Each (user, task type) pair has a due time derived from its interval plus a per-user
+jitter, so users added together do not all hit Plex and the LLM in the same minute.
+Due tasks are queued per user and dispatched round-robin across users to a bounded worker
+pool, with a separate concurrency limit per task type. A user has at most one task in
+flight, which keeps history -> taste -> monthly ordered, and one slow Plex server only
+occupies one worker instead of delaying everyone behind it.
+
+Due times and last outcomes are persisted in DB_FOLDER/schedule.db and reloaded at
+startup, so a restart resumes the schedule instead of treating every user as new.
+"""
+import os
+import random
+import sqlite3
+import logging
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import task_registry
+from config import (
+    DB_FOLDER, SCHEDULER_WORKERS, SCHEDULER_TYPE_LIMITS, SCHEDULER_JITTER_SECONDS, SCHEDULER_DEFER_SECONDS
+)
+
+TASK_ORDER = ("history", "taste", "monthly")
+TASK_INTERVALS = {
+    "history": timedelta(days=1),
+    "taste": timedelta(days=7),
+    "monthly": timedelta(days=30),
+}
+
+DB_PATH = os.path.join(DB_FOLDER, "schedule.db")
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _connect():
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_schedule (
+            user_id TEXT NOT NULL,
+            task_type TEXT NOT NULL,
+            due_at TIMESTAMP NOT NULL,
+            last_run TIMESTAMP,
+            last_status TEXT,
+            last_duration_seconds REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, task_type)
+        )
+    ''')
+    return conn
+
+
+def _parse(value):
+    return datetime.strptime(value, TIME_FORMAT) if value else None
+
+
+def _format(value):
+    return value.strftime(TIME_FORMAT) if value else None
+
+
+class UserScheduler:
+    def __init__(self, task_funcs, workers=SCHEDULER_WORKERS, type_limits=None,
+                 jitter_seconds=SCHEDULER_JITTER_SECONDS):
+        """task_funcs maps task type -> callable(user_id) returning a task_registry outcome."""
+        self.task_funcs = task_funcs
+        self.workers = workers
+        self.type_limits = dict(SCHEDULER_TYPE_LIMITS if type_limits is None else type_limits)
+        self.jitter_seconds = jitter_seconds
+        self._cond = threading.Condition()
+        self._schedule = {}              # user_id -> {task_type: {"due_at", "last_run", "last_status", ...}}
+        self._queues = OrderedDict()     # user_id -> deque of due task types, in round-robin order
+        self._in_flight = {}             # user_id -> task type currently running
+        self._type_running = {task_type: 0 for task_type in TASK_ORDER}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="user-task")
+        self._stopped = False
+        self._dispatcher = None
+        self._load()
+
+    # ----------------- Schedule state -----------------
+    def _load(self):
+        """Restore persisted due times and outcomes from schedule.db."""
+        try:
+            conn = _connect()
+            try:
+                rows = conn.execute(
+                    'SELECT user_id, task_type, due_at, last_run, last_status, last_duration_seconds FROM user_schedule'
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Could not load persisted schedule: {e}")
+            return
+        for user_id, task_type, due_at, last_run, last_status, duration in rows:
+            if task_type not in TASK_INTERVALS:
+                continue
+            tasks = self._schedule.setdefault(user_id, {})
+            tasks[task_type] = {
+                "due_at": _parse(due_at),
+                "last_run": _parse(last_run),
+                "last_status": last_status,
+                "last_duration_seconds": duration,
+            }
+        # A task type added after a user's rows were written becomes due now
+        now = datetime.utcnow()
+        for tasks in self._schedule.values():
+            for task_type in TASK_ORDER:
+                tasks.setdefault(task_type, {"due_at": now, "last_run": None, "last_status": None,
+                                             "last_duration_seconds": None})
+        if rows:
+            logging.info(f"Restored schedule for {len(self._schedule)} users from {DB_PATH}")
+
+    def _save(self, user_id, task_types):
+        with self._cond:
+            entries = [(task_type, dict(self._schedule[user_id][task_type])) for task_type in task_types]
+        try:
+            conn = _connect()
+            try:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO user_schedule
+                        (user_id, task_type, due_at, last_run, last_status, last_duration_seconds, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', [(user_id, task_type, _format(entry["due_at"]), _format(entry["last_run"]),
+                       entry["last_status"], entry["last_duration_seconds"]) for task_type, entry in entries])
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Could not persist schedule for user {user_id}: {e}")
+
+    def add_user(self, user_id, now=None):
+        """Register a user; every task becomes due after a random jitter. Returns True if new."""
+        now = now or datetime.utcnow()
+        with self._cond:
+            if user_id in self._schedule:
+                return False
+            jitter = timedelta(seconds=random.uniform(0, self.jitter_seconds))
+            self._schedule[user_id] = {
+                task_type: {"due_at": now + jitter, "last_run": None, "last_status": None,
+                            "last_duration_seconds": None}
+                for task_type in TASK_ORDER
+            }
+        self._save(user_id, TASK_ORDER)
+        return True
+
+    def remove_users(self, user_ids):
+        """Forget users: drop their schedule and queued tasks, in memory and in schedule.db."""
+        with self._cond:
+            for user_id in user_ids:
+                self._schedule.pop(user_id, None)
+                self._queues.pop(user_id, None)
+        try:
+            conn = _connect()
+            try:
+                conn.executemany('DELETE FROM user_schedule WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Could not remove users from persisted schedule: {e}")
+
+    def sync_users(self, user_ids):
+        """
+        Register unknown users, drop users missing from user_ids and queue whatever is due;
+        returns the newly added users. user_ids must be the complete current user list.
+        """
+        added = [user_id for user_id in user_ids if self.add_user(user_id)]
+        if added:
+            logging.info(f"Scheduler registered {len(added)} new users: {', '.join(added)}")
+        current = set(user_ids)
+        with self._cond:
+            removed = [user_id for user_id in self._schedule if user_id not in current]
+        if removed:
+            self.remove_users(removed)
+            logging.info(f"Scheduler removed {len(removed)} users no longer in plexauthgui: {', '.join(removed)}")
+        self.enqueue_due()
+        return added
+
+    def enqueue_due(self, now=None):
+        """Queue every due task that is not already queued or running."""
+        now = now or datetime.utcnow()
+        queued = 0
+        with self._cond:
+            for user_id, tasks in self._schedule.items():
+                queue = self._queues.get(user_id)
+                for task_type in TASK_ORDER:
+                    if tasks[task_type]["due_at"] > now:
+                        continue
+                    if self._in_flight.get(user_id) == task_type or (queue and task_type in queue):
+                        continue
+                    if queue is None:
+                        queue = self._queues[user_id] = deque()
+                    queue.append(task_type)
+                    queued += 1
+            if queued:
+                self._cond.notify_all()
+        return queued
+
+    # ----------------- Dispatch -----------------
+    def start(self):
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="user-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
+
+    def _next_task(self):
+        """Pick the next (user, task) round-robin, honoring pool size and per-type limits."""
+        if sum(self._type_running.values()) >= self.workers:
+            return None
+        for user_id in list(self._queues):
+            if user_id in self._in_flight:
+                continue
+            queue = self._queues[user_id]
+            task_type = queue[0]
+            if self._type_running[task_type] >= self.type_limits.get(task_type, self.workers):
+                continue
+            queue.popleft()
+            # Move the user to the back so the others get a turn first
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            return user_id, task_type
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                picked = self._next_task()
+                while picked is None and not self._stopped:
+                    self._cond.wait()
+                    picked = self._next_task()
+                if self._stopped:
+                    return
+                user_id, task_type = picked
+                self._in_flight[user_id] = task_type
+                self._type_running[task_type] += 1
+            self._executor.submit(self._run, user_id, task_type)
+
+    def _run(self, user_id, task_type):
+        started = datetime.utcnow()
+        duration = None
+        with self._cond:
+            skipped_at = self._schedule.get(user_id, {}).get(task_type, {}).get("skipped_at")
+        # The run we deferred to may already have done this task's work
+        completed_at = task_registry.last_success_at(user_id, task_type) if skipped_at else None
+        if completed_at and completed_at >= skipped_at:
+            outcome = task_registry.OK
+            started = completed_at
+        else:
+            try:
+                outcome = self.task_funcs[task_type](user_id)
+            except Exception as e:
+                logging.error(f"Scheduled {task_type} task for user {user_id} raised: {e}")
+                outcome = task_registry.FAILED
+            duration = round((datetime.utcnow() - started).total_seconds(), 1)
+        with self._cond:
+            self._in_flight.pop(user_id, None)
+            self._type_running[task_type] -= 1
+            self._cond.notify_all()
+            entry = self._schedule.get(user_id, {}).get(task_type)
+            if entry is None:
+                # The user was removed while the task ran
+                return
+            if outcome == task_registry.SKIPPED:
+                # Another caller owns the run; check back later instead of counting a failure
+                entry.setdefault("skipped_at", started)
+                entry["due_at"] = datetime.utcnow() + timedelta(seconds=SCHEDULER_DEFER_SECONDS)
+                return
+            entry.pop("skipped_at", None)
+            entry["last_status"] = "success" if outcome == task_registry.OK else "failed"
+            if duration is not None:
+                entry["last_duration_seconds"] = duration
+            if outcome == task_registry.OK:
+                entry["last_run"] = started
+                entry["due_at"] = started + TASK_INTERVALS[task_type]
+            else:
+                # Retry failed work later rather than immediately hammering a broken server
+                entry["due_at"] = datetime.utcnow() + min(TASK_INTERVALS[task_type], timedelta(hours=1))
+        self._save(user_id, [task_type])
+
+    # ----------------- Reporting -----------------
+    def lag_report(self, user_id=None, now=None):
+        """Per user and task: due time, state, and how many seconds the task is behind schedule."""
+        now = now or datetime.utcnow()
+        with self._cond:
+            report = {}
+            for uid, tasks in self._schedule.items():
+                if user_id is not None and uid != user_id:
+                    continue
+                queue = self._queues.get(uid, ())
+                entries = {}
+                for task_type, entry in tasks.items():
+                    if self._in_flight.get(uid) == task_type:
+                        state = "running"
+                    elif task_type in queue:
+                        state = "queued"
+                    else:
+                        state = "scheduled"
+                    entries[task_type] = {
+                        "state": state,
+                        "due_at": entry["due_at"].isoformat(),
+                        "last_run": entry["last_run"].isoformat() if entry["last_run"] else None,
+                        "last_status": entry["last_status"],
+                        "last_duration_seconds": entry["last_duration_seconds"],
+                        "lag_seconds": max(0, int((now - entry["due_at"]).total_seconds())),
+                    }
+                report[uid] = {
+                    "max_lag_seconds": max(e["lag_seconds"] for e in entries.values()),
+                    "tasks": entries,
+                }
+            return {
+                "users": report,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "running": dict(self._type_running),
+            }
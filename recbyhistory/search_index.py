@@ -0,0 +1,233 @@
+# recbyhistory/search_index.py
+"""
+Local vector index for AI search pre-filtering.
+
+Catalog items (title, overview and genres from the TMDb cache kept by candidates.py) are
+embedded with TF-IDF reduced by truncated SVD, stored as a float32 .npy matrix and opened
+memory-mapped. Queries are projected into the same space and ranked with blocked dot
+products, so a search returns local candidates in milliseconds and the LLM only refines them.
+"""
+import os
+import re
+import json
+import math
+import time
+import shutil
+import logging
+import threading
+from candidates import connect_cache, TMDB_IMAGE_BASE_URL
+from config import DB_FOLDER, SEARCH_INDEX_DIM
+
+INDEX_DIR = os.path.join(DB_FOLDER, "search_index")
+CURRENT_FILE = os.path.join(INDEX_DIR, "CURRENT")
+MIN_DOCUMENTS = 20
+BLOCK_ROWS = 65536
+
+# TMDb's fixed genre IDs for movies and TV
+GENRE_NAMES = {
+    28: "action", 12: "adventure", 16: "animation", 35: "comedy", 80: "crime",
+    99: "documentary", 18: "drama", 10751: "family", 14: "fantasy", 36: "history",
+    27: "horror", 10402: "music", 9648: "mystery", 10749: "romance", 878: "science fiction",
+    10770: "tv movie", 53: "thriller", 10752: "war", 37: "western", 10759: "action adventure",
+    10762: "kids", 10763: "news", 10764: "reality", 10765: "sci-fi fantasy", 10766: "soap",
+    10767: "talk", 10768: "war politics",
+}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he", "her", "his",
+    "in", "is", "it", "its", "of", "on", "or", "she", "that", "the", "their", "they", "this",
+    "to", "was", "were", "who", "with", "me", "some", "like", "show", "shows", "movie", "movies",
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_loaded = None
+_load_lock = threading.Lock()
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _document(row):
+    title, overview, genre_ids, release_date = row
+    genres = " ".join(GENRE_NAMES.get(g, "") for g in json.loads(genre_ids or "[]"))
+    year = (release_date or "")[:4]
+    decade = f"{year[:3]}0s" if len(year) == 4 else ""
+    # The title and genres are repeated so they weigh more than the overview
+    return " ".join([title or "", title or "", genres, genres, decade, year, overview or ""])
+
+
+def build_index(dim=SEARCH_INDEX_DIM):
+    """Embed the catalog and atomically publish a new index build; returns the item count."""
+    import numpy as np
+    import scipy.sparse as sp
+    from scipy.sparse.linalg import svds
+    conn = connect_cache()
+    try:
+        rows = conn.execute('''
+            SELECT tmdb_id, media_type, imdb_id, title, poster_path, overview, genre_ids, release_date
+            FROM tmdb_items WHERE title IS NOT NULL
+        ''').fetchall()
+    finally:
+        conn.close()
+    if len(rows) < MIN_DOCUMENTS:
+        logging.info(f"Only {len(rows)} catalog items; skipping search index build.")
+        return 0
+
+    docs = [tokenize(_document(row[3:4] + row[5:8])) for row in rows]
+    document_frequency = {}
+    for tokens in docs:
+        for token in set(tokens):
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    vocab = {token: i for i, token in enumerate(sorted(document_frequency))}
+    n_docs = len(docs)
+    idf = np.array([math.log((1 + n_docs) / (1 + document_frequency[t])) + 1.0 for t in sorted(vocab)],
+                   dtype=np.float32)
+
+    data, indices, indptr = [], [], [0]
+    for tokens in docs:
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            indices.append(vocab[token])
+            data.append(1.0 + math.log(count))
+        indptr.append(len(indices))
+    tfidf = sp.csr_matrix((np.array(data, dtype=np.float32), indices, indptr), shape=(n_docs, len(vocab)))
+    tfidf = tfidf @ sp.diags(idf)
+    row_norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1))).ravel()
+    row_norms[row_norms == 0] = 1.0
+    tfidf = sp.diags(1.0 / row_norms) @ tfidf
+
+    k = max(1, min(dim, min(tfidf.shape) - 1))
+    _, _, vt = svds(tfidf.astype(np.float64), k=k)
+    components = vt.T.astype(np.float32)  # vocab x k
+    vectors = np.asarray(tfidf @ components, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+    build_id = time.strftime("%Y%m%d%H%M%S")
+    build_dir = os.path.join(INDEX_DIR, build_id)
+    os.makedirs(build_dir, exist_ok=True)
+    np.save(os.path.join(build_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(build_dir, "components.npy"), components)
+    np.save(os.path.join(build_dir, "idf.npy"), idf)
+    with open(os.path.join(build_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "vocab": vocab,
+            "items": [{
+                "tmdb_id": row[0], "media_type": row[1], "imdb_id": row[2], "title": row[3],
+                "image_url": f"{TMDB_IMAGE_BASE_URL}{row[4]}" if row[4] else "",
+            } for row in rows],
+        }, f, ensure_ascii=False)
+
+    previous_id = _read_current()
+    tmp_current = CURRENT_FILE + ".tmp"
+    with open(tmp_current, "w") as f:
+        f.write(build_id)
+    os.replace(tmp_current, CURRENT_FILE)
+
+    # The previous build stays until the next publish, so a reader that read CURRENT just
+    # before the switch can still open it
+    for name in os.listdir(INDEX_DIR):
+        path = os.path.join(INDEX_DIR, name)
+        if name not in (build_id, previous_id) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    logging.info(f"Search index {build_id} built: {n_docs} items, {len(vocab)} terms, {k} dimensions")
+    return n_docs
+
+
+def _read_current():
+    try:
+        with open(CURRENT_FILE) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _load():
+    """Open the current build memory-mapped, reloading when a newer build was published."""
+    import numpy as np
+    global _loaded
+    with _load_lock:
+        # A concurrent build_index can remove the build CURRENT pointed to; re-read and retry
+        for attempt in range(3):
+            build_id = _read_current()
+            if build_id is None:
+                return None
+            if _loaded is not None and _loaded["build_id"] == build_id:
+                return _loaded
+            build_dir = os.path.join(INDEX_DIR, build_id)
+            try:
+                with open(os.path.join(build_dir, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                _loaded = {
+                    "build_id": build_id,
+                    "vectors": np.load(os.path.join(build_dir, "vectors.npy"), mmap_mode="r"),
+                    "components": np.load(os.path.join(build_dir, "components.npy")),
+                    "idf": np.load(os.path.join(build_dir, "idf.npy")),
+                    "vocab": meta["vocab"],
+                    "items": meta["items"],
+                }
+                return _loaded
+            except FileNotFoundError:
+                logging.warning(f"Search index build {build_id} disappeared while loading; retrying")
+        # Keep serving the build already open rather than failing the search
+        return _loaded
+
+
+def embed_queries(queries, index):
+    """Project queries into the index space; returns an (n_queries x k) normalized matrix."""
+    import numpy as np
+    vocab, idf = index["vocab"], index["idf"]
+    rows = np.zeros((len(queries), len(idf)), dtype=np.float32)
+    for q, query in enumerate(queries):
+        for token in tokenize(query):
+            i = vocab.get(token)
+            if i is not None:
+                rows[q, i] += 1.0
+    nonzero = rows > 0
+    rows[nonzero] = (1.0 + np.log(rows[nonzero])) * np.broadcast_to(idf, rows.shape)[nonzero]
+    embedded = rows @ index["components"]
+    embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-9)
+    return embedded
+
+
+def search_many(queries, limit=25, exclude=()):
+    """Rank catalog items for several queries at once; returns one result list per query."""
+    import numpy as np
+    index = _load()
+    if index is None or not queries:
+        return [[] for _ in queries]
+    query_vectors = embed_queries(queries, index)
+    vectors = index["vectors"]
+    scores = np.empty((len(queries), vectors.shape[0]), dtype=np.float32)
+    for start in range(0, vectors.shape[0], BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS])
+        scores[:, start:start + block.shape[0]] = query_vectors @ block.T
+
+    exclude = set(exclude)
+    items = index["items"]
+    results = []
+    for q in range(len(queries)):
+        if not np.any(query_vectors[q]):
+            results.append([])
+            continue
+        # Over-fetch so excluded titles do not leave the list short
+        want = min(len(items), limit + len(exclude) if exclude else limit)
+        top = np.argpartition(-scores[q], want - 1)[:want]
+        top = top[np.argsort(-scores[q][top])]
+        ranked = []
+        for i in top:
+            item = items[i]
+            if item["imdb_id"] and item["imdb_id"] in exclude:
+                continue
+            ranked.append(dict(item, score=float(scores[q][i])))
+            if len(ranked) >= limit:
+                break
+        results.append(ranked)
+    return results
+
+
+def search(query, limit=25, exclude=()):
+    return search_many([query], limit, exclude)[0]
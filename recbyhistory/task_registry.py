@@ -0,0 +1,116 @@
+# recbyhistory/task_registry.py
+"""
+Thread-safe registry of per-user background tasks.
+
+Scheduler threads, job-queue workers and request handlers all start history, taste and
+monthly tasks. The registry makes a second run of the same task for the same user a no-op
+while the first is still queued or running, serializes different tasks for one user on a
+per-user lock (they share that user's SQLite database), and keeps the state, timestamps
+and last error of every task so they can be inspected through the API.
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+
+# Outcomes of run()
+OK = "ok"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+_lock = threading.Lock()
+_user_locks = {}
+_tasks = {}
+
+
+def _user_lock(user_id):
+    with _lock:
+        if user_id not in _user_locks:
+            _user_locks[user_id] = threading.Lock()
+        return _user_locks[user_id]
+
+
+def _record(user_id, task_type):
+    return _tasks.setdefault((user_id, task_type), {
+        "user_id": user_id,
+        "task_type": task_type,
+        "state": "idle",
+        "started_at": None,
+        "finished_at": None,
+        "last_success_at": None,
+        "last_error": None,
+        "runs": 0,
+    })
+
+
+def is_active(user_id, task_type):
+    with _lock:
+        task = _tasks.get((user_id, task_type))
+        return bool(task and task["state"] in ("waiting", "running"))
+
+
+def wait_until_idle(user_id, task_type, timeout=3600, interval=2):
+    """Block until the task is no longer waiting or running; returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while is_active(user_id, task_type):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def run(user_id, task_type, func, *args, **kwargs):
+    """
+    Run func for the user unless the same task is already waiting or running.
+    Returns OK when func ran successfully, SKIPPED when another run of the task was already
+    waiting or running, and FAILED when func raised. Exceptions are logged and stored as the
+    task's last_error.
+    """
+    with _lock:
+        task = _record(user_id, task_type)
+        if task["state"] in ("waiting", "running"):
+            logging.info(f"{task_type} task for user {user_id} is already {task['state']}; skipping.")
+            return SKIPPED
+        task["state"] = "waiting"
+
+    with _user_lock(user_id):
+        with _lock:
+            task["state"] = "running"
+            task["started_at"] = datetime.utcnow().isoformat()
+            task["runs"] += 1
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"Error in {task_type} task for user {user_id}: {e}")
+            with _lock:
+                task["state"] = "failed"
+                task["last_error"] = str(e)
+                task["finished_at"] = datetime.utcnow().isoformat()
+            return FAILED
+        with _lock:
+            task["state"] = "idle"
+            task["finished_at"] = datetime.utcnow().isoformat()
+            task["last_success_at"] = task["finished_at"]
+        return OK
+
+
+def last_outcome(user_id, task_type):
+    """(state, last_error) of the task's most recent run; state is "idle" after a success."""
+    with _lock:
+        task = _tasks.get((user_id, task_type))
+        return (task["state"], task["last_error"]) if task else ("idle", None)
+
+
+def last_success_at(user_id, task_type):
+    """UTC datetime the task last finished successfully, or None."""
+    with _lock:
+        task = _tasks.get((user_id, task_type))
+        value = task["last_success_at"] if task else None
+    return datetime.fromisoformat(value) if value else None
+
+
+def snapshot(user_id=None):
+    """Copies of all task records, optionally for one user."""
+    with _lock:
+        return [dict(task) for (uid, _), task in sorted(_tasks.items())
+                if user_id is None or uid == user_id]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Import-time budget check for the services.
+
+Runs `python -X importtime -c "import app"` in each service directory, reports the total
+cumulative import time of the app module and its slowest imports, and exits non-zero when a
+service exceeds its budget. Use it after adding dependencies to keep container cold starts
+and worker forks fast:
+
+    python scripts/check_import_time.py                  # all services, default budgets
+    python scripts/check_import_time.py recbyhistory --budget-ms 800 --top 15
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budgets in milliseconds for importing each service's app module
+DEFAULT_BUDGETS_MS = {
+    "recbyhistory": 1000,
+    "getimdbid": 500,
+    "plexauthgui": 500,
+    "watchlistrequests": 600,
+}
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(service, module="app"):
+    """Return (total_ms, [(cumulative_ms, self_ms, depth, name), ...]) for importing module."""
+    # Some services create SQLite files in the working directory at import, so run from a
+    # scratch directory with the service on the path
+    with tempfile.TemporaryDirectory(prefix="importtime-") as scratch:
+        env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, service))
+        env.setdefault("DB_FOLDER", os.path.join(scratch, "db"))
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=scratch, env=env, capture_output=True, text=True
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed in {service}:\n{proc.stderr[-2000:]}")
+    entries = []
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        entries.append((int(cumulative_us) / 1000, int(self_us) / 1000, depth, name))
+        if depth == 0 and name == module:
+            total_us = int(cumulative_us)
+    return total_us / 1000, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check service import time against a budget.")
+    parser.add_argument("services", nargs="*", default=list(DEFAULT_BUDGETS_MS))
+    parser.add_argument("--budget-ms", type=float, help="Override the budget for every service")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    args = parser.parse_args()
+
+    failed = False
+    for service in args.services:
+        budget = args.budget_ms or DEFAULT_BUDGETS_MS.get(service, 1000)
+        try:
+            total, entries = measure(service)
+        except RuntimeError as e:
+            print(e)
+            failed = True
+            continue
+        status = "OK" if total <= budget else "OVER BUDGET"
+        print(f"{service}: {total:.0f} ms (budget {budget:.0f} ms) {status}")
+        # Direct imports of the app module are what a lazy import would save
+        direct = sorted((e for e in entries if e[2] == 1), reverse=True)[:args.top]
+        for cumulative, _, _, name in direct:
+            print(f"    {cumulative:8.1f} ms  {name}")
+        failed = failed or total > budget
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
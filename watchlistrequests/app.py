@@ -1,5 +1,6 @@
 from flask import Flask, render_template, jsonify, request
 import sqlite3
+import json
 import os
 from datetime import datetime, timedelta
 import requests
@@ -8,7 +9,6 @@ import threading
 import time
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from plexapi.myplex import MyPlexAccount
 from urllib.parse import quote
 
 
@@ -22,6 +22,29 @@ PLEX_ACCOUNTS = {}
 PLEX_SERVERS = {}
 PLEX_ITEMS_CACHE = {}
 
+# Local copy of Overseerr's media statuses, used to skip requests for media it already has
+OVERSEERR_STATUS_REFRESH_MINUTES = int(os.environ.get("OVERSEERR_STATUS_REFRESH_MINUTES", "15"))
+OVERSEERR_STATUS_MAX_AGE_SECONDS = int(os.environ.get("OVERSEERR_STATUS_MAX_AGE_SECONDS", str(2 * 60 * 60)))
+OVERSEERR_PAGE_SIZE = 100
+
+# Overseerr MediaStatus values
+MEDIA_STATUS_PENDING = 2
+MEDIA_STATUS_PROCESSING = 3
+MEDIA_STATUS_PARTIALLY_AVAILABLE = 4
+MEDIA_STATUS_AVAILABLE = 5
+MEDIA_STATUS_NAMES = {2: 'pending', 3: 'processing', 4: 'partially_available', 5: 'available'}
+# Overseerr MediaRequestStatus values of requests that no longer cover the media
+REQUEST_STATUSES_CLOSED = (3, 4)  # declined, failed
+
+# Auto-approved requests are queued and sent to Overseerr in batches, one request per title
+OVERSEERR_QUEUE_WINDOW_SECONDS = int(os.environ.get("OVERSEERR_QUEUE_WINDOW_SECONDS", "60"))
+
+# Season lists of TV shows requested through Overseerr; ongoing shows are re-fetched in the background
+TV_SEASONS_TTL_SECONDS = int(os.environ.get("TV_SEASONS_TTL_SECONDS", str(24 * 60 * 60)))
+TV_SEASONS_ENDED_TTL_SECONDS = int(os.environ.get("TV_SEASONS_ENDED_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+TV_SEASONS_RETENTION_SECONDS = int(os.environ.get("TV_SEASONS_RETENTION_SECONDS", str(90 * 24 * 60 * 60)))
+TV_ENDED_STATUSES = ('Ended', 'Canceled')
+
 def init_db():
     conn = sqlite3.connect('watchlist_requests.db')
     c = conn.cursor()
@@ -35,15 +58,50 @@ def init_db():
         status TEXT DEFAULT 'pending',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         approved_at TIMESTAMP,
-        approved_by TEXT
+        approved_by TEXT,
+        media_type TEXT,
+        tmdb_id INTEGER,
+        overseerr_status TEXT
     )''')
     
+    # Columns added after the first release
+    c.execute('PRAGMA table_info(requests)')
+    existing_columns = {row[1] for row in c.fetchall()}
+    for column, column_type in (('media_type', 'TEXT'), ('tmdb_id', 'INTEGER'), ('overseerr_status', 'TEXT')):
+        if column not in existing_columns:
+            c.execute(f'ALTER TABLE requests ADD COLUMN {column} {column_type}')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_requests_overseerr_status ON requests (overseerr_status)')
+    
     # Set default value for enabled to 1 (true) to enable auto-approval by default
     c.execute('''
     CREATE TABLE IF NOT EXISTS auto_approvals (
         user_id TEXT PRIMARY KEY,
         enabled BOOLEAN DEFAULT 1
     )''')
+
+    # Overseerr media status by TMDB ID, refreshed in bulk by refresh_overseerr_status_cache
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS overseerr_media (
+        tmdb_id INTEGER NOT NULL,
+        media_type TEXT NOT NULL,
+        imdb_id TEXT,
+        status INTEGER,
+        requested BOOLEAN DEFAULT 0,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (tmdb_id, media_type)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_overseerr_media_imdb ON overseerr_media (imdb_id)')
+    
+    # Season numbers per TV show (by TMDB ID) from Overseerr's /api/v1/tv/{id}
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS tv_seasons (
+        tmdb_id INTEGER PRIMARY KEY,
+        seasons TEXT NOT NULL,
+        series_status TEXT,
+        ongoing BOOLEAN DEFAULT 1,
+        fetched_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )''')
     conn.commit()
     conn.close()
 
@@ -60,7 +118,17 @@ def init_scheduler():
         # Schedule the pending request processor to run every 5 minutes
         scheduler.add_job(process_pending_requests, IntervalTrigger(minutes=5))
         
-        # Run both immediately at startup
+        # Send queued Overseerr requests, coalesced across users
+        scheduler.add_job(process_overseerr_queue, IntervalTrigger(seconds=OVERSEERR_QUEUE_WINDOW_SECONDS))
+        
+        # Re-fetch season lists of ongoing series before they expire
+        scheduler.add_job(refresh_ongoing_tv_seasons, IntervalTrigger(hours=1))
+        
+        # Keep the Overseerr status cache current
+        scheduler.add_job(refresh_overseerr_status_cache, IntervalTrigger(minutes=OVERSEERR_STATUS_REFRESH_MINUTES))
+        
+        # Run all of them immediately at startup
+        threading.Thread(target=refresh_overseerr_status_cache).start()
         threading.Thread(target=fetch_all_user_recommendations).start()
         threading.Thread(target=process_pending_requests).start()
         
@@ -136,16 +204,16 @@ def fetch_user_recommendations(user_id, recbyhistory_url):
             
             status = 'auto_approved' if auto_approve else 'pending'
             
-            # Add the recommendation as a request
+            # Add the recommendation as a request, auto-approved ones are queued for Overseerr
             c.execute('''
-            INSERT INTO requests (imdb_id, title, image_url, user_id, status, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (imdb_id, title, image_url, user_id, status, datetime.now()))
+            INSERT INTO requests (imdb_id, title, image_url, user_id, status, created_at, media_type, overseerr_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (imdb_id, title, image_url, user_id, status, datetime.now(),
+                  'movie' if 'movie' in title.lower() else 'tv', 'queued' if auto_approve else None))
             
             # If auto-approved, add to Plex watchlist
             if auto_approve:
                 conn.commit()  # Commit before calling external function
-                request_media_from_overseer(imdb_id, 'movie' if 'movie' in title.lower() else 'tv', title)
                 add_to_plex_watchlist(user_id, imdb_id)
                 
             logging.info(f"Added recommendation {title} ({imdb_id}) for user {user_id} with status {status}")
@@ -252,6 +320,287 @@ def process_pending_requests():
     except Exception as e:
         logging.error(f"Error in process_pending_requests: {e}")
 
+def _fetch_overseerr_pages(overseerr_url, path, headers, params=None):
+    """Yield every result of a paginated Overseerr list endpoint"""
+    skip = 0
+    while True:
+        page_params = dict(params or {}, take=OVERSEERR_PAGE_SIZE, skip=skip)
+        r = requests.get(f"{overseerr_url}{path}", params=page_params, headers=headers, timeout=30)
+        r.raise_for_status()
+        data = r.json()
+        results = data.get('results', [])
+        for item in results:
+            yield item
+        skip += len(results)
+        total = data.get('pageInfo', {}).get('results')
+        if not results or (total is not None and skip >= total):
+            break
+
+def refresh_overseerr_status_cache():
+    """Reload the status of every media item and open request known to Overseerr into overseerr_media"""
+    overseerr_url = os.environ.get("OVERSEERR_URL", "http://localhost:5055")
+    overseerr_api_key = os.environ.get("OVERSEERR_API_KEY")
+    if not overseerr_api_key:
+        return
+    headers = {"accept": "application/json", "X-Api-Key": overseerr_api_key}
+    started = time.time()
+    
+    # (tmdb_id, media_type) -> [imdb_id, status, requested]
+    entries = {}
+    try:
+        for media in _fetch_overseerr_pages(overseerr_url, "/api/v1/media", headers, {"filter": "all"}):
+            if media.get('tmdbId') and media.get('mediaType'):
+                entries[(int(media['tmdbId']), media['mediaType'])] = [media.get('imdbId'), media.get('status'), False]
+        
+        for req in _fetch_overseerr_pages(overseerr_url, "/api/v1/request", headers, {"filter": "all"}):
+            media = req.get('media') or {}
+            if req.get('status') in REQUEST_STATUSES_CLOSED or not media.get('tmdbId') or not media.get('mediaType'):
+                continue
+            entry = entries.setdefault((int(media['tmdbId']), media['mediaType']),
+                                       [media.get('imdbId'), media.get('status'), False])
+            entry[2] = True
+    except Exception as e:
+        # Keep the previous snapshot, rows simply age out if this keeps failing
+        logging.error(f"Error refreshing Overseerr status cache: {e}")
+        return
+    
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.executemany('''
+    INSERT INTO overseerr_media (tmdb_id, media_type, imdb_id, status, requested, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (tmdb_id, media_type) DO UPDATE SET
+        imdb_id = COALESCE(excluded.imdb_id, overseerr_media.imdb_id),
+        status = excluded.status,
+        requested = excluded.requested,
+        updated_at = excluded.updated_at
+    ''', [(tmdb_id, media_type, imdb_id, status, int(requested), started)
+          for (tmdb_id, media_type), (imdb_id, status, requested) in entries.items()])
+    # Anything not seen in this snapshot was removed from Overseerr
+    c.execute('DELETE FROM overseerr_media WHERE updated_at < ?', (started,))
+    conn.commit()
+    conn.close()
+    logging.info(f"Overseerr status cache refreshed with {len(entries)} media items")
+
+def get_overseerr_coverage(tmdb_id=None, media_type=None, imdb_id=None):
+    """
+    Check the local Overseerr status cache for a media item, by TMDB ID and media type or by IMDb ID.
+    
+    Returns:
+        str: 'available', 'pending', 'processing' or 'requested' when Overseerr already covers the
+             media and no new request is needed, otherwise None (including unknown or stale entries).
+    """
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    if tmdb_id:
+        c.execute('SELECT status, requested FROM overseerr_media WHERE tmdb_id = ? AND media_type = ? AND updated_at >= ?',
+                  (int(tmdb_id), media_type, time.time() - OVERSEERR_STATUS_MAX_AGE_SECONDS))
+    else:
+        c.execute('SELECT status, requested FROM overseerr_media WHERE imdb_id = ? AND updated_at >= ?',
+                  (imdb_id, time.time() - OVERSEERR_STATUS_MAX_AGE_SECONDS))
+    rows = c.fetchall()
+    conn.close()
+    
+    for status, requested in rows:
+        if status in (MEDIA_STATUS_AVAILABLE, MEDIA_STATUS_PENDING, MEDIA_STATUS_PROCESSING):
+            return MEDIA_STATUS_NAMES[status]
+        if requested:
+            return 'requested'
+    return None
+
+def mark_overseerr_requested(tmdb_id, media_type, imdb_id=None):
+    """Record a request we just sent so repeats are skipped until the next bulk refresh"""
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('''
+    INSERT INTO overseerr_media (tmdb_id, media_type, imdb_id, status, requested, updated_at)
+    VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT (tmdb_id, media_type) DO UPDATE SET
+        imdb_id = COALESCE(excluded.imdb_id, overseerr_media.imdb_id),
+        status = MAX(COALESCE(overseerr_media.status, 0), excluded.status),
+        requested = 1,
+        updated_at = excluded.updated_at
+    ''', (int(tmdb_id), media_type, imdb_id, MEDIA_STATUS_PENDING, time.time()))
+    conn.commit()
+    conn.close()
+
+def fetch_tv_seasons(overseerr_id):
+    """
+    Get the season numbers (excluding specials season 0) of a TV show from Overseerr and store
+    them in the tv_seasons cache.
+    
+    Raises:
+        Exception: If Overseerr cannot be reached or does not know the show.
+    """
+    overseerr_url = os.environ.get("OVERSEERR_URL", "http://localhost:5055")
+    headers = _overseerr_headers(os.environ.get("OVERSEERR_API_KEY"))
+    series_response = requests.get(f"{overseerr_url}/api/v1/tv/{overseerr_id}", headers=headers, timeout=30)
+    series_response.raise_for_status()
+    series_data = series_response.json()
+    
+    seasons = [season['seasonNumber'] for season in series_data.get('seasons', []) 
+              if season.get('seasonNumber', 0) > 0]
+    series_status = series_data.get('status')
+    ongoing = bool(series_data.get('inProduction')) or series_status not in TV_ENDED_STATUSES
+    
+    now = time.time()
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('''
+    INSERT INTO tv_seasons (tmdb_id, seasons, series_status, ongoing, fetched_at, last_used_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (tmdb_id) DO UPDATE SET
+        seasons = excluded.seasons,
+        series_status = excluded.series_status,
+        ongoing = excluded.ongoing,
+        fetched_at = excluded.fetched_at
+    ''', (int(overseerr_id), json.dumps(seasons), series_status, int(ongoing), now, now))
+    conn.commit()
+    conn.close()
+    return seasons
+
+def get_tv_seasons(overseerr_id, title=None):
+    """
+    Season numbers of a TV show, from the tv_seasons cache while fresh (TV_SEASONS_TTL_SECONDS for
+    ongoing series, TV_SEASONS_ENDED_TTL_SECONDS for ended ones) and from Overseerr otherwise.
+    An expired entry is still used when Overseerr fails; with nothing cached an empty list is
+    returned, meaning all seasons.
+    """
+    now = time.time()
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('SELECT seasons, ongoing, fetched_at FROM tv_seasons WHERE tmdb_id = ?', (int(overseerr_id),))
+    row = c.fetchone()
+    if row:
+        c.execute('UPDATE tv_seasons SET last_used_at = ? WHERE tmdb_id = ?', (now, int(overseerr_id)))
+        conn.commit()
+    conn.close()
+    
+    if row:
+        seasons, ongoing, fetched_at = json.loads(row[0]), row[1], row[2]
+        ttl = TV_SEASONS_TTL_SECONDS if ongoing else TV_SEASONS_ENDED_TTL_SECONDS
+        if now - fetched_at < ttl:
+            logging.info(f"Using cached seasons for '{title}': {seasons}")
+            return seasons
+    
+    try:
+        seasons = fetch_tv_seasons(overseerr_id)
+        logging.info(f"Found {len(seasons)} seasons for '{title}': {seasons}")
+        return seasons
+    except Exception as e:
+        if row:
+            logging.warning(f"Error getting seasons for '{title}': {e}, using cached seasons")
+            return json.loads(row[0])
+        logging.warning(f"Error getting seasons for '{title}': {e}, requesting all seasons")
+        return []
+
+def refresh_ongoing_tv_seasons():
+    """Re-fetch cached season lists of ongoing series before they expire, and drop unused entries"""
+    if not os.environ.get("OVERSEERR_API_KEY"):
+        return
+    now = time.time()
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('DELETE FROM tv_seasons WHERE last_used_at < ?', (now - TV_SEASONS_RETENTION_SECONDS,))
+    # Refresh at three quarters of the TTL so request-time lookups keep hitting the cache
+    c.execute('SELECT tmdb_id FROM tv_seasons WHERE ongoing = 1 AND fetched_at < ?',
+              (now - TV_SEASONS_TTL_SECONDS * 0.75,))
+    due = [row[0] for row in c.fetchall()]
+    conn.commit()
+    conn.close()
+    
+    refreshed = 0
+    for tmdb_id in due:
+        try:
+            fetch_tv_seasons(tmdb_id)
+            refreshed += 1
+        except Exception as e:
+            logging.warning(f"Error refreshing seasons for TV show {tmdb_id}: {e}")
+    if due:
+        logging.info(f"Refreshed seasons for {refreshed} of {len(due)} ongoing TV shows")
+
+def _overseerr_outcome(result):
+    """overseerr_status value for a send_overseerr_request result"""
+    if result.get("skipped"):
+        return result.get("reason", "requested")
+    if "error" in result:
+        return 'failed'
+    return 'requested'
+
+def _known_overseerr_media(imdb_id, title):
+    """The TMDB ID an earlier queued request for imdb_id was resolved to, in resolve_overseerr_media's format"""
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('SELECT tmdb_id, media_type FROM requests WHERE imdb_id = ? AND tmdb_id IS NOT NULL ORDER BY id DESC LIMIT 1',
+              (imdb_id,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {"overseerr_id": row[0], "media_type": row[1], "title": title}
+
+def process_overseerr_queue():
+    """
+    Send the Overseerr requests queued since the last run. Requests are grouped by IMDb ID and
+    then by TMDB ID across all users, so a title recommended to many users is converted once and
+    requested once, and the outcome is written back to every user's request row.
+    """
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.execute('SELECT id, imdb_id, title, media_type FROM requests WHERE overseerr_status = "queued" ORDER BY id')
+    queued = c.fetchall()
+    conn.close()
+    if not queued:
+        return
+    
+    by_imdb = {}
+    for req_id, imdb_id, title, media_type in queued:
+        by_imdb.setdefault(imdb_id, {"title": title, "media_type": media_type or 'movie', "ids": []})["ids"].append(req_id)
+    
+    # row id -> (overseerr_status, media_type, tmdb_id)
+    outcomes = {}
+    by_tmdb = {}
+    for imdb_id, group in by_imdb.items():
+        coverage = get_overseerr_coverage(imdb_id=imdb_id)
+        if coverage:
+            outcome = (coverage, group["media_type"], None)
+        elif not os.environ.get("OVERSEERR_API_KEY"):
+            logging.error("OVERSEERR_API_KEY not set in environment variables.")
+            outcome = ('failed', group["media_type"], None)
+        else:
+            try:
+                media = _known_overseerr_media(imdb_id, group["title"]) or \
+                    resolve_overseerr_media(imdb_id, group["media_type"], group["title"])
+            except Exception as e:
+                logging.error(f"Error converting IMDb ID {imdb_id} for Overseerr: {e}")
+                media = {"error": str(e)}
+            if "error" in media:
+                outcome = ('failed', group["media_type"], None)
+            else:
+                key = (media["overseerr_id"], media["media_type"])
+                by_tmdb.setdefault(key, {"title": media["title"], "imdb_id": imdb_id, "ids": []})["ids"].extend(group["ids"])
+                continue
+        for req_id in group["ids"]:
+            outcomes[req_id] = outcome
+    
+    for (tmdb_id, media_type), group in by_tmdb.items():
+        try:
+            result = send_overseerr_request(tmdb_id, media_type, group["title"], group["imdb_id"])
+        except Exception as e:
+            logging.error(f"Error requesting '{group['title']}' ({media_type} {tmdb_id}) from Overseerr: {e}")
+            result = {"error": str(e)}
+        for req_id in group["ids"]:
+            outcomes[req_id] = (_overseerr_outcome(result), media_type, tmdb_id)
+    
+    conn = sqlite3.connect('watchlist_requests.db')
+    c = conn.cursor()
+    c.executemany('UPDATE requests SET overseerr_status = ?, media_type = ?, tmdb_id = COALESCE(?, tmdb_id) WHERE id = ?',
+                  [(status, media_type, tmdb_id, req_id) for req_id, (status, media_type, tmdb_id) in outcomes.items()])
+    conn.commit()
+    conn.close()
+    logging.info(f"Processed {len(queued)} queued Overseerr requests as {len(by_tmdb)} upstream requests "
+                 f"({len(by_imdb)} titles)")
+
 init_db()
 init_scheduler()
 
@@ -262,19 +611,28 @@ def dashboard():
 @app.route('/api/requests', methods=['GET'])
 def get_requests():
     user_id_filter = request.args.get('user_id') # Get user_id from query params
+    # With since_id only newer requests are returned, oldest first, for incremental sync
+    since_id = request.args.get('since_id', type=int)
     conn = sqlite3.connect('watchlist_requests.db')
     c = conn.cursor()
     
     query = 'SELECT * FROM requests'
+    conditions = []
     params = []
     if user_id_filter:
-        query += ' WHERE user_id = ?'
+        conditions.append('user_id = ?')
         params.append(user_id_filter)
-    query += ' ORDER BY created_at DESC'
+    if since_id is not None:
+        conditions.append('id > ?')
+        params.append(since_id)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY id ASC' if since_id is not None else ' ORDER BY created_at DESC'
     
     c.execute(query, params)
     
-    requests_data = [dict(zip(['id', 'imdb_id', 'title', 'image_url', 'user_id', 'status', 'created_at', 'approved_at', 'approved_by'], row)) 
+    requests_data = [dict(zip(['id', 'imdb_id', 'title', 'image_url', 'user_id', 'status', 'created_at', 'approved_at', 'approved_by',
+                               'media_type', 'tmdb_id', 'overseerr_status'], row)) 
                 for row in c.fetchall()]
     conn.close()
     return jsonify(requests_data)
@@ -297,18 +655,18 @@ def add_request():
     
     status = 'auto_approved' if auto_approve else 'pending'
     
+    # If auto-approval is enabled the Overseerr request is queued for process_overseerr_queue
     c.execute('''
-    INSERT INTO requests (imdb_id, title, image_url, user_id, status)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (data['imdb_id'], data['title'], data['image_url'], data['user_id'], status))
+    INSERT INTO requests (imdb_id, title, image_url, user_id, status, media_type, overseerr_status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (data['imdb_id'], data['title'], data['image_url'], data['user_id'], status,
+          data.get('media_type', 'movie'), 'queued' if auto_approve else None))
     
     last_id = c.lastrowid
     
-    # If auto-approval is enabled, add to Plex watchlist and request in Overseerr
+    # If auto-approval is enabled, add to Plex watchlist
     if auto_approve:
         conn.commit()  # Commit before calling external function
-        # Add this line to request media in Overseerr
-        request_media_from_overseer(data['imdb_id'], data.get('media_type', 'movie'))
         add_to_plex_watchlist(data['user_id'], data['imdb_id'])
         
     conn.commit()
@@ -338,6 +696,7 @@ def connect_to_plex(user_id):
         return None
         
     try:
+        from plexapi.myplex import MyPlexAccount
         account = MyPlexAccount(token=token)
         PLEX_ACCOUNTS[user_id] = account
         return account
@@ -434,133 +793,125 @@ def add_to_plex_watchlist(user_id, imdb_id):
             return False
         
 
-def request_media_from_overseer(imdb_id, media_type="movie", title=None):
+def _overseerr_headers(overseerr_api_key):
+    return {
+        "accept": "application/json",
+        "Content-Type": "application/json",
+        "X-Api-Key": overseerr_api_key
+    }
+
+def resolve_overseerr_media(imdb_id, media_type="movie", title=None):
     """
-    Converts an IMDb ID to media details using TMDb API, searches Overseerr by title,
-    compares the tvdbId (if media_type is "tv") and sends a request to Overseerr.
-    
-    Uses the new getimdbid service endpoint for ID conversion and Overseerr searching.
+    Converts an IMDb ID to the Overseerr media ID (the TMDB ID) through the getimdbid service,
+    falling back to the other media type when the given one has no match.
     
-    Args:
-        imdb_id (str): The IMDb ID of the media.
-        media_type (str): "movie" for movies or "tv" for TV shows (default: "movie").
-        title (str, optional): The title of the media, if known.
-        
     Returns:
-        dict: The JSON response from Overseerr or error details.
+        dict: {"overseerr_id", "media_type", "title"} or error details.
     """
-    overseerr_url = os.environ.get("OVERSEERR_URL", "http://localhost:5055")
-    overseerr_api_key = os.environ.get("OVERSEERR_API_KEY")
     getimdbid_url = os.environ.get("GETIMDBID_URL", "http://getimdbid:5331")
     
-    if not overseerr_api_key:
-        error_msg = "OVERSEERR_API_KEY not set in environment variables."
-        logging.error(error_msg)
-        return {"error": error_msg}
-    
-    # Setup headers with the API key
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json",
-        "X-Api-Key": overseerr_api_key
+    # Include title in the request payload if available
+    payload = {
+        "imdb_id": imdb_id, 
+        "media_type": media_type
     }
-
-    # Step 1: Convert IMDb ID to all media details using the new endpoint
-    try:
-        # Include title in the request payload if available
-        payload = {
-            "imdb_id": imdb_id, 
-            "media_type": media_type
-        }
-        if title:
-            payload["title"] = title
-            logging.info(f"Including title '{title}' in convert_ids request")
-            
-        r = requests.post(f"{getimdbid_url}/convert_ids", json=payload)
+    if title:
+        payload["title"] = title
+        logging.info(f"Including title '{title}' in convert_ids request")
+        
+    r = requests.post(f"{getimdbid_url}/convert_ids", json=payload)
+    r.raise_for_status()
+    media_details = r.json()
+    
+    # Use the provided title if no title returned from the API
+    title = media_details.get("title") or title
+    overseerr_id = media_details.get("overseerr_id")
+    
+    if not overseerr_id:
+        logging.warning(f"Could not find Overseerr ID for IMDb ID: {imdb_id}, trying alternative media type")
+        # Try the opposite media type as a fallback
+        alt_media_type = "tv" if media_type == "movie" else "movie"
+        r = requests.post(f"{getimdbid_url}/convert_ids", 
+                        json={"imdb_id": imdb_id, "media_type": alt_media_type, "title": title})
         r.raise_for_status()
         media_details = r.json()
-        
-        # Use the provided title if no title returned from the API
-        title = media_details.get("title") or title
-        tvdbId = media_details.get("tvdb_id", 0)
+        title = media_details.get("title") or title  # Keep original title if no new one
         overseerr_id = media_details.get("overseerr_id")
         
         if not overseerr_id:
-            logging.warning(f"Could not find Overseerr ID for IMDb ID: {imdb_id}, trying alternative media type")
-            # Try the opposite media type as a fallback
-            alt_media_type = "tv" if media_type == "movie" else "movie"
-            r = requests.post(f"{getimdbid_url}/convert_ids", 
-                            json={"imdb_id": imdb_id, "media_type": alt_media_type, "title": title})
-            r.raise_for_status()
-            media_details = r.json()
-            title = media_details.get("title") or title  # Keep original title if no new one
-            tvdbId = media_details.get("tvdb_id", 0)
-            overseerr_id = media_details.get("overseerr_id")
+            error_msg = f"Could not find Overseerr ID for IMDb ID: {imdb_id} with either media type"
+            logging.error(error_msg)
+            return {"error": error_msg}
             
-            if not overseerr_id:
-                error_msg = f"Could not find Overseerr ID for IMDb ID: {imdb_id} with either media type"
-                logging.error(error_msg)
-                return {"error": error_msg}
-                
-            # Update media_type to the one that worked
-            media_type = alt_media_type
-            logging.info(f"Successfully found with alternative media type: {alt_media_type}")
+        # Update media_type to the one that worked
+        media_type = alt_media_type
+        logging.info(f"Successfully found with alternative media type: {alt_media_type}")
+    
+    return {"overseerr_id": int(overseerr_id), "media_type": media_type, "title": title}
+
+def send_overseerr_request(overseerr_id, media_type, title=None, imdb_id=None):
+    """
+    Sends a request for an already resolved Overseerr media ID, unless the Overseerr status cache
+    shows it as covered. For TV shows all seasons except specials are requested.
+    
+    Returns:
+        dict: The JSON response from Overseerr or {"skipped": True, "reason": ...}.
         
-        # Step 2: Get seasons if it's a TV show
-        seasons = []
-        if media_type.lower() == "tv":
-            try:
-                # Get the series details to find available seasons
-                series_endpoint = f"{overseerr_url}/api/v1/tv/{overseerr_id}"
-                series_response = requests.get(series_endpoint, headers=headers)
-                series_response.raise_for_status()
-                series_data = series_response.json()
-                
-                # Extract season numbers (excluding specials season 0)
-                seasons = [season['seasonNumber'] for season in series_data.get('seasons', []) 
-                          if season.get('seasonNumber', 0) > 0]
-                
-                logging.info(f"Found {len(seasons)} seasons for '{title}': {seasons}")
-                
-                # If no seasons found or error, default to requesting all seasons with empty array
-                if not seasons:
-                    logging.warning(f"No specific seasons found for '{title}', requesting all seasons")
-            except Exception as e:
-                logging.warning(f"Error getting seasons for '{title}': {e}, requesting all seasons")
-        
-        # Build payload for Overseerr request
-        payload = {
-            "mediaType": media_type,          # "movie" or "tv"
-            "mediaId": int(overseerr_id),     # Ensure it's an integer
-        }
-        
-        # Only include seasons for TV shows AND if specific seasons are identified
-        if media_type.lower() == "tv":
-            if seasons: # Check if seasons list is not empty
-                payload["seasons"] = seasons
-            else:
-                # Log that we are requesting all seasons as none were specified
-                logging.info(f"Requesting all available seasons for TV show '{title}' (Overseerr ID: {overseerr_id}) as no specific seasons were identified or fetched.")
-        
-        # Remove optional params if not needed (some Overseerr instances require this)
-        # This line fixes 400 errors from Overseerr API
-        optional_params = ["tvdbId", "is4k", "serverId", "profileId", "rootFolder", "languageProfileId", "userId"]
-        for param in optional_params:
-            if param in payload and (payload[param] == 0 or payload[param] == "" or payload[param] == []):
-                del payload[param]
-        
-        # Send request to Overseerr
-        request_endpoint = f"{overseerr_url}/api/v1/request"
-        logging.info(f"Sending request to Overseerr for '{title}' ({media_type}) with payload: {payload}")
-        request_response = requests.post(request_endpoint, json=payload, headers=headers)
-        request_response.raise_for_status()
-        logging.info(f"Successfully sent request for media '{title}' (Overseerr mediaId: {overseerr_id})")
-        return request_response.json()
+    Raises:
+        Exception: If Overseerr rejects the request.
+    """
+    overseerr_url = os.environ.get("OVERSEERR_URL", "http://localhost:5055")
+    headers = _overseerr_headers(os.environ.get("OVERSEERR_API_KEY"))
+    
+    # Overseerr's mediaId is the TMDB ID, which keys the status cache
+    coverage = get_overseerr_coverage(overseerr_id, media_type)
+    if coverage:
+        logging.info(f"Skipping Overseerr request for '{title}' ({media_type} {overseerr_id}): already {coverage}")
+        return {"skipped": True, "reason": coverage, "mediaType": media_type, "mediaId": int(overseerr_id)}
+    
+    # Get seasons if it's a TV show
+    seasons = []
+    if media_type.lower() == "tv":
+        seasons = get_tv_seasons(overseerr_id, title)
         
-    except Exception as e:
-        error_msg = f"Error processing request for IMDb ID {imdb_id}: {e}"
-        logging.error(error_msg)
-        return {"error": error_msg}
+        # If no seasons found or error, default to requesting all seasons with empty array
+        if not seasons:
+            logging.warning(f"No specific seasons found for '{title}', requesting all seasons")
+    
+    # Build payload for Overseerr request
+    payload = {
+        "mediaType": media_type,          # "movie" or "tv"
+        "mediaId": int(overseerr_id),     # Ensure it's an integer
+    }
+    
+    # Only include seasons for TV shows AND if specific seasons are identified
+    if media_type.lower() == "tv":
+        if seasons: # Check if seasons list is not empty
+            payload["seasons"] = seasons
+        else:
+            # Log that we are requesting all seasons as none were specified
+            logging.info(f"Requesting all available seasons for TV show '{title}' (Overseerr ID: {overseerr_id}) as no specific seasons were identified or fetched.")
+    
+    # Remove optional params if not needed (some Overseerr instances require this)
+    # This line fixes 400 errors from Overseerr API
+    optional_params = ["tvdbId", "is4k", "serverId", "profileId", "rootFolder", "languageProfileId", "userId"]
+    for param in optional_params:
+        if param in payload and (payload[param] == 0 or payload[param] == "" or payload[param] == []):
+            del payload[param]
+    
+    # Send request to Overseerr
+    request_endpoint = f"{overseerr_url}/api/v1/request"
+    logging.info(f"Sending request to Overseerr for '{title}' ({media_type}) with payload: {payload}")
+    request_response = requests.post(request_endpoint, json=payload, headers=headers)
+    if request_response.status_code == 409:
+        # Requested since the last refresh, by someone else
+        mark_overseerr_requested(overseerr_id, media_type, imdb_id)
+        logging.info(f"Overseerr already has a request for '{title}' (Overseerr mediaId: {overseerr_id})")
+        return {"skipped": True, "reason": "requested", "mediaType": media_type, "mediaId": int(overseerr_id)}
+    request_response.raise_for_status()
+    mark_overseerr_requested(overseerr_id, media_type, imdb_id)
+    logging.info(f"Successfully sent request for media '{title}' (Overseerr mediaId: {overseerr_id})")
+    return request_response.json()
 
 @app.route('/api/approve/<int:request_id>', methods=['POST'])
 def approve_request(request_id):